@@ -1,48 +1,574 @@
+import asyncio
+import hmac
+import json
+import logging
+import sqlite3
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncGenerator, AsyncIterator, Optional
+
+import openai
 from grid_api import AsyncGrid
+from pydantic_core import to_json
 from starlette.applications import Starlette
 from starlette.middleware import Middleware
 from starlette.middleware.cors import CORSMiddleware
-from starlette.requests import Request
-from starlette.responses import JSONResponse
+from starlette.requests import ClientDisconnect, Request
+from starlette.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 from starlette.routing import Route
+from starlette.types import Receive, Scope, Send
 
+from .batch import BatchChatRequest, BatchResults, run_batch
+from .cache import TTLCache
 from .config import get_config
-from .grid import ProjectXRevenueModel
+from .grid import GridCalculator, ProjectXRevenueModel
+from .limits import Abandoned, AdmissionController, Overloaded, run_until_abandoned
+from .llm.encoding import SeriesEncoder
 from .llm.openai import OpenAITooledChat, create_toolbinding
-from .types import ChatRequest
+from .metrics import (
+    CHAT_ABANDONED,
+    CHAT_REQUEST_SECONDS,
+    REQUEST_PARSE_SECONDS,
+    metrics,
+    request_timings,
+    timed,
+)
+from .resilience import CircuitOpen, ResilientUpstream
+from .sessions import ChatSession, SessionStore
+from .shared_cache import SharedResultStore
+from .surrogate import RevenueSurrogate
+from .types import ChatRequest, MessageList
+from .workbooks import WorkbookRegistry
+
+logger = logging.getLogger(__name__)
+
+DEADLINE_HEADER = "X-Request-Timeout"
+
+ChatEvents = AsyncGenerator[tuple[str, dict[str, Any]], None]
 
 config = get_config()
 
-grid_client = AsyncGrid(api_key=config.GRID_API_KEY)
-project_x = ProjectXRevenueModel(grid_client)
+# Retried by the GridCalculator's ResilientUpstream instead, within each chat's deadline
+grid_client = AsyncGrid(api_key=config.GRID_API_KEY, base_url=config.GRID_API_URL, max_retries=0)
+grid_calculator = GridCalculator(
+    grid_client,
+    cache=(
+        TTLCache(config.GRID_CACHE_MAX_ENTRIES, config.GRID_CACHE_TTL_SECONDS)
+        if config.GRID_CACHE_MAX_ENTRIES > 0
+        else None
+    ),
+    max_concurrent_requests=config.GRID_MAX_CONCURRENT_REQUESTS,
+    upstream=ResilientUpstream.from_config("grid", config, hedge=True),
+    plan_reads=config.GRID_READ_PLANNING,
+    shared_cache=(
+        SharedResultStore(
+            config.GRID_SHARED_CACHE_PATH, config.GRID_SHARED_CACHE_MAX_ENTRIES, config.GRID_CACHE_TTL_SECONDS
+        )
+        if config.GRID_SHARED_CACHE_PATH
+        else None
+    ),
+)
+project_x = ProjectXRevenueModel(
+    grid_calculator,
+    sweep_concurrency=config.GRID_SWEEP_CONCURRENCY,
+    max_sweep_points=config.GRID_SWEEP_MAX_POINTS,
+    local_engine=RevenueSurrogate() if config.LOCAL_REVENUE_ENGINE else None,
+    local_engine_sample_rate=config.LOCAL_REVENUE_ENGINE_SAMPLE_RATE,
+)
+
+forecast_encoder = SeriesEncoder(
+    significant_digits=config.TOOL_OUTPUT_SIGNIFICANT_DIGITS,
+    baseline=project_x.forecast_revenue if config.TOOL_OUTPUT_DELTA_ENCODING else None,
+)
 
-openai_chat = OpenAITooledChat(
-    config,
-    tools=dict(
-        get_model_defaults=create_toolbinding(project_x.get_model_defaults),
-        forecast_revenue=create_toolbinding(project_x.forecast_revenue, name="forecast_revenue"),
+workbooks = (
+    WorkbookRegistry.from_file(config.WORKBOOK_SPECS_PATH, grid_calculator) if config.WORKBOOK_SPECS_PATH else None
+)
+
+tools = dict(
+    get_model_defaults=create_toolbinding(project_x.get_model_defaults),
+    forecast_revenue=create_toolbinding(
+        project_x.forecast_revenue, name="forecast_revenue", encoder=forecast_encoder
+    ),
+    forecast_revenue_sweep=create_toolbinding(
+        project_x.forecast_revenue_sweep,
+        encoder=SeriesEncoder(significant_digits=config.TOOL_OUTPUT_SIGNIFICANT_DIGITS),
     ),
 )
+if workbooks is not None:
+    workbook_tools = workbooks.tools()
+    if clashes := set(tools) & set(workbook_tools):
+        raise ValueError(f"Workbook specs declare tools that already exist: {sorted(clashes)}")
+    tools.update(workbook_tools)
+
+openai_chat = OpenAITooledChat(config, tools=tools)
+
+# Background calibrations of the local revenue engine
+calibrations: set[asyncio.Task] = set()
+
+sessions = SessionStore(config.CHAT_SESSIONS_MAX, config.CHAT_SESSION_TTL_SECONDS)
+
+admission = AdmissionController(
+    config.CHAT_MAX_CONCURRENCY,
+    config.CHAT_QUEUE_MAX,
+    config.CHAT_QUEUE_TIMEOUT_SECONDS,
+    retry_after=config.CHAT_RETRY_AFTER_SECONDS,
+)
+
+metrics.callback(
+    "grid_cache_hits_total",
+    "GRID calculations served from cache",
+    lambda: grid_calculator.cache_stats["hits"],
+    "counter",
+)
+metrics.callback(
+    "grid_cache_misses_total",
+    "GRID calculations not found in cache",
+    lambda: grid_calculator.cache_stats["misses"],
+    "counter",
+)
+metrics.callback(
+    "grid_cache_entries", "GRID calculations currently cached", lambda: grid_calculator.cache_stats["entries"]
+)
+metrics.callback(
+    "grid_coalesced_calls_total",
+    "GRID calculations that joined an identical in-flight request",
+    lambda: grid_calculator.coalesced_calls,
+    "counter",
+)
+metrics.callback(
+    "grid_shared_cache_hits_total",
+    "GRID calculations served from the cache shared between workers",
+    lambda: grid_calculator.shared_cache_stats["hits"],
+    "counter",
+)
+metrics.callback(
+    "grid_shared_cache_misses_total",
+    "GRID calculations not found in the cache shared between workers",
+    lambda: grid_calculator.shared_cache_stats["misses"],
+    "counter",
+)
+metrics.callback("chat_sessions", "Server-side chat sessions currently stored", lambda: len(sessions))
+metrics.callback(
+    "openai_response_cache_hits_total",
+    "Chat replies served from the reply cache",
+    lambda: openai_chat.response_cache.hits if openai_chat.response_cache is not None else 0,
+    "counter",
+)
+metrics.callback(
+    "openai_response_cache_misses_total",
+    "Chat replies not found in the reply cache",
+    lambda: openai_chat.response_cache.misses if openai_chat.response_cache is not None else 0,
+    "counter",
+)
+metrics.callback("chat_active", "Chat requests currently being handled", lambda: admission.active)
+metrics.callback("chat_queued", "Chat requests waiting for a slot", lambda: admission.waiting)
+metrics.callback(
+    "chat_rejected_total", "Chat requests rejected as overloaded", lambda: admission.rejected, "counter"
+)
+
+
+class FastJSONResponse(JSONResponse):
+    """A JSONResponse rendered with pydantic's serializer, several times quicker than the json module"""
+
+    def render(self, content: Any) -> bytes:
+        return to_json(content)
+
+
+def get_session(chat_request: ChatRequest) -> Optional[ChatSession]:
+    """
+    The server-side session a request continues or starts, if any.
+    Raises KeyError if the request continues a session we don't have (any more).
+    """
+    if chat_request.session_id is not None:
+        session = sessions.get(chat_request.session_id)
+        if session is None:
+            raise KeyError(chat_request.session_id)
+        return session
+    if chat_request.start_session:
+        return sessions.create()
+    return None
+
+
+def unknown_session_response(chat_request: ChatRequest) -> JSONResponse:
+    return JSONResponse(
+        {
+            "error": "Unknown or expired session",
+            "details": f"Session {chat_request.session_id} not found, resend the full conversation",
+        },
+        status_code=404,
+    )
+
+
+def overloaded_response(e: Overloaded) -> JSONResponse:
+    return JSONResponse(
+        {"error": "Overloaded", "details": "Too many chats in progress, try again shortly"},
+        status_code=503,
+        headers={"Retry-After": str(round(e.retry_after))},
+    )
+
+
+def unavailable_response(e: CircuitOpen) -> JSONResponse:
+    return JSONResponse(
+        {"error": "Upstream unavailable", "details": str(e)},
+        status_code=503,
+        headers={"Retry-After": str(max(1, round(e.retry_after)))},
+    )
+
+
+def upstream_error_response(e: openai.APIError) -> JSONResponse:
+    # Still failing after ResilientUpstream's retries, or not worth retrying
+    logger.error(f"OpenAI request failed: {e!r}")
+    return JSONResponse({"error": "Upstream error", "details": str(e)}, status_code=502)
+
+
+class AdmittedStreamingResponse(StreamingResponse):
+    """A streaming response that gives up its admission slot once it's done, however the stream ends"""
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            admission.release()
+
+
+async def parse_chat_request(request: Request) -> ChatRequest:
+    with timed(REQUEST_PARSE_SECONDS, "parse"):
+        # Validated straight from the raw body, without building an intermediate dict first
+        return ChatRequest.model_validate_json(await request.body())
+
+
+def request_deadline(request: Request) -> float:
+    """
+    The time.monotonic() by which a chat request must be done. Clients can shorten the configured deadline with
+    the X-Request-Timeout header, in seconds, but not extend it.
+    """
+    seconds = config.CHAT_DEADLINE_SECONDS
+    requested = request.headers.get(DEADLINE_HEADER)
+    if requested is not None:
+        try:
+            seconds = min(seconds, float(requested))
+        except ValueError:
+            logger.debug(f"Ignoring invalid {DEADLINE_HEADER} header: {requested!r}")
+    return time.monotonic() + seconds
+
+
+async def wait_for_disconnect(request: Request) -> None:
+    # Only once the body has been read, from then on the only message left to receive is the disconnect
+    while (await request.receive())["type"] != "http.disconnect":
+        pass
+
+
+def abandoned_response(e: Abandoned) -> Response:
+    CHAT_ABANDONED.inc(reason=e.reason)
+    if e.reason == "deadline":
+        return JSONResponse(
+            {"error": "Deadline exceeded", "details": "The chat took longer than the request's deadline"},
+            status_code=504,
+        )
+    # Nobody is listening any more, but the status still shows up in access logs
+    return Response(status_code=499)
 
 
 async def chat(request: Request):
+    deadline_at = request_deadline(request)
+    with request_timings() as timings, timed(CHAT_REQUEST_SECONDS, "total", endpoint="chat"):
+        try:
+            response = await run_chat(request, deadline_at)
+        except Overloaded as e:
+            response = overloaded_response(e)
+        except Abandoned as e:
+            response = abandoned_response(e)
+        except CircuitOpen as e:
+            response = unavailable_response(e)
+        except openai.APIError as e:
+            response = upstream_error_response(e)
+    if config.METRICS_TIMING_HEADER:
+        response.headers["Server-Timing"] = timings.server_timing()
+    return response
+
+
+async def run_chat(request: Request, deadline_at: float) -> Response:
+    try:
+        await request.body()
+    except ClientDisconnect:
+        raise Abandoned("disconnect") from None
+    disconnected = asyncio.ensure_future(wait_for_disconnect(request))
     try:
-        payload = await request.json()
-        chat_request = ChatRequest(**payload)
+        return await run_until_abandoned(admit_chat(request), disconnected, deadline_at)
+    finally:
+        disconnected.cancel()
+
+
+async def admit_chat(request: Request) -> Response:
+    async with admission.admit():
+        return await handle_chat(request)
+
+
+async def handle_chat(request: Request) -> Response:
+    try:
+        chat_request = await parse_chat_request(request)
+    except Exception as e:
+        return JSONResponse({"error": "Invalid request payload", "details": str(e)}, status_code=400)
+
+    try:
+        session = get_session(chat_request)
+    except KeyError:
+        return unknown_session_response(chat_request)
+
+    if session is None:
+        messages = chat_request.messages
+
+        response = await openai_chat.create_response(messages)
+
+        return FastJSONResponse({"reply": response.content, "role": response.role})
+
+    async with session.lock:
+        with session.rollback_on_error():
+            session.messages.extend(chat_request.messages)
+            response = await openai_chat.create_response(session.messages, session)
+        sessions.save(session)
+
+    return FastJSONResponse({"reply": response.content, "role": response.role, "session_id": session.session_id})
+
+
+async def format_sse(events: AsyncIterator[tuple[str, dict[str, Any]]]) -> AsyncIterator[str]:
+    async for event, data in events:
+        yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def stream_session_response(session: ChatSession, messages: MessageList) -> ChatEvents:
+    async with session.lock:
+        with session.rollback_on_error():
+            session.messages.extend(messages)
+            async for event, data in openai_chat.stream_response(session.messages, session):
+                if event == "done":
+                    data = {**data, "session_id": session.session_id}
+                yield event, data
+        sessions.save(session)
+
+
+async def next_event(events: ChatEvents) -> Optional[tuple[str, dict[str, Any]]]:
+    async for event in events:
+        return event
+    return None
+
+
+async def stream_until_abandoned(request: Request, events: ChatEvents, deadline_at: float) -> ChatEvents:
+    """
+    Pass events through until the client disconnects or the deadline expires, cancelling whatever is producing
+    them at that point. An expired deadline, or an unavailable or failing upstream, is reported with a final
+    "error" event.
+    """
+    disconnected = asyncio.ensure_future(wait_for_disconnect(request))
+    try:
+        with timed(CHAT_REQUEST_SECONDS, "total", endpoint="stream"):
+            while True:
+                event = await run_until_abandoned(next_event(events), disconnected, deadline_at)
+                if event is None:
+                    return
+                yield event
+    except Abandoned as e:
+        CHAT_ABANDONED.inc(reason=e.reason)
+        if e.reason == "deadline":
+            yield "error", {"error": "Deadline exceeded"}
+    except CircuitOpen as e:
+        yield "error", {"error": "Upstream unavailable", "details": str(e)}
+    except openai.APIError as e:
+        logger.error(f"OpenAI request failed: {e!r}")
+        yield "error", {"error": "Upstream error", "details": str(e)}
+    finally:
+        disconnected.cancel()
+        await events.aclose()
+
+
+async def chat_stream(request: Request):
+    """
+    Like /chat, but streams the reply back as server-sent events: text deltas as they're generated, a progress
+    event for each tool call, and a final "done" event with the complete reply.
+    """
+    deadline_at = request_deadline(request)
+    try:
+        chat_request = await parse_chat_request(request)
+    except ClientDisconnect:
+        return abandoned_response(Abandoned("disconnect"))
     except Exception as e:
         return JSONResponse({"error": "Invalid request payload", "details": str(e)}, status_code=400)
 
-    messages = chat_request.messages
+    try:
+        session = get_session(chat_request)
+    except KeyError:
+        return unknown_session_response(chat_request)
 
-    response = await openai_chat.create_response(messages)
+    try:
+        await admission.acquire()
+    except Overloaded as e:
+        return overloaded_response(e)
 
-    return JSONResponse({"reply": response.content, "role": response.role})
+    if session is None:
+        events = openai_chat.stream_response(chat_request.messages)
+    else:
+        events = stream_session_response(session, chat_request.messages)
+
+    return AdmittedStreamingResponse(
+        format_sse(stream_until_abandoned(request, events, deadline_at)),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def format_ndjson(results: BatchResults) -> AsyncIterator[bytes]:
+    try:
+        async for result in results:
+            yield to_json(result) + b"\n"
+    finally:
+        # Cancels the chats still running when the client goes away
+        await results.aclose()
+
+
+async def chat_batch(request: Request):
+    """
+    Run many chat requests at once, for offline evaluation runs, streaming back a line of NDJSON for each as it
+    completes, see backend.batch.run_batch. Sessions aren't supported, each request holds a whole conversation.
+    """
+    try:
+        batch = BatchChatRequest.model_validate_json(await request.body())
+    except ClientDisconnect:
+        return abandoned_response(Abandoned("disconnect"))
+    except Exception as e:
+        return JSONResponse({"error": "Invalid request payload", "details": str(e)}, status_code=400)
+    if len(batch.requests) > config.CHAT_BATCH_MAX_REQUESTS:
+        return JSONResponse(
+            {
+                "error": "Invalid request payload",
+                "details": f"At most {config.CHAT_BATCH_MAX_REQUESTS} requests per batch",
+            },
+            status_code=400,
+        )
+
+    max_concurrency = min(
+        batch.max_concurrency or config.CHAT_BATCH_MAX_CONCURRENCY, config.CHAT_BATCH_MAX_CONCURRENCY
+    )
+    # Each of the batch's chats is admitted on its own, alongside those sent to /chat
+    results = run_batch(openai_chat, batch.requests, max_concurrency, config.CHAT_DEADLINE_SECONDS, admission)
+    return StreamingResponse(format_ndjson(results), media_type="application/x-ndjson")
+
+
+async def metrics_endpoint(request: Request):
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+def admin_error_response(request: Request) -> Optional[JSONResponse]:
+    """An error response unless the request carries the admin token, admin endpoints are hidden without one"""
+    if config.ADMIN_TOKEN is None:
+        return JSONResponse({"error": "Not found"}, status_code=404)
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(token.encode(), config.ADMIN_TOKEN.encode()):
+        return JSONResponse({"error": "Unauthorized"}, status_code=401, headers={"WWW-Authenticate": "Bearer"})
+    return None
+
+
+async def invalidate_workbook(request: Request):
+    """Drop cached calculations for a workbook, to be called whenever it's republished. Needs the admin token."""
+    error = admin_error_response(request)
+    if error is not None:
+        return error
+    workbook_id = request.path_params["workbook_id"]
+    invalidated = await grid_calculator.invalidate_shared(workbook_id)
+    changed = {workbook_id}
+    if grid_calculator.shared_cache is not None:
+        # Including this invalidation, so that watch_workbook_versions() doesn't go through it all again
+        changed.update(await grid_calculator.shared_cache.changed_workbooks())
+    for changed_id in changed:
+        invalidate_locally(changed_id)
+    return JSONResponse({"invalidated": invalidated})
+
+
+def invalidate_locally(workbook_id: str) -> None:
+    """Drop everything this worker holds that was based on a workbook's old results"""
+    grid_calculator.invalidate(workbook_id)
+    openai_chat.invalidate_response_cache()
+    if config.LOCAL_REVENUE_ENGINE and workbook_id == project_x.workbook_id:
+        # The local engine was verified against the old workbook, so it has to be again
+        project_x.reset_local_engine()
+        start_local_engine_calibration()
+
+
+async def watch_workbook_versions(shared_cache: SharedResultStore, interval_seconds: float) -> None:
+    """Invalidate what this worker holds for workbooks that other workers have invalidated in the shared cache"""
+    while True:
+        try:
+            for workbook_id in await shared_cache.changed_workbooks():
+                logger.info(f"Workbook {workbook_id} was invalidated by another worker")
+                invalidate_locally(workbook_id)
+        except sqlite3.Error:
+            logger.exception("Failed to check the shared cache for invalidated workbooks")
+        await asyncio.sleep(interval_seconds)
+
+
+def _log_calibration_result(task: asyncio.Task) -> None:
+    if task.cancelled():
+        return
+    if task.exception() is not None:
+        logger.error("Failed to calibrate the local revenue engine, using GRID", exc_info=task.exception())
+    elif not task.result():
+        logger.warning("Local revenue engine doesn't match GRID within tolerance, using GRID")
+
+
+def start_local_engine_calibration() -> None:
+    """
+    Calibrate in the background, forecasts are served by GRID until the local engine has been verified. Any
+    calibration still running is cancelled, as it's against what may be an older version of the workbook.
+    """
+    for task in calibrations:
+        task.cancel()
+    calibration = asyncio.create_task(project_x.calibrate_local_engine(config.LOCAL_REVENUE_ENGINE_TOLERANCE))
+    calibration.add_done_callback(_log_calibration_result)
+    calibrations.add(calibration)
+    calibration.add_done_callback(calibrations.discard)
+
+
+@asynccontextmanager
+async def lifespan(app: Starlette):
+    if config.LOCAL_REVENUE_ENGINE:
+        start_local_engine_calibration()
+    if workbooks is not None:
+        # Also in the background, any workbook that isn't warm by the time it's used is calculated on demand
+        warming = asyncio.create_task(workbooks.warm())
+    if grid_calculator.shared_cache is not None:
+        watching = asyncio.create_task(
+            watch_workbook_versions(grid_calculator.shared_cache, config.GRID_SHARED_CACHE_POLL_SECONDS)
+        )
+    yield
+    if grid_calculator.shared_cache is not None:
+        watching.cancel()
+    if workbooks is not None:
+        warming.cancel()
+    for task in calibrations:
+        task.cancel()
+    await openai_chat.aclose()
+    await grid_client.close()
+    if grid_calculator.shared_cache is not None:
+        grid_calculator.shared_cache.close()
 
 
 app = Starlette(
     debug=True,
+    lifespan=lifespan,
     routes=[
         Route("/chat", chat, methods=["POST"]),
+        Route("/chat/stream", chat_stream, methods=["POST"]),
+        Route("/chat/batch", chat_batch, methods=["POST"]),
+        Route("/workbooks/{workbook_id}/invalidate", invalidate_workbook, methods=["POST"]),
+        Route("/metrics", metrics_endpoint, methods=["GET"]),
+    ],
+    middleware=[
+        Middleware(
+            CORSMiddleware,
+            allow_origins=["*"],
+            allow_methods=["*"],
+            allow_headers=[DEADLINE_HEADER],
+            expose_headers=["Server-Timing"],
+        )
     ],
-    middleware=[Middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"])],
 )
@@ -0,0 +1,125 @@
+"""
+Batches of chat requests, for offline evaluation runs replaying many scripted conversations at once.
+
+Served at /chat/batch, or run from the command line with one ChatRequest per line of a JSON lines file:
+
+    python -m backend.batch conversations.jsonl > results.jsonl
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import sys
+import time
+from contextlib import nullcontext
+from typing import Any, AsyncGenerator, Optional, Sequence
+
+from pydantic import BaseModel, Field
+
+from .limits import AdmissionController, Overloaded, deadline
+from .llm.openai import OpenAITooledChat
+from .metrics import CHAT_REQUEST_SECONDS, timed
+from .types import ChatRequest
+
+logger = logging.getLogger(__name__)
+
+BatchResults = AsyncGenerator[dict[str, Any], None]
+
+
+class BatchChatRequest(BaseModel):
+    requests: list[ChatRequest]
+    # Chats run at once, capped by CHAT_BATCH_MAX_CONCURRENCY
+    max_concurrency: Optional[int] = Field(None, ge=1)
+
+
+async def run_batch(
+    chat: OpenAITooledChat,
+    requests: Sequence[ChatRequest],
+    max_concurrency: int,
+    timeout_seconds: float,
+    admission: Optional[AdmissionController] = None,
+) -> BatchResults:
+    """
+    Run chat requests concurrently, at most max_concurrency at once, yielding a result for each as it completes:
+    {"index": ..., "reply": ..., "role": ...}, or {"index": ..., "error": ...} for those that failed, where
+    index is the request's position in requests.
+
+    The chats share the chat's tools, so the GRID result cache and in-flight calculations too: conversations
+    with the same tool calls only calculate them once. Each chat gets timeout_seconds, and a failed chat doesn't
+    fail the batch. Closing the results cancels the chats still running.
+
+    With admission, every chat is admitted just like one sent to /chat, so a batch can't take more than its
+    share while the server is busy: a chat that can't be admitted fails with an Overloaded error.
+    """
+    results: asyncio.Queue[dict[str, Any]] = asyncio.Queue()
+    pending = iter(enumerate(requests))
+
+    async def worker() -> None:
+        for index, chat_request in pending:
+            results.put_nowait(await _run_chat(chat, index, chat_request, timeout_seconds, admission))
+
+    workers = [asyncio.create_task(worker()) for _ in range(min(max_concurrency, len(requests)))]
+    try:
+        for _ in range(len(requests)):
+            yield await results.get()
+    finally:
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+
+async def _run_chat(
+    chat: OpenAITooledChat,
+    index: int,
+    chat_request: ChatRequest,
+    timeout_seconds: float,
+    admission: Optional[AdmissionController],
+) -> dict[str, Any]:
+    if chat_request.session_id is not None or chat_request.start_session:
+        return {"index": index, "error": "Sessions aren't supported in batches, send each conversation in full"}
+    try:
+        with timed(CHAT_REQUEST_SECONDS, "total", endpoint="batch"), deadline(time.monotonic() + timeout_seconds):
+            async with asyncio.timeout(timeout_seconds), admission.admit() if admission else nullcontext():
+                message = await chat.create_response(chat_request.messages)
+    except TimeoutError:
+        return {"index": index, "error": "Deadline exceeded"}
+    except Overloaded as e:
+        return {"index": index, "error": "Overloaded", "retry_after": e.retry_after}
+    except Exception as e:
+        logger.exception(f"Chat {index} of batch failed")
+        return {"index": index, "error": str(e) or type(e).__name__}
+    return {"index": index, "reply": message.content, "role": message.role}
+
+
+async def _main(path: str, max_concurrency: Optional[int]) -> None:
+    # Imported here, the app builds its tools and clients from the environment
+    from .app import config, grid_client, openai_chat
+
+    with open(path, "rb") as f:
+        requests = [ChatRequest.model_validate_json(line) for line in f if line.strip()]
+    results = run_batch(
+        openai_chat,
+        requests,
+        max_concurrency or config.CHAT_BATCH_MAX_CONCURRENCY,
+        config.CHAT_DEADLINE_SECONDS,
+    )
+    try:
+        async for result in results:
+            sys.stdout.write(json.dumps(result) + "\n")
+            sys.stdout.flush()
+    finally:
+        await openai_chat.aclose()
+        await grid_client.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", help="a JSON lines file of chat requests")
+    parser.add_argument("--max-concurrency", type=int, help="chats run at once")
+    args = parser.parse_args()
+    asyncio.run(_main(args.path, args.max_concurrency))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,7 @@
 import os
-from dataclasses import dataclass
+import types
+from dataclasses import dataclass, fields
+from typing import Any, Union, get_args, get_origin
 
 
 @dataclass(frozen=True)
@@ -7,14 +9,132 @@ class AppConfig:
     OPENAI_API_KEY: str
     GRID_API_KEY: str
     GRID_API_URL: str | None = None
+    OPENAI_BASE_URL: str | None = None
+
+    # Connection pool and timeouts for the long-lived AsyncOpenAI client
+    OPENAI_MAX_CONNECTIONS: int = 100
+    OPENAI_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    OPENAI_KEEPALIVE_EXPIRY_SECONDS: float = 30.0
+    OPENAI_CONNECT_TIMEOUT_SECONDS: float = 5.0
+    OPENAI_TIMEOUT_SECONDS: float = 60.0
+
+    # Limits on concurrent upstream requests, shared by all chats. Further requests wait for a slot.
+    OPENAI_MAX_CONCURRENT_REQUESTS: int = 64
+    GRID_MAX_CONCURRENT_REQUESTS: int = 32
+
+    # Retries of calls to OpenAI and GRID after transient errors, with jittered exponential backoff, never past the
+    # request's deadline. The clients' own retries are disabled in favour of these.
+    UPSTREAM_MAX_ATTEMPTS: int = 3
+    UPSTREAM_RETRY_BASE_DELAY_SECONDS: float = 0.2
+    UPSTREAM_RETRY_MAX_DELAY_SECONDS: float = 2.0
+
+    # Consecutive failures after which calls to an upstream fail fast, for a while (0 disables circuit breaking)
+    CIRCUIT_BREAKER_FAILURES: int = 5
+    CIRCUIT_BREAKER_RESET_SECONDS: float = 30.0
+
+    # Send a duplicate GRID calculation once one has taken longer than this percentile of recent ones, e.g. 95
+    # (0 disables hedging)
+    GRID_HEDGE_PERCENTILE: float = 0.0
+
+    # Admission control in front of /chat, /chat/stream and each chat of a /chat/batch: chats handled at once,
+    # chats allowed to queue for a slot, and how long they may wait. Beyond that they're rejected with a 503 and
+    # this Retry-After.
+    CHAT_MAX_CONCURRENCY: int = 64
+    CHAT_QUEUE_MAX: int = 128
+    CHAT_QUEUE_TIMEOUT_SECONDS: float = 10.0
+    CHAT_RETRY_AFTER_SECONDS: int = 1
+
+    # The most time a chat request may take, clients can ask for less with an X-Request-Timeout header (seconds).
+    # Work for a request is cancelled once its deadline expires, or its client disconnects.
+    CHAT_DEADLINE_SECONDS: float = 120.0
+
+    # /chat/batch: chats run at once per batch (each chat still gets CHAT_DEADLINE_SECONDS), and chats per batch.
+    # Every chat of a batch is admitted on its own, like any other.
+    CHAT_BATCH_MAX_CONCURRENCY: int = 16
+    CHAT_BATCH_MAX_REQUESTS: int = 10000
+
+    # Tool calling: rounds of tool calls allowed per chat, and the default limit on concurrent calls per tool
+    OPENAI_MAX_TOOL_ROUNDS: int = 5
+    TOOL_MAX_CONCURRENCY: int = 8
+
+    # Tools to call with their default arguments while the first OpenAI request of a turn is in flight, in case
+    # the model asks for them, comma separated (e.g. "get_model_defaults,forecast_revenue"). Only for tools
+    # without side effects. Calls it doesn't ask for are cancelled, and at most so many run at once.
+    OPENAI_SPECULATIVE_TOOLS: str = ""
+    OPENAI_SPECULATION_MAX_IN_FLIGHT: int = 16
+
+    # In-process cache of GRID workbook calculations, set GRID_CACHE_MAX_ENTRIES to 0 to disable it
+    GRID_CACHE_MAX_ENTRIES: int = 4096
+    GRID_CACHE_TTL_SECONDS: float = 3600.0
+    # Merge adjacent cells and ranges read from a workbook into fewer, larger ranges, see backend.grid.ReadPlan
+    GRID_READ_PLANNING: bool = True
+
+    # A SQLite database of GRID calculations shared by all worker processes on the host, checked behind the
+    # in-process cache. Off unless given a path.
+    GRID_SHARED_CACHE_PATH: str | None = None
+    GRID_SHARED_CACHE_MAX_ENTRIES: int = 100000
+    # How often each worker checks it for workbooks invalidated by another, to drop what it has cached for them
+    GRID_SHARED_CACHE_POLL_SECONDS: float = 1.0
+
+    # Sensitivity sweeps: concurrent GRID calculations per sweep, and the most points a single sweep may evaluate
+    GRID_SWEEP_CONCURRENCY: int = 8
+    GRID_SWEEP_MAX_POINTS: int = 100
+
+    # A JSON file of specs for further spreadsheet models to expose as tools, see backend.workbooks.WorkbookSpec
+    WORKBOOK_SPECS_PATH: str | None = None
+
+    # Serve revenue forecasts from the in-process engine, once it has been verified against GRID within tolerance
+    LOCAL_REVENUE_ENGINE: bool = False
+    LOCAL_REVENUE_ENGINE_TOLERANCE: float = 1e-3
+    # The fraction of local forecasts checked against GRID afterwards, the engine is no longer used once one's off
+    LOCAL_REVENUE_ENGINE_SAMPLE_RATE: float = 0.01
+
+    # Server-side chat sessions, optionally chained onto OpenAI's stored previous response
+    CHAT_SESSIONS_MAX: int = 10000
+    CHAT_SESSION_TTL_SECONDS: float = 3600.0
+    OPENAI_CHAIN_RESPONSES: bool = True
+
+    # Token budget for the history sent to OpenAI in full, older turns are compacted beyond it (0 disables this)
+    OPENAI_HISTORY_MAX_TOKENS: int = 16000
+    OPENAI_HISTORY_KEEP_RECENT_TURNS: int = 4
+
+    # Cache of replies to whole conversations, for common opening questions. Off unless given a size.
+    OPENAI_RESPONSE_CACHE_MAX_ENTRIES: int = 0
+    OPENAI_RESPONSE_CACHE_TTL_SECONDS: float = 600.0
+
+    # Encoding of forecast tool outputs sent back to the LLM, see backend.llm.encoding.SeriesEncoder
+    TOOL_OUTPUT_SIGNIFICANT_DIGITS: int = 4
+    TOOL_OUTPUT_DELTA_ENCODING: bool = False
+
+    # Bearer token required by admin endpoints, like /workbooks/{id}/invalidate, which aren't served without one
+    ADMIN_TOKEN: str | None = None
+
+    # Add a Server-Timing header breaking down where each /chat request spent its time
+    METRICS_TIMING_HEADER: bool = False
+
+
+def _parse_env_value(value: str, field_type: Any) -> Any:
+    # Optional fields (e.g. `str | None`) are parsed as their non-None type
+    if get_origin(field_type) in (Union, types.UnionType):
+        field_type = next(arg for arg in get_args(field_type) if arg is not type(None))
+    if field_type is bool:
+        return value.strip().lower() in ("1", "true", "yes", "on")
+    return field_type(value)
 
 
 def get_config() -> AppConfig:
     try:
-        return AppConfig(
+        required: dict[str, Any] = dict(
             OPENAI_API_KEY=os.environ["OPENAI_API_KEY"],
             GRID_API_KEY=os.environ["GRID_API_KEY"],
-            GRID_API_URL=os.environ.get("GRID_API_URL"),
         )
     except KeyError as e:
         raise KeyError(f"Missing environment variable: {e}") from e
+
+    # Everything else is optional, falling back to the defaults on AppConfig
+    optional = {
+        field.name: _parse_env_value(os.environ[field.name], field.type)
+        for field in fields(AppConfig)
+        if field.name not in required and field.name in os.environ
+    }
+    return AppConfig(**required, **optional)
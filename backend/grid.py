@@ -1,20 +1,452 @@
+import asyncio
+import contextvars
 import logging
-from typing import Any, Optional
+import random
+import re
+import sqlite3
+from contextlib import nullcontext
+from dataclasses import dataclass, replace
+from functools import lru_cache
+from typing import Any, Literal, Optional, cast
 
-from grid_api import AsyncGrid
+from grid_api import NOT_GIVEN, AsyncGrid
+from grid_api.types import WorkbookCalcResponse
+from grid_api.types.workbook_calc_response import WorkbookCalcResponseItemReadValue
+
+from .cache import TTLCache
+from .limits import current_deadline, remaining_seconds
+from .metrics import GRID_CALC_SECONDS, timed
+from .resilience import ResilientUpstream
+from .shared_cache import SharedResultStore
+from .surrogate import RevenueSurrogate
 
 logger = logging.getLogger(__name__)
 
+CellValue = str | int | float | bool | None
+ModelParameter = Literal[
+    "ad_budget",
+    "ad_cpc",
+    "registration_conversion_rate",
+    "subscription_conversion_rate",
+    "registration_conversion_lag_in_months",
+    "subscription_conversion_lag_in_months",
+    "churn_rate",
+    "customer_lifetime_length_in_months",
+    "virality_per_registered_user",
+    "virality_per_subscribed_user",
+    "subscription_price",
+]
+CalcKey = tuple[str, tuple[tuple[str, str, CellValue], ...], tuple[str, ...]]
+
 
 class GRIDExecutionException(Exception):
     pass
 
 
+def _normalize_cell_value(value: CellValue) -> tuple[str, CellValue]:
+    # 10 and 10.0 calculate the same thing, so they should share a cache entry, but True == 1 in python and
+    # they don't calculate the same thing, so values are tagged with their kind
+    if isinstance(value, bool) or value is None:
+        return type(value).__name__, value
+    if isinstance(value, (int, float)):
+        return "number", float(value)
+    return "string", value
+
+
+def calc_cache_key(workbook_id: str, read: list[str], apply: Optional[dict[str, CellValue]] = None) -> CalcKey:
+    """A hashable key identifying a workbook calculation, independent of the order of reads and applied values"""
+    return (
+        workbook_id,
+        tuple(sorted((ref, *_normalize_cell_value(value)) for ref, value in (apply or {}).items())),
+        tuple(sorted(read)),
+    )
+
+
+_REFERENCE = re.compile(
+    r"^(?:(?P<sheet>[^!]+)!)?\$?(?P<left>[A-Z]+)\$?(?P<top>[0-9]+)(?::\$?(?P<right>[A-Z]+)\$?(?P<bottom>[0-9]+))?$"
+)
+
+
+def _column_number(column: str) -> int:
+    number = 0
+    for char in column:
+        number = number * 26 + ord(char) - ord("A") + 1
+    return number
+
+
+def _column_name(number: int) -> str:
+    name = ""
+    while number > 0:
+        number, remainder = divmod(number - 1, 26)
+        name = chr(ord("A") + remainder) + name
+    return name
+
+
+@dataclass(frozen=True)
+class CellRange:
+    """A rectangle of cells on a sheet, with 1-based columns and rows, all inclusive"""
+
+    sheet: Optional[str]
+    left: int
+    top: int
+    right: int
+    bottom: int
+
+    @classmethod
+    def parse(cls, reference: str) -> Optional["CellRange"]:
+        """The range a reference like "B4", "Sheet1!C39:AL41" refers to, None for any other kind of reference"""
+        match = _REFERENCE.match(reference)
+        if match is None:
+            return None
+        left, top = _column_number(match["left"]), int(match["top"])
+        right = _column_number(match["right"]) if match["right"] else left
+        bottom = int(match["bottom"]) if match["bottom"] else top
+        if right < left or bottom < top:
+            return None
+        return cls(match["sheet"], left, top, right, bottom)
+
+    @property
+    def width(self) -> int:
+        return self.right - self.left + 1
+
+    @property
+    def height(self) -> int:
+        return self.bottom - self.top + 1
+
+    def __str__(self) -> str:
+        reference = f"{_column_name(self.left)}{self.top}"
+        if self.width > 1 or self.height > 1:
+            reference += f":{_column_name(self.right)}{self.bottom}"
+        return reference if self.sheet is None else f"{self.sheet}!{reference}"
+
+
+def _merge_ranges(ranges: set[CellRange]) -> list[CellRange]:
+    # Alternately stack ranges spanning the same columns on consecutive rows, and join ranges spanning the same
+    # rows on consecutive columns, until nothing more can be merged
+    merged = sorted(ranges, key=lambda r: (r.sheet or "", r.left, r.right, r.top))
+    while True:
+        count = len(merged)
+        for vertical in (True, False):
+            if vertical:
+                merged.sort(key=lambda r: (r.sheet or "", r.left, r.right, r.top))
+            else:
+                merged.sort(key=lambda r: (r.sheet or "", r.top, r.bottom, r.left))
+            result: list[CellRange] = []
+            for cell_range in merged:
+                previous = result[-1] if result else None
+                if previous is not None and previous.sheet == cell_range.sheet:
+                    if vertical and (previous.left, previous.right, previous.bottom + 1) == (
+                        cell_range.left,
+                        cell_range.right,
+                        cell_range.top,
+                    ):
+                        result[-1] = replace(previous, bottom=cell_range.bottom)
+                        continue
+                    if not vertical and (previous.top, previous.bottom, previous.right + 1) == (
+                        cell_range.top,
+                        cell_range.bottom,
+                        cell_range.left,
+                    ):
+                        result[-1] = replace(previous, right=cell_range.right)
+                        continue
+                result.append(cell_range)
+            merged = result
+        if len(merged) == count:
+            return merged
+
+
+@dataclass(frozen=True)
+class _Slice:
+    source: str
+    whole: bool
+    row: int
+    column: int
+    source_range: CellRange
+    cell_range: CellRange
+
+
+class ReadPlan:
+    """
+    Reads merged into as few rectangular ranges as possible, e.g. the rows C39:AL39, C40:AL40 and C41:AL41 into a
+    single read of C39:AL41, and the cells B4 and B5 into B4:B5, to send GRID smaller requests with fewer results.
+    extract() slices the results for the original reads back out of the merged results.
+
+    GRID returns a range as a list of its cells in row order, so a read spanning whole rows of a merged range
+    is a plain slice of that list, and a single cell an index into it: the cells aren't copied or rebuilt. That
+    order is checked on every merged result, by the offsets of its first and last cells and the first cell of its
+    second row, so a result in any other order is never sliced up wrongly.
+    """
+
+    def __init__(self, reads: tuple[str, ...]):
+        ranges = {reference: CellRange.parse(reference) for reference in reads}
+        merged = _merge_ranges({r for r in ranges.values() if r is not None})
+        # References the planner doesn't understand, e.g. named ranges, are read as they are
+        self._unplanned = [reference for reference, r in ranges.items() if r is None]
+        # Ranges left as they were are read by their original reference
+        names = {cell_range: reference for reference, cell_range in ranges.items() if cell_range is not None}
+        self.reads = [names.get(r, str(r)) for r in merged] + self._unplanned
+        self._slices: dict[str, _Slice] = {}
+        for reference, cell_range in ranges.items():
+            if cell_range is None:
+                continue
+            source = next(
+                m
+                for m in merged
+                if m.sheet == cell_range.sheet
+                and m.left <= cell_range.left
+                and m.top <= cell_range.top
+                and cell_range.right <= m.right
+                and cell_range.bottom <= m.bottom
+            )
+            self._slices[reference] = _Slice(
+                names.get(source, str(source)),
+                source == cell_range,
+                cell_range.top - source.top,
+                cell_range.left - source.left,
+                source,
+                cell_range,
+            )
+
+    @property
+    def merges(self) -> bool:
+        """Whether any reads were merged, otherwise the plan reads just what was asked for"""
+        return not all(piece.whole for piece in self._slices.values())
+
+    def extract(self, results: WorkbookCalcResponse) -> WorkbookCalcResponse:
+        """
+        The results for the original reads, from the results of the merged reads. Raises ValueError if the
+        results aren't shaped as the merged reads should be.
+        """
+        extracted: WorkbookCalcResponse = {reference: results[reference] for reference in self._unplanned}
+        checked: set[str] = set()
+        for reference, piece in self._slices.items():
+            result = results[piece.source]
+            if piece.whole:
+                extracted[reference] = result
+                continue
+            source_width = piece.source_range.width
+            if piece.source not in checked:
+                _check_row_order(result, piece.source_range)
+                checked.add(piece.source)
+            assert isinstance(result, list)
+            start = piece.row * source_width + piece.column
+            cell_range = piece.cell_range
+            if cell_range.width == 1 and cell_range.height == 1:
+                # The same fields as a single cell read's result, just another model class
+                extracted[reference] = cast(WorkbookCalcResponseItemReadValue, result[start])
+            elif cell_range.width == source_width:
+                extracted[reference] = result[start : start + cell_range.height * source_width]
+            else:
+                extracted[reference] = [
+                    cell
+                    for row in range(cell_range.height)
+                    for cell in result[start + row * source_width : start + row * source_width + cell_range.width]
+                ]
+        return extracted
+
+
+def _check_row_order(result: Any, cell_range: CellRange) -> None:
+    # Offsets may be relative to the range, or to the sheet, either way they must be in row order
+    if not isinstance(result, list) or len(result) != cell_range.width * cell_range.height:
+        raise ValueError(f"Expected {cell_range.width * cell_range.height} cells for {cell_range}")
+    origin = list(getattr(result[0], "offset", None) or [])
+    if origin not in ([0, 0], [cell_range.left - 1, cell_range.top - 1]):
+        raise ValueError(f"Unexpected offset {origin} for the first cell of {cell_range}")
+    expected = {len(result) - 1: [origin[0] + cell_range.width - 1, origin[1] + cell_range.height - 1]}
+    if cell_range.height > 1:
+        expected[cell_range.width] = [origin[0], origin[1] + 1]
+    for index, offset in expected.items():
+        if list(getattr(result[index], "offset", None) or []) != offset:
+            raise ValueError(f"Cells of {cell_range} aren't in row order")
+
+
+@lru_cache(maxsize=1024)
+def plan_reads(reads: tuple[str, ...]) -> ReadPlan:
+    """The ReadPlan for a set of reads, which are usually the same few sets over and over"""
+    return ReadPlan(reads)
+
+
+class GridCalculator:
+    """
+    Runs workbook calculations through the GRID API, memoizing the results in an optional in-process cache.
+
+    Workbook calculations are deterministic for a published workbook, so a cached result stays valid until the
+    workbook is republished, at which point invalidate() should be called for it.
+
+    Concurrent callers asking for the same calculation share a single upstream request, whether or not there is
+    a cache. Nothing is kept for this once the request completes.
+
+    With max_concurrent_requests, at most that many upstream requests are made at once, and the rest wait their
+    turn rather than piling onto the GRID API.
+
+    With a shared_cache, results are also shared with the other worker processes on the host, which is checked
+    before going to GRID. Invalidating a workbook there reaches every worker, though results already in another
+    worker's in-process cache are only dropped once it calls invalidate() too, see
+    SharedResultStore.changed_workbooks().
+
+    With an upstream, calls to GRID are retried, hedged and circuit broken as it's configured to.
+
+    With plan_reads, adjacent reads are merged into larger ranges (see ReadPlan), which are what's calculated and
+    cached, and the results for the reads asked for are sliced back out of them.
+    """
+
+    def __init__(
+        self,
+        grid_client: AsyncGrid,
+        cache: Optional[TTLCache[CalcKey, WorkbookCalcResponse]] = None,
+        max_concurrent_requests: Optional[int] = None,
+        shared_cache: Optional[SharedResultStore] = None,
+        upstream: Optional[ResilientUpstream] = None,
+        plan_reads: bool = False,
+    ):
+        self._grid_client = grid_client
+        self._plan_reads = plan_reads
+        self.upstream = upstream
+        self._cache = cache
+        self.shared_cache = shared_cache
+        self._upstream_limit = asyncio.Semaphore(max_concurrent_requests) if max_concurrent_requests else None
+        self._in_flight: dict[CalcKey, asyncio.Task[WorkbookCalcResponse]] = {}
+        # Callers waiting on each in-flight calculation, it's cancelled once none are left
+        self._waiters: dict[asyncio.Task[WorkbookCalcResponse], int] = {}
+        self.coalesced_calls = 0
+
+    async def calc(
+        self, workbook_id: str, read: list[str], apply: Optional[dict[str, CellValue]] = None
+    ) -> WorkbookCalcResponse:
+        if self._plan_reads:
+            plan = plan_reads(tuple(read))
+            if plan.merges:
+                results = await self._calc(workbook_id, plan.reads, apply)
+                try:
+                    return plan.extract(results)
+                except (KeyError, ValueError) as e:
+                    logger.warning(
+                        f"Couldn't slice merged reads {plan.reads} for {read}, reading them as they are: {e}"
+                    )
+        return await self._calc(workbook_id, read, apply)
+
+    async def _calc(
+        self, workbook_id: str, read: list[str], apply: Optional[dict[str, CellValue]]
+    ) -> WorkbookCalcResponse:
+        key = calc_cache_key(workbook_id, read, apply)
+        if self._cache is not None:
+            cached = self._cache.get(key)
+            if cached is not None:
+                return cached
+
+        task = self._in_flight.get(key)
+        if task is None:
+            # Shared by callers with deadlines of their own, so the calculation doesn't inherit its first caller's
+            context = contextvars.copy_context()
+            context.run(current_deadline.set, None)
+            task = asyncio.create_task(self._calc_upstream(key, workbook_id, read, apply), context=context)
+            self._in_flight[key] = task
+            task.add_done_callback(lambda done: self._calc_done(key, done))
+        else:
+            self.coalesced_calls += 1
+
+        # Shielded, so a cancelled caller doesn't cancel the calculation for everyone else waiting on it. Once
+        # the last of them has gone there's nobody left to use the results, and the calculation is cancelled too.
+        # Each caller waits until its own deadline.
+        self._waiters[task] = self._waiters.get(task, 0) + 1
+        try:
+            async with asyncio.timeout(remaining_seconds()):
+                return await asyncio.shield(task)
+        finally:
+            self._waiters[task] -= 1
+            if not self._waiters[task]:
+                del self._waiters[task]
+                if not task.done():
+                    task.cancel()
+                    # Callers from now on start afresh, rather than joining a calculation that's being cancelled
+                    if self._in_flight.get(key) is task:
+                        del self._in_flight[key]
+
+    async def _calc_upstream(
+        self, key: CalcKey, workbook_id: str, read: list[str], apply: Optional[dict[str, CellValue]]
+    ) -> WorkbookCalcResponse:
+        shared, version = await self._shared_get(key)
+        if shared is not None:
+            if self._cache is not None:
+                self._cache.set(key, shared)
+            return shared
+
+        async def attempt() -> WorkbookCalcResponse:
+            async with self._upstream_limit or nullcontext():
+                with timed(GRID_CALC_SECONDS, "grid"):
+                    # Not bounded by any one caller's deadline, it's cancelled once all of them have given up
+                    return await self._grid_client.workbooks.calc(
+                        id=workbook_id, read=read, apply=apply if apply is not None else NOT_GIVEN
+                    )
+
+        results = await (self.upstream.call(attempt) if self.upstream is not None else attempt())
+        if self._cache is not None:
+            self._cache.set(key, results)
+        if self.shared_cache is not None and version is not None:
+            try:
+                await self.shared_cache.set(key, results, version)
+            except sqlite3.Error:
+                logger.exception("Failed to store GRID calculation in the shared cache")
+        return results
+
+    async def _shared_get(self, key: CalcKey) -> tuple[Optional[WorkbookCalcResponse], Optional[int]]:
+        # The shared cache is only an optimization, GRID is still there if it fails
+        if self.shared_cache is None:
+            return None, None
+        try:
+            return await self.shared_cache.get(key)
+        except sqlite3.Error:
+            logger.exception("Failed to read the shared cache of GRID calculations")
+            return None, None
+
+    def _calc_done(self, key: CalcKey, task: asyncio.Task[WorkbookCalcResponse]) -> None:
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        # Every waiter may have been cancelled, in which case nobody else will retrieve the exception
+        if not task.cancelled() and task.exception() is not None:
+            logger.debug(f"GRID calculation failed: {task.exception()!r}")
+
+    def invalidate(self, workbook_id: Optional[str] = None) -> int:
+        """Forget cached results for a workbook (or for all workbooks), e.g. after it has been republished"""
+        if self._cache is None:
+            return 0
+        return self._cache.invalidate(lambda key: workbook_id is None or key[0] == workbook_id)
+
+    async def invalidate_shared(self, workbook_id: str) -> int:
+        """Like invalidate(), and also for every worker sharing the shared cache"""
+        invalidated = self.invalidate(workbook_id)
+        if self.shared_cache is not None:
+            invalidated += await self.shared_cache.invalidate(workbook_id)
+        return invalidated
+
+    @property
+    def cache_stats(self) -> dict[str, int]:
+        return self._cache.stats if self._cache is not None else {"hits": 0, "misses": 0, "entries": 0}
+
+    @property
+    def shared_cache_stats(self) -> dict[str, int]:
+        return self.shared_cache.stats if self.shared_cache is not None else {"hits": 0, "misses": 0}
+
+
 class ProjectXRevenueModel:
     """ " This is a class implementing GRID API calls to a spreadsheet model called "Project X Revenue Model" """
 
-    def __init__(self, grid_client: AsyncGrid):
-        self._grid_client = grid_client
+    def __init__(
+        self,
+        grid_client: AsyncGrid | GridCalculator,
+        sweep_concurrency: int = 8,
+        max_sweep_points: int = 100,
+        local_engine: Optional[RevenueSurrogate] = None,
+        local_engine_sample_rate: float = 0.0,
+    ):
+        self._calculator = grid_client if isinstance(grid_client, GridCalculator) else GridCalculator(grid_client)
+        self._sweep_concurrency = sweep_concurrency
+        self._max_sweep_points = max_sweep_points
+        # Forecasts are served by the local engine once it's been verified against GRID, with GRID as a fallback
+        self._local_engine = local_engine
+        # The fraction of local forecasts checked against GRID in the background, the engine is reset if one's off
+        self._local_engine_sample_rate = local_engine_sample_rate
+        self._spot_checks: set[asyncio.Task] = set()
         self._workbook_id = "44f4e920-9e5b-45d5-a9a4-4c7d4ff933e2"
         # These parameter references could be potentially built from the GRID API labels/parameters endpoints
         # when they become available in the public API, although I suspect some codegen would be required in
@@ -48,14 +480,29 @@ class ProjectXRevenueModel:
             # "Organic": "Sheet1!C29:AL29",
             # "Paid": "Sheet1!C30:AL30",
         }
+        self._forecast_labels = [
+            # "ARR (month 36)",  # create a range for ARR so we can answer ARR for any month
+            "Monthly Recurring Revenue",
+            "Revenue from Existing subscribers",
+            "Revenue from New subscribers",
+        ]
         self._cell_ref_labels = {
             value: key for key, value in list(self._data_ranges.items()) + list(self._parameter_references.items())
         }
 
+    @property
+    def workbook_id(self) -> str:
+        return self._workbook_id
+
+    def reset_local_engine(self) -> None:
+        """Serve forecasts from GRID again until the local engine has been recalibrated against the workbook"""
+        if self._local_engine is not None:
+            self._local_engine.reset()
+
     async def get_model_defaults(self) -> dict[str, str | int | float | bool | None]:
         """Get the default values for all the model parameters used in 'forecast_revenue'"""
         reads = list(self._parameter_references.values())
-        results = await self._grid_client.workbooks.calc(id=self._workbook_id, read=reads)
+        results = await self._calculator.calc(self._workbook_id, reads)
         logger.debug("results=", results)
         response = {}
         for cell, result in results.items():
@@ -91,14 +538,52 @@ class ProjectXRevenueModel:
         so supply a null value for any of the parameters you don't have yet for the user.
         {list(self._parameter_references.keys())}
         """
-        reads = [
-            # self._data_ranges["ARR (month 36)"],  # create a range for ARR so we can answer ARR for any month
-            self._data_ranges["Monthly Recurring Revenue"],
-            self._data_ranges["Revenue from Existing subscribers"],
-            self._data_ranges["Revenue from New subscribers"],
-        ]
+        parameters: dict[str, CellValue] = {
+            "ad_budget": ad_budget,
+            "ad_cpc": ad_cpc,
+            "registration_conversion_rate": registration_conversion_rate,
+            "subscription_conversion_rate": subscription_conversion_rate,
+            "registration_conversion_lag_in_months": registration_conversion_lag_in_months,
+            "subscription_conversion_lag_in_months": subscription_conversion_lag_in_months,
+            "churn_rate": churn_rate,
+            "customer_lifetime_length_in_months": customer_lifetime_length_in_months,
+            "virality_per_registered_user": virality_per_registered_user,
+            "virality_per_subscribed_user": virality_per_subscribed_user,
+            "subscription_price": subscription_price,
+        }
+        return await self._forecast(parameters)
+
+    async def forecast_revenue_sweep(
+        self,
+        parameter: ModelParameter,
+        values: list[float],
+        second_parameter: Optional[ModelParameter] = None,
+        second_values: Optional[list[float]] = None,
+        ad_budget: Optional[float] = None,
+        ad_cpc: Optional[float] = None,
+        registration_conversion_rate: Optional[float] = None,
+        subscription_conversion_rate: Optional[float] = None,
+        registration_conversion_lag_in_months: Optional[float] = None,
+        subscription_conversion_lag_in_months: Optional[float] = None,
+        churn_rate: Optional[float] = None,
+        customer_lifetime_length_in_months: Optional[float] = None,
+        virality_per_registered_user: Optional[float] = None,
+        virality_per_subscribed_user: Optional[float] = None,
+        subscription_price: Optional[float] = None,
+    ) -> dict[str, Any]:
+        """
+        Run a sensitivity sweep of the revenue forecast, for questions like "how does MRR change as churn goes
+        from 2% to 10%?". Evaluates the forecast at every value in 'values' for 'parameter', and optionally at
+        every combination with the values in 'second_values' for 'second_parameter'.
 
-        parameters: dict[str, str | int | float | bool | None] = {
+        The remaining parameters describe the base scenario that is swept over, supply a null value for any of
+        them you don't have yet for the user to use the model's built-in default.
+
+        Returns the swept values and, for each point, the Monthly Recurring Revenue in the final month and the
+        total revenue over the whole forecast. Results are lists indexed like 'values' for a single parameter
+        sweep, or matrices indexed by [values index][second_values index] when sweeping two parameters.
+        """
+        base: dict[str, CellValue] = {
             "ad_budget": ad_budget,
             "ad_cpc": ad_cpc,
             "registration_conversion_rate": registration_conversion_rate,
@@ -112,9 +597,109 @@ class ProjectXRevenueModel:
             "subscription_price": subscription_price,
         }
 
-        results = await self._grid_client.workbooks.calc(
-            id=self._workbook_id,
-            read=reads,
+        swept = [parameter] if second_parameter is None else [parameter, second_parameter]
+        if any(p not in self._parameter_references for p in swept):
+            return {"error": f"Can only sweep over the model parameters: {list(self._parameter_references)}"}
+        if second_parameter is not None and not second_values:
+            return {"error": "'second_values' must be supplied when sweeping 'second_parameter'"}
+        second_count = len(second_values) if second_parameter is not None and second_values else 1
+        if len(values) * second_count > self._max_sweep_points:
+            return {"error": f"Too many sweep points, at most {self._max_sweep_points} can be evaluated at once"}
+
+        points = [{**base, parameter: value} for value in values]
+        if second_parameter is not None and second_values:
+            points = [{**point, second_parameter: second} for point in points for second in second_values]
+
+        forecasts = await self._forecast_many(points)
+
+        results: dict[str, list[Any]] = {
+            "Monthly Recurring Revenue (final month)": [f["Monthly Recurring Revenue"][-1] for f in forecasts],
+            "Total revenue": [sum(f["Monthly Recurring Revenue"]) for f in forecasts],
+        }
+
+        response: dict[str, Any] = {"parameter": parameter, "values": values}
+        if second_parameter is not None and second_values:
+            # Reshape each flat list of results into a [values index][second_values index] matrix
+            response["second_parameter"] = second_parameter
+            response["second_values"] = second_values
+            results = {
+                label: [result[i : i + second_count] for i in range(0, len(result), second_count)]
+                for label, result in results.items()
+            }
+        return {**response, **results}
+
+    async def calibrate_local_engine(self, relative_tolerance: float) -> bool:
+        """
+        Calibrate the local engine with the workbook's defaults, then verify it against GRID on the default
+        scenario and several values of each parameter it models, then on combinations of the parameters that
+        agreed. Forecasts are only served locally if this succeeds, and then only for scenarios changing
+        parameters that agreed with GRID every time.
+        """
+        engine = self._local_engine
+        if engine is None:
+            return False
+
+        engine.calibrate(await self.get_model_defaults())
+
+        scenarios: list[dict[str, CellValue]] = [dict(scenario) for scenario in engine.verification_scenarios()]
+        references = await asyncio.gather(*(self._forecast_grid(scenario) for scenario in scenarios))
+        engine.verify(list(zip(scenarios, references)), relative_tolerance)
+        if engine.verified and len(engine.verified_parameters) > 1:
+            combinations: list[dict[str, CellValue]] = [
+                dict(scenario) for scenario in engine.combination_scenarios(engine.verified_parameters)
+            ]
+            scenarios += combinations
+            references += await asyncio.gather(*(self._forecast_grid(scenario) for scenario in combinations))
+            engine.verify(list(zip(scenarios, references)), relative_tolerance)
+        return engine.verified
+
+    async def _forecast(self, parameters: dict[str, CellValue]) -> dict[str, list[Any]]:
+        return (await self._forecast_many([parameters]))[0]
+
+    async def _forecast_many(self, scenarios: list[dict[str, CellValue]]) -> list[dict[str, list[Any]]]:
+        if self._local_engine is not None and self._local_engine.can_forecast(scenarios):
+            try:
+                forecasts = self._local_engine.forecast(scenarios, self._forecast_labels)
+            except Exception:
+                logger.exception("Local revenue engine failed, falling back to GRID")
+            else:
+                if random.random() < self._local_engine_sample_rate:
+                    index = random.randrange(len(scenarios))
+                    # In the background, and not bound by the deadline of the request that happened to be sampled
+                    context = contextvars.copy_context()
+                    context.run(current_deadline.set, None)
+                    spot_check = asyncio.create_task(
+                        self._spot_check(scenarios[index], forecasts[index]), context=context
+                    )
+                    self._spot_checks.add(spot_check)
+                    spot_check.add_done_callback(self._spot_checks.discard)
+                return forecasts
+
+        semaphore = asyncio.Semaphore(self._sweep_concurrency)
+
+        async def evaluate(scenario: dict[str, CellValue]) -> dict[str, list[Any]]:
+            async with semaphore:
+                return await self._forecast_grid(scenario)
+
+        return await asyncio.gather(*(evaluate(scenario) for scenario in scenarios))
+
+    async def _spot_check(self, scenario: dict[str, CellValue], forecast: dict[str, list[Any]]) -> None:
+        assert self._local_engine is not None
+        try:
+            expected = await self._forecast_grid(scenario)
+        except Exception as e:
+            logger.debug(f"Couldn't spot check the local revenue engine: {e!r}")
+            return
+        if not self._local_engine.agrees(forecast, expected):
+            logger.warning(f"Local revenue engine disagrees with GRID for {scenario}, serving forecasts from GRID")
+            self._local_engine.reset()
+
+    async def _forecast_grid(self, parameters: dict[str, CellValue]) -> dict[str, list[Any]]:
+        reads = [self._data_ranges[label] for label in self._forecast_labels]
+
+        results = await self._calculator.calc(
+            self._workbook_id,
+            reads,
             apply={
                 self._parameter_references[key]: value
                 for key, value in parameters.items()
@@ -0,0 +1,126 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import AsyncIterator, Awaitable, Iterator, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class Overloaded(Exception):
+    """Raised when a request can't be admitted, it should be retried after retry_after seconds"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Overloaded, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    A bounded admission queue in front of expensive requests.
+
+    At most max_concurrent requests run at once. Up to max_queue more may wait for a slot, each for at most
+    max_wait_seconds. Anything beyond that is rejected straight away with Overloaded, so overload turns into
+    predictable shedding rather than every request slowing down together.
+    """
+
+    def __init__(self, max_concurrent: int, max_queue: int, max_wait_seconds: float, retry_after: float = 1.0):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_wait_seconds = max_wait_seconds
+        self.retry_after = retry_after
+        self.active = 0
+        self.waiting = 0
+        self.rejected = 0
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+
+    async def acquire(self) -> None:
+        if self._semaphore.locked():
+            if self.waiting >= self.max_queue:
+                self.rejected += 1
+                raise Overloaded(self.retry_after)
+            self.waiting += 1
+            try:
+                async with asyncio.timeout(self.max_wait_seconds):
+                    await self._semaphore.acquire()
+            except TimeoutError:
+                self.rejected += 1
+                raise Overloaded(self.retry_after) from None
+            finally:
+                self.waiting -= 1
+        else:
+            await self._semaphore.acquire()
+        self.active += 1
+
+    def release(self) -> None:
+        self.active -= 1
+        self._semaphore.release()
+
+    @asynccontextmanager
+    async def admit(self) -> AsyncIterator[None]:
+        await self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+
+class Abandoned(Exception):
+    """Raised when a request's work is cancelled, because its client disconnected or its deadline expired"""
+
+    def __init__(self, reason: str):
+        super().__init__(f"Request abandoned: {reason}")
+        self.reason = reason
+
+
+# The time.monotonic() by which the current request must be done, inherited by the tasks it starts
+current_deadline: ContextVar[Optional[float]] = ContextVar("current_deadline", default=None)
+
+
+@contextmanager
+def deadline(deadline_at: float) -> Iterator[None]:
+    """Set the deadline for the block, never extending one that's already set"""
+    previous = current_deadline.get()
+    token = current_deadline.set(deadline_at if previous is None else min(previous, deadline_at))
+    try:
+        yield
+    finally:
+        current_deadline.reset(token)
+
+
+def remaining_seconds(default: Optional[float] = None) -> Optional[float]:
+    """The timeout for an upstream call: what's left of the current deadline, or default if that's sooner"""
+    deadline_at = current_deadline.get()
+    if deadline_at is None:
+        return default
+    remaining = max(deadline_at - time.monotonic(), 0.0)
+    return remaining if default is None else min(remaining, default)
+
+
+async def run_until_abandoned(work: Awaitable[T], disconnected: asyncio.Future, deadline_at: float) -> T:
+    """
+    Wait for work, unless the client disconnects or the deadline expires first. The work is then cancelled,
+    along with any OpenAI rounds and tool calls it has in flight, and Abandoned is raised.
+    """
+    with deadline(deadline_at):
+        task = asyncio.ensure_future(work)
+    try:
+        done, _ = await asyncio.wait(
+            {task, disconnected},
+            timeout=max(deadline_at - time.monotonic(), 0.0),
+            return_when=asyncio.FIRST_COMPLETED,
+        )
+    except BaseException:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        raise
+
+    if task in done:
+        # Upstream calls time out at the deadline too, their errors are then just the deadline expiring
+        if task.exception() is not None and time.monotonic() >= deadline_at:
+            raise Abandoned("deadline") from task.exception()
+        return task.result()
+
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    raise Abandoned("disconnect" if disconnected in done else "deadline")
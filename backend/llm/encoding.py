@@ -0,0 +1,113 @@
+import json
+import math
+from typing import Any, Awaitable, Callable, Literal, Optional
+
+
+def json_encoder(result: Any) -> str:
+    """The default tool output encoder, plain JSON"""
+    return json.dumps(result)
+
+
+def round_significant(value: Any, digits: int) -> Any:
+    """Round every float in a (possibly nested) result to the given number of significant digits"""
+    if isinstance(value, float):
+        if value == 0 or not math.isfinite(value):
+            return value
+        return round(value, digits - 1 - math.floor(math.log10(abs(value))))
+    if isinstance(value, list):
+        return [round_significant(v, digits) for v in value]
+    if isinstance(value, dict):
+        return {k: round_significant(v, digits) for k, v in value.items()}
+    return value
+
+
+def is_series(value: Any) -> bool:
+    return isinstance(value, list) and len(value) > 1 and all(isinstance(v, (int, float)) for v in value)
+
+
+class SeriesEncoder:
+    """
+    Encodes tool results made up of numeric series, like forecast_revenue's monthly timeseries, compactly for the
+    LLM. Every option is off when left at its default, other than compact JSON separators:
+
+    - significant_digits: round floats to this many significant digits
+    - layout: "columns" keeps a {label: series} mapping, "rows" turns equal length series into a table with a
+      header row, and one row per index
+    - summary: replace each series with its min, max, mean, first and last values
+    - sample_points: keep only this many evenly spaced points of each series, always including the last one
+    - baseline: a callable returning the result for the default parameters, series are then sent as their
+      difference from it. The baseline result itself is sent as it is, so the absolute values reach the LLM.
+    """
+
+    def __init__(
+        self,
+        significant_digits: Optional[int] = None,
+        layout: Literal["columns", "rows"] = "columns",
+        summary: bool = False,
+        sample_points: Optional[int] = None,
+        baseline: Optional[Callable[[], Awaitable[dict[str, Any]]]] = None,
+    ):
+        self.significant_digits = significant_digits
+        self.layout = layout
+        self.summary = summary
+        self.sample_points = sample_points
+        self.baseline = baseline
+
+    async def __call__(self, result: Any) -> str:
+        if isinstance(result, dict) and "error" not in result:
+            result = await self.encode_series(result)
+        if self.significant_digits is not None:
+            result = round_significant(result, self.significant_digits)
+        return json.dumps(result, separators=(",", ":"))
+
+    async def encode_series(self, result: dict[str, Any]) -> dict[str, Any]:
+        series = {label: value for label, value in result.items() if is_series(value)}
+        if not series:
+            return result
+        encoded: dict[str, Any] = {label: value for label, value in result.items() if label not in series}
+
+        baseline = await self.baseline() if self.baseline is not None else None
+        if baseline is not None and any(baseline.get(label) != values for label, values in series.items()):
+            series = {
+                label: (
+                    [v - b for v, b in zip(values, baseline[label])]
+                    if is_series(baseline.get(label)) and len(baseline[label]) == len(values)
+                    else values
+                )
+                for label, values in series.items()
+            }
+            encoded["encoding"] = "difference from the forecast with default parameters, which has absolute values"
+
+        if self.summary:
+            encoded.update(
+                {
+                    label: {
+                        "min": min(values),
+                        "max": max(values),
+                        "mean": sum(values) / len(values),
+                        "first": values[0],
+                        "last": values[-1],
+                    }
+                    for label, values in series.items()
+                }
+            )
+            return encoded
+
+        indexes: Optional[list[int]] = None
+        if self.sample_points is not None:
+            length = max(len(values) for values in series.values())
+            if self.sample_points < length:
+                step = (length - 1) / max(self.sample_points - 1, 1)
+                indexes = sorted({round(length - 1 - i * step) for i in range(self.sample_points)})
+                encoded["sampled_indexes"] = indexes
+                series = {
+                    label: [values[i] for i in indexes if i < len(values)] for label, values in series.items()
+                }
+
+        lengths = {len(values) for values in series.values()}
+        if self.layout == "rows" and len(lengths) == 1:
+            labels = list(series)
+            encoded["table"] = [labels] + [list(row) for row in zip(*series.values())]
+        else:
+            encoded.update(series)
+        return encoded
@@ -0,0 +1,143 @@
+import json
+import logging
+from functools import lru_cache
+from typing import Any, Optional
+
+from backend.llm.encoding import is_series, round_significant
+from backend.types import (
+    FunctionCallOutput,
+    FunctionCallRequest,
+    Message,
+    MessageList,
+    TextMessage,
+    canonical_arguments,
+)
+
+logger = logging.getLogger(__name__)
+
+try:
+    import tiktoken  # type: ignore[import-not-found]
+
+    _encoding: Optional[Any] = tiktoken.get_encoding("o200k_base")
+except ImportError:  # pragma: no cover - tiktoken is optional
+    _encoding = None
+except Exception:  # pragma: no cover - e.g. the encoding's file couldn't be downloaded
+    logger.warning("Couldn't load the tiktoken encoding, counting tokens roughly instead", exc_info=True)
+    _encoding = None
+
+# Per message framing OpenAI adds around the content
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+@lru_cache(maxsize=8192)
+def count_tokens(text: str) -> int:
+    """Tokens in text, exactly with tiktoken if it's installed, or roughly at four characters per token"""
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return (len(text) + 3) // 4
+
+
+def message_tokens(message: Message) -> int:
+    if isinstance(message, TextMessage):
+        return MESSAGE_OVERHEAD_TOKENS + count_tokens(message.content)
+    if isinstance(message, FunctionCallRequest):
+        return MESSAGE_OVERHEAD_TOKENS + count_tokens(message.name) + count_tokens(message.arguments)
+    return MESSAGE_OVERHEAD_TOKENS + count_tokens(message.output)
+
+
+def summarize_output(output: str, max_chars: int) -> str:
+    """A short stand-in for a tool output from an earlier turn: series become their first, last, min and max"""
+    try:
+        result = json.loads(output)
+    except ValueError:
+        result = None
+    if isinstance(result, dict) and any(is_series(value) for value in result.values()):
+        summary = {
+            label: (
+                {"first": value[0], "last": value[-1], "min": min(value), "max": max(value)}
+                if is_series(value)
+                else value
+            )
+            for label, value in result.items()
+        }
+        summary["note"] = "summarized from an earlier turn"
+        return json.dumps(round_significant(summary, 4), separators=(",", ":"))
+    if len(output) <= max_chars:
+        return output
+    return output[:max_chars] + "... (truncated, from an earlier turn)"
+
+
+class HistoryCompactor:
+    """
+    Keeps the history sent to OpenAI within a token budget. Histories within max_tokens are sent as they are.
+
+    Beyond that, the latest keep_recent_turns turns (starting at a user message) are always kept verbatim, and
+    the earlier ones are compacted, until the history fits:
+    1. tool calls that were repeated later on with the same arguments are dropped, with their outputs
+    2. the remaining tool outputs are summarized
+    3. the oldest turns are dropped altogether
+    """
+
+    def __init__(self, max_tokens: int, keep_recent_turns: int = 4, summary_chars: int = 400):
+        self.max_tokens = max_tokens
+        self.keep_recent_turns = keep_recent_turns
+        self.summary_chars = summary_chars
+
+    def compact(self, messages: MessageList) -> tuple[MessageList, int]:
+        """The compacted history, and the number of tokens that saved. messages itself is left untouched."""
+        tokens = [message_tokens(m) for m in messages]
+        total = sum(tokens)
+        if total <= self.max_tokens:
+            return messages, 0
+
+        turn_starts = [i for i, m in enumerate(messages) if isinstance(m, TextMessage) and m.role == "user"]
+        boundary = turn_starts[-self.keep_recent_turns] if len(turn_starts) >= self.keep_recent_turns else 0
+        if boundary == 0:
+            return messages, 0
+        older, recent = messages[:boundary], messages[boundary:]
+        budget = self.max_tokens - sum(tokens[boundary:])
+
+        older = self._drop_superseded_calls(older, recent)
+        if self._tokens(older) > budget:
+            older = [
+                (
+                    FunctionCallOutput(
+                        type="function_call_output",
+                        call_id=m.call_id,
+                        output=summarize_output(m.output, self.summary_chars),
+                    )
+                    if isinstance(m, FunctionCallOutput)
+                    else m
+                )
+                for m in older
+            ]
+        while older and self._tokens(older) > budget:
+            older = self._drop_oldest_turn(older)
+
+        compacted = older + recent
+        return compacted, total - self._tokens(compacted)
+
+    @staticmethod
+    def _tokens(messages: MessageList) -> int:
+        return sum(message_tokens(m) for m in messages)
+
+    @staticmethod
+    def _drop_superseded_calls(older: MessageList, recent: MessageList) -> MessageList:
+        # A call is superseded when the same tool is called again later with the same arguments
+        seen: set[tuple[str, str]] = set()
+        superseded: set[str] = set()
+        for m in reversed(older + recent):
+            if isinstance(m, FunctionCallRequest):
+                key = (m.name, canonical_arguments(m.arguments))
+                if key in seen:
+                    superseded.add(m.call_id)
+                seen.add(key)
+        return [m for m in older if isinstance(m, TextMessage) or m.call_id not in superseded]
+
+    @staticmethod
+    def _drop_oldest_turn(older: MessageList) -> MessageList:
+        next_turn = next(
+            (i for i, m in enumerate(older) if i > 0 and isinstance(m, TextMessage) and m.role == "user"),
+            len(older),
+        )
+        return older[next_turn:]
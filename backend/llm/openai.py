@@ -1,11 +1,14 @@
+import asyncio
+import hashlib
 import inspect
 import json
 import logging
+from dataclasses import dataclass
 from inspect import isawaitable
-from typing import Any, Callable, Iterable, Optional, TypeAlias, Union, cast
+from typing import Any, AsyncGenerator, Callable, Iterable, Optional, TypeAlias, Union, cast
 
-import openai
-from openai import NotGiven
+import httpx
+from openai import AsyncOpenAI, BadRequestError, DefaultAsyncHttpxClient, NotFoundError, NotGiven
 from openai.types.responses import (
     ComputerToolParam,
     FileSearchToolParam,
@@ -13,55 +16,387 @@ from openai.types.responses import (
     WebSearchToolParam,
 )
 from openai.types.responses.response_input_param import ResponseInputItemParam
-from pydantic import create_model
+from pydantic import BaseModel, ConfigDict, ValidationError, create_model
 
+from backend.cache import TTLCache
 from backend.config import AppConfig
-from backend.types import FunctionCallOutput, FunctionCallRequest, MessageList, TextMessage, ToolBinding
+from backend.limits import remaining_seconds
+from backend.llm.encoding import json_encoder
+from backend.llm.history import HistoryCompactor
+from backend.llm.speculation import Speculation, predict_default_calls
+from backend.metrics import (
+    CHAT_TOKENS,
+    HISTORY_TOKENS_SAVED,
+    OPENAI_INPUT_ENCODE_SECONDS,
+    OPENAI_ROUND_SECONDS,
+    OPENAI_TOKENS,
+    SPECULATIVE_TOOL_CALLS,
+    TOOL_CALL_ERRORS,
+    TOOL_CALL_SECONDS,
+    TOOL_ROUNDS,
+    Stopwatch,
+    timed,
+)
+from backend.resilience import CircuitOpen, ResilientUpstream
+from backend.sessions import ChatSession
+from backend.types import (
+    FunctionCallOutput,
+    FunctionCallRequest,
+    Message,
+    MessageList,
+    TextMessage,
+    ToolBinding,
+    ToolDefinition,
+    ToolOutputEncoder,
+    message_list_adapter,
+)
 
 ToolParam: TypeAlias = Union[FunctionToolParam, FileSearchToolParam, ComputerToolParam, WebSearchToolParam]
 MessageParam: TypeAlias = ResponseInputItemParam
 
 logger = logging.getLogger(__name__)
 
+UNEXPECTED_RESPONSE_REPLY = "error, unexpected response type from LLM"
+
+# Marks a tool call without a speculative result to use, as None is a valid result
+_NOT_SPECULATED = object()
+
+
+def create_openai_client(config: AppConfig) -> AsyncOpenAI:
+    """
+    Create a long-lived AsyncOpenAI client, with a connection pool sized from the config. The client is meant to be
+    shared for the lifetime of the process, so connections are kept alive between chat requests.
+    """
+    timeout = httpx.Timeout(config.OPENAI_TIMEOUT_SECONDS, connect=config.OPENAI_CONNECT_TIMEOUT_SECONDS)
+    return AsyncOpenAI(
+        api_key=config.OPENAI_API_KEY,
+        base_url=config.OPENAI_BASE_URL,
+        timeout=timeout,
+        # Retried by OpenAITooledChat's ResilientUpstream instead, within each chat's deadline
+        max_retries=0,
+        http_client=DefaultAsyncHttpxClient(
+            timeout=timeout,
+            limits=httpx.Limits(
+                max_connections=config.OPENAI_MAX_CONNECTIONS,
+                max_keepalive_connections=config.OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=config.OPENAI_KEEPALIVE_EXPIRY_SECONDS,
+            ),
+        ),
+    )
+
+
+@dataclass
+class ChatUsage:
+    """Token and tool round counts for a single chat request"""
+
+    input_tokens: int = 0
+    output_tokens: int = 0
+    tool_rounds: int = 0
+
+    def add(self, response: Any) -> None:
+        usage = getattr(response, "usage", None)
+        if usage is not None and isinstance(usage.input_tokens, int):
+            self.input_tokens += usage.input_tokens
+            self.output_tokens += usage.output_tokens
+
+    def observe(self) -> None:
+        OPENAI_TOKENS.inc(self.input_tokens, direction="input")
+        OPENAI_TOKENS.inc(self.output_tokens, direction="output")
+        CHAT_TOKENS.observe(self.input_tokens, direction="input")
+        CHAT_TOKENS.observe(self.output_tokens, direction="output")
+        TOOL_ROUNDS.observe(self.tool_rounds)
+
+
+def _normalize_message(message: Message) -> Any:
+    # Call ids differ between otherwise identical conversations, and so does whitespace or case in questions
+    if isinstance(message, TextMessage):
+        return [message.role, " ".join(message.content.split()).casefold()]
+    if isinstance(message, FunctionCallRequest):
+        return [message.type, message.name, message.arguments]
+    return [message.type, message.output]
+
 
 class OpenAITooledChat:
-    def __init__(self, config: AppConfig, tools: dict[str, ToolBinding]):
+    """
+    A chat with an OpenAI model that can call the given tools.
+
+    Replies can optionally be cached (see OPENAI_RESPONSE_CACHE_MAX_ENTRIES), keyed on the normalized
+    conversation, the model and the tool definitions, so common opening questions are answered without going
+    to OpenAI at all. cache_filter can exclude conversations from the cache, by returning False for them.
+
+    Tools can also be called speculatively (see OPENAI_SPECULATIVE_TOOLS): at the start of a turn, tools the
+    conversation hasn't called with their default arguments yet are called that way while the request to
+    OpenAI is in flight, and the model's matching calls use their results rather than calling them again.
+    """
+
+    def __init__(
+        self,
+        config: AppConfig,
+        tools: dict[str, ToolBinding],
+        cache_filter: Optional[Callable[[MessageList], bool]] = None,
+    ):
         self.tools = tools
-        openai.api_key = config.OPENAI_API_KEY
+        self._tool_definitions: Optional[list[FunctionToolParam]] = None
+        self._tools_version = ""
+        self.client = create_openai_client(config)
+        self.upstream = ResilientUpstream.from_config("openai", config)
+        self.model = "gpt-4o"
+        self.max_tool_rounds = config.OPENAI_MAX_TOOL_ROUNDS
+        self.chain_responses = config.OPENAI_CHAIN_RESPONSES
+        self._timeout = config.OPENAI_TIMEOUT_SECONDS
+        self._tool_concurrency = config.TOOL_MAX_CONCURRENCY
+        self._tool_semaphores: dict[str, asyncio.Semaphore] = {}
+        # Shared by all chats, so a burst of chats queues here instead of overwhelming OpenAI (and our rate limit)
+        self._upstream_limit = asyncio.Semaphore(config.OPENAI_MAX_CONCURRENT_REQUESTS)
+        self.response_cache: Optional[TTLCache[str, TextMessage]] = (
+            TTLCache(config.OPENAI_RESPONSE_CACHE_MAX_ENTRIES, config.OPENAI_RESPONSE_CACHE_TTL_SECONDS)
+            if config.OPENAI_RESPONSE_CACHE_MAX_ENTRIES > 0
+            else None
+        )
+        self.cache_filter = cache_filter
+        self.history = (
+            HistoryCompactor(config.OPENAI_HISTORY_MAX_TOKENS, config.OPENAI_HISTORY_KEEP_RECENT_TURNS)
+            if config.OPENAI_HISTORY_MAX_TOKENS > 0
+            else None
+        )
+        self.speculative_tools = tuple(
+            name.strip() for name in config.OPENAI_SPECULATIVE_TOOLS.split(",") if name.strip()
+        )
+        for name in self.speculative_tools:
+            if name not in self.tools:
+                raise ValueError(f"Speculative tool {name} doesn't exist")
+            self._default_arguments(name)
+        self.max_speculative_calls = config.OPENAI_SPECULATION_MAX_IN_FLIGHT
+        self._speculative_calls = 0
+
+    async def aclose(self) -> None:
+        await self.client.close()
+
+    async def create_response(
+        self, messages: MessageList, session: Optional[ChatSession] = None, use_cache: bool = True
+    ) -> TextMessage:
+        """
+        Wraps the client.responses.create call, handles function calls, and sends the result back to OpenAI.
+
+        With a session, messages is the session's full history, and the reply is appended to it. Only the
+        messages OpenAI hasn't seen yet are sent upstream, chained onto the session's previous response.
+
+        With use_cache=False, the reply cache is bypassed (though the new reply is still not cached).
+        """
+        cache_key = self.response_cache_key(messages) if use_cache else None
+        cached = self._cached_reply(cache_key, messages, session)
+        if cached is not None:
+            return cached
+
+        usage = ChatUsage()
+        with self.speculate(messages) as speculation:
+            for tool_round in range(self.max_tool_rounds + 1):
+                # Once we're out of tool rounds, make the model answer with the tool results it already has
+                tools_allowed = tool_round < self.max_tool_rounds
+                async with self._upstream_limit:
+                    with timed(OPENAI_ROUND_SECONDS, "openai"):
+                        response = await self._create(messages, tools_allowed, session)
+                usage.add(response)
+                self._record_response(response, messages, session)
+                if not (tools_allowed and await self.perform_function_calls(response, messages, speculation)):
+                    break
+                usage.tool_rounds += 1
+
+        message = self.final_message(response)
+        self._record_reply(message, messages, session)
+        self._cache_reply(cache_key, message)
+        usage.observe()
+        return message
 
-    async def create_response(self, messages: MessageList) -> TextMessage:
+    async def stream_response(
+        self, messages: MessageList, session: Optional[ChatSession] = None, use_cache: bool = True
+    ) -> AsyncGenerator[tuple[str, dict[str, Any]], None]:
         """
-        Wraps the openai.responses.create call, handles function calls, and sends the result back to OpenAI.
+        Streaming variant of create_response, yielding (event, data) pairs as they arrive from OpenAI:
+        - "delta": a chunk of the assistant's reply text
+        - "tool_call": the model has asked for a tool call, which we're about to run
+        - "done": the final assistant message, once all tool calls have been handled
         """
-        response = openai.responses.create(
-            model="gpt-4o",
-            input=[cast(MessageParam, m.model_dump()) for m in messages],
+        cache_key = self.response_cache_key(messages) if use_cache else None
+        cached = self._cached_reply(cache_key, messages, session)
+        if cached is not None:
+            yield "delta", {"delta": cached.content}
+            yield "done", {"reply": cached.content, "role": cached.role}
+            return
+
+        usage = ChatUsage()
+        with self.speculate(messages) as speculation:
+            for tool_round in range(self.max_tool_rounds + 1):
+                tools_allowed = tool_round < self.max_tool_rounds
+                # The stream holds its upstream slot until it has been read to the end
+                async with self._upstream_limit:
+                    # Only the time spent waiting on OpenAI, not on our client reading what's been yielded to it
+                    stopwatch = Stopwatch()
+                    try:
+                        with stopwatch.running():
+                            stream = await self._create(messages, tools_allowed, session, stream=True)
+                            events = stream.__aiter__()
+                        response = None
+                        while True:
+                            with stopwatch.running():
+                                try:
+                                    event = await events.__anext__()
+                                except StopAsyncIteration:
+                                    break
+                            if event.type == "response.output_text.delta":
+                                yield "delta", {"delta": event.delta}
+                            elif event.type == "response.output_item.added" and event.item.type == "function_call":
+                                yield "tool_call", {"name": event.item.name}
+                            elif event.type == "response.completed":
+                                response = event.response
+                    finally:
+                        stopwatch.observe(OPENAI_ROUND_SECONDS, "openai")
+
+                if response is None:
+                    logger.error("OpenAI response stream ended without a completed response")
+                    message = TextMessage(role="assistant", content=UNEXPECTED_RESPONSE_REPLY)
+                    break
+
+                usage.add(response)
+                self._record_response(response, messages, session)
+                if not (tools_allowed and await self.perform_function_calls(response, messages, speculation)):
+                    message = self.final_message(response)
+                    break
+                usage.tool_rounds += 1
+
+        self._record_reply(message, messages, session)
+        self._cache_reply(cache_key, message)
+        usage.observe()
+        yield "done", {"reply": message.content, "role": message.role}
+
+    async def _create(
+        self, messages: MessageList, tools_allowed: bool, session: Optional[ChatSession], **kwargs: Any
+    ) -> Any:
+        try:
+            return await self.upstream.call(
+                lambda: self.client.responses.create(
+                    **self._request_params(messages, tools_allowed, session), **kwargs
+                )
+            )
+        except (NotFoundError, BadRequestError):
+            if session is None or session.previous_response_id is None:
+                raise
+            # The previous response may have expired upstream, so start the chain over with the full history
+            logger.warning(
+                f"Couldn't chain onto previous response {session.previous_response_id}, resending full history"
+            )
+            session.previous_response_id = None
+            return await self.upstream.call(
+                lambda: self.client.responses.create(
+                    **self._request_params(messages, tools_allowed, session), **kwargs
+                )
+            )
+
+    def _request_params(
+        self, messages: MessageList, tools_allowed: bool = True, session: Optional[ChatSession] = None
+    ) -> dict[str, Any]:
+        params: dict[str, Any] = dict(
+            model=self.model,
             tools=cast(Iterable[ToolParam] | NotGiven, self.tool_definitions),
+            tool_choice="auto" if tools_allowed else "none",
+            # Never wait on OpenAI past the chat request's deadline
+            timeout=remaining_seconds(self._timeout),
+        )
+        if session is not None and session.previous_response_id is not None:
+            # The previous response already holds the function calls it made, only their outputs are new
+            params["previous_response_id"] = session.previous_response_id
+            messages = [m for m in messages[session.synced :] if not isinstance(m, FunctionCallRequest)]
+        elif self.history is not None:
+            # Only when sending the full history, a chained response's history is kept by OpenAI
+            messages, saved_tokens = self.history.compact(messages)
+            HISTORY_TOKENS_SAVED.observe(saved_tokens)
+        with timed(OPENAI_INPUT_ENCODE_SECONDS, "encode"):
+            params["input"] = cast(list[MessageParam], message_list_adapter.dump_python(messages))
+        return params
+
+    def response_cache_key(self, messages: MessageList) -> Optional[str]:
+        """The reply cache key for a conversation, or None if it shouldn't be cached"""
+        if self.response_cache is None or not messages:
+            return None
+        if self.cache_filter is not None and not self.cache_filter(messages):
+            return None
+        canonical = {
+            "model": self.model,
+            "tools": self.tools_version,
+            "messages": [_normalize_message(m) for m in messages],
+        }
+        return hashlib.sha256(json.dumps(canonical, sort_keys=True, default=str).encode()).hexdigest()
+
+    def _cached_reply(
+        self, cache_key: Optional[str], messages: MessageList, session: Optional[ChatSession]
+    ) -> Optional[TextMessage]:
+        if cache_key is None or self.response_cache is None:
+            return None
+        message = self.response_cache.get(cache_key)
+        if message is not None and session is not None:
+            # OpenAI hasn't seen this turn, so synced stays put and the next turn sends it along
+            messages.append(message)
+        return message
+
+    def _cache_reply(self, cache_key: Optional[str], message: TextMessage) -> None:
+        if (
+            cache_key is not None
+            and self.response_cache is not None
+            and message.content != UNEXPECTED_RESPONSE_REPLY
+        ):
+            self.response_cache.set(cache_key, message)
+
+    def invalidate_response_cache(self) -> int:
+        """Forget every cached reply, e.g. once a workbook they were based on has been republished"""
+        return self.response_cache.invalidate() if self.response_cache is not None else 0
+
+    def _record_response(self, response: Any, messages: MessageList, session: Optional[ChatSession]) -> None:
+        if session is not None and self.chain_responses:
+            session.previous_response_id = response.id
+            session.synced = len(messages)
+
+    def _record_reply(self, message: TextMessage, messages: MessageList, session: Optional[ChatSession]) -> None:
+        if session is not None:
+            messages.append(message)
+            if session.previous_response_id is not None:
+                # The reply is part of the previous response's output, so it doesn't need sending back
+                session.synced = len(messages)
+
+    async def perform_function_calls(
+        self, response: Any, messages: MessageList, speculation: Optional[Speculation] = None
+    ) -> bool:
+        """
+        Run the function calls requested in an OpenAI response concurrently, appending the requests and their
+        outputs to messages in the order the model asked for them. Returns whether any function calls were
+        performed.
+        """
+        tool_calls = [
+            output for response_type, output in self.yield_responses(response) if response_type == "function_call"
+        ]
+        function_call_outputs = await asyncio.gather(
+            *(self.handle_function_call(c, speculation) for c in tool_calls)
         )
 
         performed_function_calls = False
 
-        for response_type, output in self.yield_responses(response):
-            if response_type == "function_call":
-                tool_call = output
-                function_call_output = await self.handle_function_call(tool_call)
-                if function_call_output:
-                    messages.append(
-                        FunctionCallRequest(
-                            type="function_call",
-                            name=tool_call.name,
-                            arguments=tool_call.arguments,
-                            call_id=tool_call.call_id,
-                        )
+        for tool_call, function_call_output in zip(tool_calls, function_call_outputs):
+            if function_call_output:
+                messages.append(
+                    FunctionCallRequest(
+                        type="function_call",
+                        name=tool_call.name,
+                        arguments=tool_call.arguments,
+                        call_id=tool_call.call_id,
                     )
-                    messages.append(function_call_output)
-                    print("function call response:", function_call_output)
-                    performed_function_calls = True
+                )
+                messages.append(function_call_output)
+                logger.debug(f"function call response: {function_call_output}")
+                performed_function_calls = True
 
-        if performed_function_calls:
-            # Recursive call to allow OpenAI to respond with the tool call responses
-            return await self.create_response(messages)
+        return performed_function_calls
 
+    @classmethod
+    def final_message(cls, response: Any) -> TextMessage:
         if len(response.output) == 1:
             output = response.output[0]
             if output.type == "message" and output.content[0].type == "output_text":
@@ -74,26 +409,137 @@ class OpenAITooledChat:
             f"Unsupported response from OpenAI -- expected single message, got {len(response.output)} items",
             extra={"response": response},
         )
-        return TextMessage(role="assistant", content="error, unexpected response type from LLM")
+        return TextMessage(role="assistant", content=UNEXPECTED_RESPONSE_REPLY)
 
-    async def handle_function_call(self, tool_call: FunctionCallRequest) -> Optional[FunctionCallOutput]:
+    async def handle_function_call(
+        self, tool_call: FunctionCallRequest, speculation: Optional[Speculation] = None
+    ) -> Optional[FunctionCallOutput]:
         if tool_call.name in self.tools:
-            args = json.loads(tool_call.arguments)
-            # if the callable is an async function, await it, otherwise call it:
-            result = self.tools[tool_call.name]["ref"](**args)
-            if isawaitable(result):
-                result = await result
+            tool = self.tools[tool_call.name]
+            try:
+                args = self._parse_arguments(tool, tool_call.arguments)
+            except (ValidationError, ValueError) as e:
+                # Rejected here rather than deep inside the tool, and the model gets a chance to correct itself
+                logger.warning(f"Invalid arguments for {tool_call.name}: {e}")
+                TOOL_CALL_ERRORS.inc(tool=tool_call.name, reason="invalid_arguments")
+                return FunctionCallOutput(
+                    type="function_call_output",
+                    call_id=tool_call.call_id,
+                    output=json.dumps(
+                        {
+                            "error": f"Invalid arguments for {tool_call.name}",
+                            "details": (
+                                e.errors(include_url=False, include_context=False, include_input=False)
+                                if isinstance(e, ValidationError)
+                                else str(e)
+                            ),
+                        }
+                    ),
+                )
+
+            try:
+                result = await self._speculated_result(speculation, tool_call.name, args)
+                if result is _NOT_SPECULATED:
+                    result = await self._call_tool(tool_call.name, args)
+
+                # Encoders may also be sync or async, and may make calls of their own (e.g. for a baseline)
+                output = tool.get("encoder", json_encoder)(result)
+                if isawaitable(output):
+                    output = await output
+            except Exception as e:
+                # Reported to the model rather than failing the chat, it can retry or answer without the tool
+                if isinstance(e, CircuitOpen):
+                    logger.warning(f"Tool {tool_call.name} failed fast: {e}")
+                else:
+                    logger.exception(f"Tool {tool_call.name} failed")
+                reason = "circuit_open" if isinstance(e, CircuitOpen) else "exception"
+                TOOL_CALL_ERRORS.inc(tool=tool_call.name, reason=reason)
+                return FunctionCallOutput(
+                    type="function_call_output",
+                    call_id=tool_call.call_id,
+                    output=json.dumps(
+                        {"error": f"{tool_call.name} failed", "details": str(e) or type(e).__name__}
+                    ),
+                )
 
             # Create a new object to add to input
             return FunctionCallOutput(
                 type="function_call_output",
                 call_id=tool_call.call_id,
-                output=json.dumps(result),
+                output=output,
             )
         else:
             logger.error(f"No tool found for function call: {tool_call.name}", extra={"tool_call": tool_call})
             return None
 
+    async def _call_tool(self, name: str, args: dict[str, Any]) -> Any:
+        tool = self.tools[name]
+        async with self._tool_semaphore(name):
+            with timed(TOOL_CALL_SECONDS, "tools", tool=name):
+                # if the callable is an async function, await it, otherwise call it:
+                result = tool["ref"](**args)
+                if isawaitable(result):
+                    result = await result
+        return result
+
+    def speculate(self, messages: MessageList) -> Speculation:
+        """Start the speculative tool calls for a chat request, see the class docstring"""
+        speculation = Speculation()
+        for name in predict_default_calls(messages, self.speculative_tools):
+            # Bounded across all chats, so mispredictions can't crowd out the tool calls the model asks for
+            if self._speculative_calls >= self.max_speculative_calls:
+                SPECULATIVE_TOOL_CALLS.inc(tool=name, outcome="skipped")
+                continue
+            args = self._default_arguments(name)
+            self._speculative_calls += 1
+            task = asyncio.create_task(self._call_tool(name, args))
+            task.add_done_callback(self._speculative_call_done)
+            speculation.add(name, args, task)
+        return speculation
+
+    def _speculative_call_done(self, task: asyncio.Task) -> None:
+        self._speculative_calls -= 1
+        if not task.cancelled() and task.exception() is not None:
+            logger.debug(f"Speculative tool call failed: {task.exception()!r}")
+
+    async def _speculated_result(self, speculation: Optional[Speculation], name: str, args: dict[str, Any]) -> Any:
+        task = speculation.claim(name, args) if speculation is not None else None
+        if task is None:
+            return _NOT_SPECULATED
+        try:
+            result = await task
+        except Exception as e:
+            # Made again for real, as the model asked for it
+            logger.warning(f"Speculative call to {name} failed, calling it again: {e!r}")
+            SPECULATIVE_TOOL_CALLS.inc(tool=name, outcome="failed")
+            return _NOT_SPECULATED
+        SPECULATIVE_TOOL_CALLS.inc(tool=name, outcome="hit")
+        return result
+
+    def _default_arguments(self, name: str) -> dict[str, Any]:
+        validator = self.tools[name].get("validator")
+        if validator is None:
+            return {}
+        try:
+            return dict(validator.model_validate({}))
+        except ValidationError as e:
+            raise ValueError(f"Speculative tool {name} has required parameters") from e
+
+    @staticmethod
+    def _parse_arguments(tool: ToolBinding, arguments: str) -> dict[str, Any]:
+        validator = tool.get("validator")
+        if validator is None:
+            return json.loads(arguments)
+        # Parsed and coerced in one pass from the raw JSON, a shallow dict keeps the values as validated
+        return dict(validator.model_validate_json(arguments))
+
+    def _tool_semaphore(self, name: str) -> asyncio.Semaphore:
+        """Limits how many calls to a single tool run at once, across all chats"""
+        if name not in self._tool_semaphores:
+            limit = self.tools[name].get("max_concurrency", self._tool_concurrency)
+            self._tool_semaphores[name] = asyncio.Semaphore(limit)
+        return self._tool_semaphores[name]
+
     @classmethod
     def yield_responses(cls, response: Any) -> Iterable[tuple[str, Any]]:
         for output in response.output:
@@ -108,31 +554,66 @@ class OpenAITooledChat:
                 )
 
     @property
-    def tool_definitions(self) -> Iterable[FunctionToolParam]:
-        return [FunctionToolParam(**tool["schema"], strict=True) for tool in self.tools.values()]
+    def tool_definitions(self) -> list[FunctionToolParam]:
+        """The definitions sent with every request, built once as tools don't change after they're bound"""
+        if self._tool_definitions is None:
+            self._tool_definitions = [
+                cast(FunctionToolParam, tool.get("definition") or FunctionToolParam(**tool["schema"], strict=True))
+                for tool in self.tools.values()
+            ]
+            self._tools_version = hashlib.sha256(
+                json.dumps(self._tool_definitions, sort_keys=True, default=str).encode()
+            ).hexdigest()
+        return self._tool_definitions
+
+    @property
+    def tools_version(self) -> str:
+        """A hash of the tool definitions, identifying them in reply cache keys"""
+        self.tool_definitions
+        return self._tools_version
 
 
-def create_toolbinding(method: Callable, name: Optional[str] = None) -> ToolBinding:
+def create_toolbinding(
+    method: Callable,
+    name: Optional[str] = None,
+    max_concurrency: Optional[int] = None,
+    encoder: Optional[ToolOutputEncoder] = None,
+    description: Optional[str] = None,
+    parameters: Optional[type[BaseModel]] = None,
+) -> ToolBinding:
     """
     Create a ToolBinding object for a given method and name.
     If no name is provided, the method's name will be used.
+    If max_concurrency is provided, it overrides the default limit on concurrent calls to this tool.
+    If an encoder is provided, it's used instead of plain JSON to encode the tool's results for the LLM.
+    If a description is provided, it's used instead of the method's docstring.
+    If a parameters model is provided, it describes the method's parameters instead of its signature, for
+    methods generated at runtime, like those of a WorkbookRegistry.
+
+    The binding also carries the tool's definition for OpenAI, and a validator for its arguments, both built
+    once here rather than on every call.
     """
     if name is None:
         if method.__name__ is None:
             raise ValueError("Can't determine a tool name from the given method, consider providing one")
         name = method.__name__
 
-    signature = inspect.signature(method)
+    if parameters is None:
+        signature = inspect.signature(method)
 
-    # Dynamically create a Pydantic model for the method's parameters
-    fields: dict[str, tuple[str, Any]] = {
-        param_name: (param.annotation, param.default if param.default is not inspect.Parameter.empty else ...)
-        for param_name, param in signature.parameters.items()
-        if param_name != "self" and param.annotation is not inspect.Parameter.empty
-    }
+        # Dynamically create a Pydantic model for the method's parameters
+        fields: dict[str, tuple[str, Any]] = {
+            param_name: (param.annotation, param.default if param.default is not inspect.Parameter.empty else ...)
+            for param_name, param in signature.parameters.items()
+            if param_name != "self" and param.annotation is not inspect.Parameter.empty
+        }
 
-    # Generate JSON Schema for the parameters
-    parameter_schema = create_model(name + "Parameters", **fields).model_json_schema()  # type: ignore[call-overload]
+        # The model validates the arguments we're sent, and its JSON Schema describes them to OpenAI. Unknown
+        # arguments are rejected, as they are by the schema.
+        parameters = create_model(  # type: ignore[call-overload]
+            name + "Parameters", __config__=ConfigDict(extra="forbid"), **fields
+        )
+    parameter_schema = parameters.model_json_schema()
 
     # Remove 'default' from all properties (OpenAI rejects default values in the schema)
     for prop in parameter_schema["properties"].values():
@@ -140,14 +621,22 @@ def create_toolbinding(method: Callable, name: Optional[str] = None) -> ToolBind
 
     # OpenAI demands all schemas have additionalProperties=false and all parameters are required..
     parameter_schema["additionalProperties"] = False
-    parameter_schema["required"] = list([str(field) for field in fields.keys()])
+    parameter_schema["required"] = list(parameters.model_fields)
 
-    return {
+    schema: ToolDefinition = {
+        "type": "function",
+        "name": name,
+        "description": description if description is not None else (method.__doc__ or "").strip(),
+        "parameters": parameter_schema,
+    }
+    toolbinding: ToolBinding = {
         "ref": method,
-        "schema": {
-            "type": "function",
-            "name": name,
-            "description": (method.__doc__ or "").strip(),
-            "parameters": parameter_schema,
-        },
+        "schema": schema,
+        "definition": FunctionToolParam(**schema, strict=True),
+        "validator": parameters,
     }
+    if max_concurrency is not None:
+        toolbinding["max_concurrency"] = max_concurrency
+    if encoder is not None:
+        toolbinding["encoder"] = encoder
+    return toolbinding
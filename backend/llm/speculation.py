@@ -0,0 +1,59 @@
+import asyncio
+import json
+import logging
+from typing import Any, Optional
+
+from backend.metrics import SPECULATIVE_TOOL_CALLS
+from backend.types import FunctionCallRequest, MessageList, TextMessage, canonical_arguments
+
+logger = logging.getLogger(__name__)
+
+
+def arguments_key(name: str, arguments: dict[str, Any]) -> tuple[str, str]:
+    """Identifies a tool call by its validated arguments, null ones are the same as those left out"""
+    return name, json.dumps({k: v for k, v in arguments.items() if v is not None}, sort_keys=True, default=str)
+
+
+def predict_default_calls(messages: MessageList, tool_names: tuple[str, ...]) -> list[str]:
+    """
+    The tools the model is likely to call with their default arguments next: at the start of a turn, those of
+    tool_names the conversation hasn't already called that way (their results are already in its history).
+    """
+    if not tool_names or not messages:
+        return []
+    last = messages[-1]
+    if not (isinstance(last, TextMessage) and last.role == "user"):
+        return []
+    called = {
+        m.name for m in messages if isinstance(m, FunctionCallRequest) and canonical_arguments(m.arguments) == "{}"
+    }
+    return [name for name in tool_names if name not in called]
+
+
+class Speculation:
+    """
+    Tool calls started speculatively for a single chat request, while waiting on OpenAI. A call the model then
+    asks for with matching arguments claims the speculative call's result, and once the request is done any
+    left unclaimed are cancelled.
+    """
+
+    def __init__(self) -> None:
+        self._tasks: dict[tuple[str, str], asyncio.Task] = {}
+
+    def add(self, name: str, arguments: dict[str, Any], task: asyncio.Task) -> None:
+        self._tasks[arguments_key(name, arguments)] = task
+
+    def claim(self, name: str, arguments: dict[str, Any]) -> Optional[asyncio.Task]:
+        return self._tasks.pop(arguments_key(name, arguments), None)
+
+    def close(self) -> None:
+        for (name, _), task in self._tasks.items():
+            SPECULATIVE_TOOL_CALLS.inc(tool=name, outcome="unused")
+            task.cancel()
+        self._tasks.clear()
+
+    def __enter__(self) -> "Speculation":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
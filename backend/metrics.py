@@ -0,0 +1,227 @@
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Callable, Iterator, Optional
+
+LabelValues = tuple[tuple[str, str], ...]
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _labels(labels: dict[str, str]) -> LabelValues:
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(labels: LabelValues, extra: Optional[tuple[str, str]] = None) -> str:
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if value != float("inf") else "+Inf"
+
+
+class Counter:
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._values: dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = _labels(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(_labels(labels), 0)
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for labels, value in self._values.items():
+            yield f"{self.name}{_format_labels(labels)} {_format_value(value)}"
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        # Per label set: a count per bucket (plus one for +Inf), the sum and the count of observations
+        self._values: dict[LabelValues, tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = _labels(labels)
+        if key not in self._values:
+            self._values[key] = ([0] * (len(self.buckets) + 1), [0.0, 0.0])
+        bucket_counts, totals = self._values[key]
+        bucket_counts[bisect_left(self.buckets, value)] += 1
+        totals[0] += value
+        totals[1] += 1
+
+    def count(self, **labels: str) -> int:
+        values = self._values.get(_labels(labels))
+        return int(values[1][1]) if values else 0
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for labels, (bucket_counts, (total, count)) in self._values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), bucket_counts):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket{_format_labels(labels, ('le', _format_value(bound)))} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(labels)} {_format_value(total)}"
+            yield f"{self.name}_count{_format_labels(labels)} {_format_value(count)}"
+
+
+class CallbackMetric:
+    """A metric whose value is read from elsewhere (e.g. a cache's own counters) whenever it's rendered"""
+
+    def __init__(self, name: str, help: str, type: str, callback: Callable[[], float]):
+        self.name = name
+        self.help = help
+        self.type = type
+        self.callback = callback
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.type}"
+        yield f"{self.name} {_format_value(self.callback())}"
+
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        self._metrics: dict[str, Counter | Histogram | CallbackMetric] = {}
+
+    def counter(self, name: str, help: str) -> Counter:
+        return self._register(Counter(name, help))
+
+    def histogram(self, name: str, help: str, buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, buckets))
+
+    def callback(self, name: str, help: str, callback: Callable[[], float], type: str = "gauge") -> CallbackMetric:
+        # Callbacks are re-registered whenever the object they read from is recreated
+        self._metrics.pop(name, None)
+        return self._register(CallbackMetric(name, help, type, callback))
+
+    def _register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format"""
+        return "\n".join(line for metric in self._metrics.values() for line in metric.render()) + "\n"
+
+
+@dataclass
+class RequestTimings:
+    """Time spent per span during a single request, for the optional Server-Timing response header"""
+
+    spans: dict[str, float] = field(default_factory=dict)
+
+    def add(self, span: str, seconds: float) -> None:
+        self.spans[span] = self.spans.get(span, 0.0) + seconds
+
+    def server_timing(self) -> str:
+        return ", ".join(f"{span};dur={seconds * 1000:.1f}" for span, seconds in self.spans.items())
+
+
+# Set for the duration of each request, and inherited by the tasks it starts
+current_timings: ContextVar[Optional[RequestTimings]] = ContextVar("current_timings", default=None)
+
+
+@contextmanager
+def timed(histogram: Histogram, span: str, **labels: str) -> Iterator[None]:
+    """Observe the time spent in the block, and add it to the current request's timings under span"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        _observe(histogram, span, time.perf_counter() - started, labels)
+
+
+class Stopwatch:
+    """
+    Like timed(), for time spent across several separate blocks, e.g. reading a stream but not the time its
+    consumer takes in between. Observed once, as a whole.
+    """
+
+    def __init__(self) -> None:
+        self.elapsed = 0.0
+
+    @contextmanager
+    def running(self) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.elapsed += time.perf_counter() - started
+
+    def observe(self, histogram: Histogram, span: str, **labels: str) -> None:
+        _observe(histogram, span, self.elapsed, labels)
+
+
+def _observe(histogram: Histogram, span: str, elapsed: float, labels: dict[str, str]) -> None:
+    histogram.observe(elapsed, **labels)
+    timings = current_timings.get()
+    if timings is not None:
+        timings.add(span, elapsed)
+
+
+@contextmanager
+def request_timings() -> Iterator[RequestTimings]:
+    timings = RequestTimings()
+    token = current_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        current_timings.reset(token)
+
+
+metrics = MetricsRegistry()
+
+CHAT_REQUEST_SECONDS = metrics.histogram("chat_request_seconds", "Time to handle a chat request")
+CHAT_ABANDONED = metrics.counter(
+    "chat_abandoned_total", "Chat requests cancelled because the client disconnected or the deadline expired"
+)
+REQUEST_PARSE_SECONDS = metrics.histogram("chat_request_parse_seconds", "Time to parse a chat request payload")
+OPENAI_ROUND_SECONDS = metrics.histogram("openai_round_seconds", "Time for one OpenAI response round trip")
+OPENAI_INPUT_ENCODE_SECONDS = metrics.histogram(
+    "openai_input_encode_seconds", "Time to serialize the message history sent to OpenAI"
+)
+HISTORY_TOKENS_SAVED = metrics.histogram(
+    "openai_history_tokens_saved",
+    "Tokens saved per OpenAI request by compacting the history sent",
+    buckets=(0, 100, 500, 1000, 2500, 5000, 10000, 25000, 50000),
+)
+OPENAI_TOKENS = metrics.counter("openai_tokens_total", "Tokens used by OpenAI responses")
+CHAT_TOKENS = metrics.histogram(
+    "chat_tokens",
+    "OpenAI tokens used per chat request",
+    buckets=(100, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000),
+)
+TOOL_CALL_SECONDS = metrics.histogram("tool_call_seconds", "Time to run a tool call")
+TOOL_CALL_ERRORS = metrics.counter("tool_call_errors_total", "Tool calls that failed, by tool and reason")
+SPECULATIVE_TOOL_CALLS = metrics.counter(
+    "speculative_tool_calls_total",
+    "Tool calls made speculatively while waiting on OpenAI, by tool and outcome (hit, unused, failed or skipped)",
+)
+TOOL_ROUNDS = metrics.histogram(
+    "chat_tool_rounds", "Rounds of tool calls per chat request", buckets=(0, 1, 2, 3, 4, 5, 8, 10)
+)
+UPSTREAM_RETRIES = metrics.counter(
+    "upstream_retries_total", "Calls to OpenAI or GRID retried after a transient error"
+)
+UPSTREAM_HEDGED_REQUESTS = metrics.counter(
+    "upstream_hedged_requests_total", "Duplicate calls made to slow upstream calls, by outcome (sent or won)"
+)
+CIRCUIT_BREAKER_EVENTS = metrics.counter(
+    "circuit_breaker_events_total", "Circuit breaker state changes and calls it rejected, by upstream and event"
+)
+GRID_CALC_SECONDS = metrics.histogram("grid_calc_seconds", "Time for an upstream GRID workbooks.calc call")
@@ -0,0 +1,209 @@
+import asyncio
+import random
+import time
+from collections import deque
+from typing import Awaitable, Callable, Optional, TypeVar
+
+import grid_api
+import openai
+
+from .config import AppConfig
+from .limits import remaining_seconds
+from .metrics import CIRCUIT_BREAKER_EVENTS, UPSTREAM_HEDGED_REQUESTS, UPSTREAM_RETRIES
+
+T = TypeVar("T")
+
+# Status codes worth another try: timeouts, conflicts, rate limits and server errors
+_TRANSIENT_STATUS_CODES = frozenset({408, 409, 429})
+
+
+def is_transient(error: BaseException) -> bool:
+    """Whether an error from OpenAI or GRID may well not happen again, so the call is worth retrying"""
+    if isinstance(error, (openai.APIConnectionError, grid_api.APIConnectionError)):
+        return True
+    if isinstance(error, (openai.APIStatusError, grid_api.APIStatusError)):
+        return error.status_code in _TRANSIENT_STATUS_CODES or error.status_code >= 500
+    return False
+
+
+class CircuitOpen(Exception):
+    """Raised instead of calling an upstream that has been failing, until it's time to try it again"""
+
+    def __init__(self, upstream: str, retry_after: float):
+        super().__init__(f"{upstream} is unavailable, try again in {retry_after:.0f}s")
+        self.upstream = upstream
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Opens after failure_threshold consecutive transient failures, and then fails calls fast for reset_seconds.
+    After that a single call is let through to probe the upstream: its success closes the circuit again, its
+    failure keeps it open for another reset_seconds.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int,
+        reset_seconds: float,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._clock = clock
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    def check(self) -> None:
+        """Raises CircuitOpen if the call shouldn't be made"""
+        if self.opened_at is None:
+            return
+        now = self._clock()
+        if now - self.opened_at >= self.reset_seconds:
+            # This call is the probe, the next one waits another reset_seconds unless it succeeds
+            self.opened_at = now
+            return
+        CIRCUIT_BREAKER_EVENTS.inc(upstream=self.name, event="rejected")
+        raise CircuitOpen(self.name, self.opened_at + self.reset_seconds - now)
+
+    def record_success(self) -> None:
+        if self.opened_at is not None:
+            CIRCUIT_BREAKER_EVENTS.inc(upstream=self.name, event="closed")
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.failures >= self.failure_threshold:
+            if self.opened_at is None:
+                CIRCUIT_BREAKER_EVENTS.inc(upstream=self.name, event="opened")
+            self.opened_at = self._clock()
+
+
+class LatencyTracker:
+    """Latencies of the most recent calls, for percentiles"""
+
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        self.min_samples = min_samples
+        self._latencies: deque[float] = deque(maxlen=window)
+
+    def add(self, seconds: float) -> None:
+        self._latencies.append(seconds)
+
+    def percentile(self, percentile: float) -> Optional[float]:
+        """The given percentile (0-100) of recent latencies, or None until there have been enough calls"""
+        if len(self._latencies) < self.min_samples:
+            return None
+        latencies = sorted(self._latencies)
+        return latencies[min(int(len(latencies) * percentile / 100), len(latencies) - 1)]
+
+
+class ResilientUpstream:
+    """
+    Calls to an upstream (OpenAI or GRID), made resilient:
+    - transient errors are retried, up to max_attempts in all, after a jittered exponential backoff ("full
+      jitter", so retries from many chats don't arrive in lockstep). Retries are bounded by the current request's
+      deadline too: there's no retry once its backoff would take up the time that's left.
+    - with a circuit breaker, calls fail fast with CircuitOpen while the upstream keeps failing
+    - with hedge_percentile, a duplicate call is made once a call has taken longer than that percentile of
+      recent calls, and whichever finishes first is used. Only for idempotent calls, like GRID calculations.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_attempts: int = 3,
+        base_delay: float = 0.2,
+        max_delay: float = 2.0,
+        breaker: Optional[CircuitBreaker] = None,
+        hedge_percentile: Optional[float] = None,
+    ):
+        self.name = name
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breaker = breaker
+        self.hedge_percentile = hedge_percentile
+        self.latencies = LatencyTracker()
+
+    @classmethod
+    def from_config(cls, name: str, config: AppConfig, hedge: bool = False) -> "ResilientUpstream":
+        return cls(
+            name,
+            max_attempts=config.UPSTREAM_MAX_ATTEMPTS,
+            base_delay=config.UPSTREAM_RETRY_BASE_DELAY_SECONDS,
+            max_delay=config.UPSTREAM_RETRY_MAX_DELAY_SECONDS,
+            breaker=(
+                CircuitBreaker(name, config.CIRCUIT_BREAKER_FAILURES, config.CIRCUIT_BREAKER_RESET_SECONDS)
+                if config.CIRCUIT_BREAKER_FAILURES > 0
+                else None
+            ),
+            hedge_percentile=config.GRID_HEDGE_PERCENTILE if hedge and config.GRID_HEDGE_PERCENTILE > 0 else None,
+        )
+
+    async def call(self, attempt: Callable[[], Awaitable[T]]) -> T:
+        """Make the call attempt() makes, resiliently. attempt is called afresh for every try."""
+        attempts = 0
+        while True:
+            attempts += 1
+            if self.breaker is not None:
+                self.breaker.check()
+            started = time.monotonic()
+            try:
+                result = await (self._hedged(attempt) if self.hedge_percentile is not None else attempt())
+            except Exception as e:
+                if not is_transient(e):
+                    # The upstream did answer, it's the call that's wrong
+                    if self.breaker is not None:
+                        self.breaker.record_success()
+                    raise
+                remaining = remaining_seconds()
+                if remaining is not None and remaining <= 0:
+                    # Timed out at the request's deadline, which says nothing about the upstream's health
+                    raise
+                if self.breaker is not None:
+                    self.breaker.record_failure()
+                delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempts - 1)))
+                if attempts >= self.max_attempts or (remaining is not None and delay >= remaining):
+                    raise
+                UPSTREAM_RETRIES.inc(upstream=self.name)
+                await asyncio.sleep(delay)
+                continue
+            if self.breaker is not None:
+                self.breaker.record_success()
+            self.latencies.add(time.monotonic() - started)
+            return result
+
+    async def _hedged(self, attempt: Callable[[], Awaitable[T]]) -> T:
+        assert self.hedge_percentile is not None
+        hedge_after = self.latencies.percentile(self.hedge_percentile)
+        if hedge_after is None:
+            return await attempt()
+
+        tasks = [asyncio.ensure_future(attempt())]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+            if not done:
+                UPSTREAM_HEDGED_REQUESTS.inc(upstream=self.name, outcome="sent")
+                tasks.append(asyncio.ensure_future(attempt()))
+            pending = set(tasks)
+            while True:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                # Prefer a success, a failure only counts once there's nothing else left to wait for
+                for task in done:
+                    if task.exception() is None:
+                        if task is not tasks[0]:
+                            UPSTREAM_HEDGED_REQUESTS.inc(upstream=self.name, outcome="won")
+                        return task.result()
+                if not pending:
+                    return done.pop().result()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,59 @@
+import asyncio
+import secrets
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Iterator, Optional
+
+from .cache import TTLCache
+from .types import MessageList
+
+
+@dataclass
+class ChatSession:
+    """
+    Conversation state kept on the server, so clients only need to send new messages each turn.
+
+    When OpenAI response chaining is in use, previous_response_id is the last OpenAI response in the
+    conversation, which already holds every message before index `synced`. Only messages from there on need to
+    be sent upstream.
+    """
+
+    session_id: str
+    messages: MessageList = field(default_factory=list)
+    previous_response_id: Optional[str] = None
+    synced: int = 0
+    # Turns in the same session are serialized, they'd otherwise interleave their messages
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock, repr=False)
+
+    @contextmanager
+    def rollback_on_error(self) -> Iterator[None]:
+        """Restore the session if the turn in the block fails or is cancelled, so turns are all or nothing"""
+        length, previous_response_id, synced = len(self.messages), self.previous_response_id, self.synced
+        try:
+            yield
+        except BaseException:
+            del self.messages[length:]
+            self.previous_response_id, self.synced = previous_response_id, synced
+            raise
+
+
+class SessionStore:
+    """A bounded, in-process store of chat sessions, evicting the least recently used and idle sessions"""
+
+    def __init__(self, max_sessions: int, ttl_seconds: Optional[float] = None):
+        self._sessions: TTLCache[str, ChatSession] = TTLCache(max_sessions, ttl_seconds)
+
+    def create(self) -> ChatSession:
+        session = ChatSession(session_id=secrets.token_urlsafe(16))
+        self._sessions.set(session.session_id, session)
+        return session
+
+    def get(self, session_id: str) -> Optional[ChatSession]:
+        return self._sessions.get(session_id)
+
+    def save(self, session: ChatSession) -> None:
+        # Re-setting the session restarts its time-to-live
+        self._sessions.set(session.session_id, session)
+
+    def __len__(self) -> int:
+        return len(self._sessions)
@@ -0,0 +1,198 @@
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, Optional
+
+from grid_api.types import WorkbookCalcResponse
+from pydantic import TypeAdapter
+
+if TYPE_CHECKING:
+    from .grid import CalcKey
+
+_responses: TypeAdapter[WorkbookCalcResponse] = TypeAdapter(WorkbookCalcResponse)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS workbook_versions (
+    workbook_id TEXT PRIMARY KEY,
+    version INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    workbook_id TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    value BLOB NOT NULL,
+    stored_at REAL NOT NULL,
+    expires_at REAL
+);
+CREATE INDEX IF NOT EXISTS results_stored_at ON results (stored_at);
+"""
+
+
+def _hash_key(key: "CalcKey") -> str:
+    return hashlib.sha256(json.dumps(key, separators=(",", ":")).encode()).hexdigest()
+
+
+class SharedResultStore:
+    """
+    GRID calculation results shared by every worker process on a host, in a local SQLite database in WAL mode,
+    so readers never block on writers. Used as a second level cache behind each worker's in-process TTLCache.
+
+    Results are stored against their workbook's version. invalidate() bumps the version, which makes every
+    result for the workbook stale for all workers at once, including results still being calculated: set()
+    only stores a result if the workbook's version is still the one get() saw before the calculation.
+
+    changed_workbooks() tells a worker which workbooks have been invalidated since it last asked, so it can drop
+    what it holds for them itself.
+
+    Writes are atomic, and once there are more than max_entries results the oldest are evicted. Expiry and
+    eviction go by when a result was stored, so reads stay read-only.
+
+    SQLite calls are blocking, so they're run in a worker thread, one at a time per process.
+    """
+
+    def __init__(
+        self,
+        path: str | Path,
+        max_entries: int = 100_000,
+        ttl_seconds: Optional[float] = None,
+        clock: Callable[[], float] = time.time,
+    ):
+        if max_entries < 1:
+            raise ValueError("SharedResultStore needs room for at least one entry")
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._writes_since_eviction = 0
+        self._seen_versions: Optional[dict[str, int]] = None
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5.0)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript(_SCHEMA)
+
+    async def get(self, key: "CalcKey") -> tuple[Optional[WorkbookCalcResponse], int]:
+        """The stored result for key, if any, and the workbook's current version to pass on to set()"""
+        value, version = await asyncio.to_thread(self._get, key)
+        if value is None:
+            self.misses += 1
+            return None, version
+        self.hits += 1
+        return _responses.validate_json(value), version
+
+    async def set(self, key: "CalcKey", value: WorkbookCalcResponse, version: int) -> None:
+        await asyncio.to_thread(self._set, key, _responses.dump_json(value), version)
+
+    async def invalidate(self, workbook_id: str) -> int:
+        """Make every stored result for a workbook stale, returns the number of results dropped"""
+        return await asyncio.to_thread(self._invalidate, workbook_id)
+
+    async def changed_workbooks(self) -> list[str]:
+        """
+        The workbooks invalidated, by any worker, since the last call. The first call only takes note of their
+        versions.
+        """
+        versions = await asyncio.to_thread(self._versions)
+        seen = self._seen_versions
+        self._seen_versions = versions
+        if seen is None:
+            return []
+        return [workbook_id for workbook_id, version in versions.items() if seen.get(workbook_id, 0) != version]
+
+    @property
+    def stats(self) -> dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses}
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+    def _get(self, key: "CalcKey") -> tuple[Optional[bytes], int]:
+        with self._lock:
+            version_row = self._connection.execute(
+                "SELECT version FROM workbook_versions WHERE workbook_id = ?", (key[0],)
+            ).fetchone()
+            version = version_row[0] if version_row is not None else 0
+            row = self._connection.execute(
+                """
+                SELECT value FROM results
+                WHERE key = ? AND version = ? AND (expires_at IS NULL OR expires_at > ?)
+                """,
+                (_hash_key(key), version, self._clock()),
+            ).fetchone()
+        return (row[0] if row is not None else None), version
+
+    def _versions(self) -> dict[str, int]:
+        with self._lock:
+            return dict(self._connection.execute("SELECT workbook_id, version FROM workbook_versions").fetchall())
+
+    def _set(self, key: "CalcKey", value: bytes, version: int) -> None:
+        now = self._clock()
+        workbook_id = key[0]
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                self._connection.execute(
+                    "INSERT INTO workbook_versions (workbook_id, version) VALUES (?, 0) ON CONFLICT DO NOTHING",
+                    (workbook_id,),
+                )
+                self._connection.execute(
+                    """
+                    INSERT OR REPLACE INTO results (key, workbook_id, version, value, stored_at, expires_at)
+                    SELECT ?, workbook_id, version, ?, ?, ? FROM workbook_versions
+                    WHERE workbook_id = ? AND version = ?
+                    """,
+                    (
+                        _hash_key(key),
+                        value,
+                        now,
+                        now + self.ttl_seconds if self.ttl_seconds is not None else None,
+                        workbook_id,
+                        version,
+                    ),
+                )
+                self._writes_since_eviction += 1
+                # Counting rows isn't free, so the bound is only enforced every so often
+                if self._writes_since_eviction >= max(1, self.max_entries // 100):
+                    self._writes_since_eviction = 0
+                    self._evict()
+                self._connection.execute("COMMIT")
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+
+    def _evict(self) -> None:
+        self._connection.execute(
+            "DELETE FROM results WHERE expires_at IS NOT NULL AND expires_at <= ?", (self._clock(),)
+        )
+        (count,) = self._connection.execute("SELECT COUNT(*) FROM results").fetchone()
+        if count > self.max_entries:
+            self._connection.execute(
+                "DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY stored_at LIMIT ?)",
+                (count - self.max_entries,),
+            )
+
+    def _invalidate(self, workbook_id: str) -> int:
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                self._connection.execute(
+                    """
+                    INSERT INTO workbook_versions (workbook_id, version) VALUES (?, 1)
+                    ON CONFLICT (workbook_id) DO UPDATE SET version = version + 1
+                    """,
+                    (workbook_id,),
+                )
+                dropped = self._connection.execute(
+                    "DELETE FROM results WHERE workbook_id = ?", (workbook_id,)
+                ).rowcount
+                self._connection.execute("COMMIT")
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+        return dropped
@@ -0,0 +1,206 @@
+import logging
+import random
+from typing import Any, Iterable, Mapping, Sequence
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+ScenarioParameters = Mapping[str, str | int | float | bool | None]
+
+
+class RevenueSurrogate:
+    """
+    An in-process reimplementation of the Project X Revenue Model's monthly recurrence, evaluating any number of
+    scenarios in one vectorized pass instead of a GRID round trip each.
+
+    The recurrence is reconstructed from what the model's inputs describe, rather than read out of the workbook,
+    so it must be calibrated with the workbook's defaults and verified against GRID before it is trusted:
+    `verified` only becomes true once verify() has seen it agree with GRID results within tolerance, and even then
+    it's only trusted with scenarios changing the parameters verify() saw changed (see can_forecast()). A
+    workbook can still have thresholds or clamps the recurrence doesn't, so verification_scenarios() covers
+    several values of each parameter and mixes of them, and agrees() lets forecasts be spot checked later on.
+
+    Each month:
+    - visitors are the paid visitors bought by the ad budget, plus the organic visitors brought in by last month's
+      registered and subscribed users
+    - registrations convert from visitors, after the registration lag
+    - new subscriptions convert from registrations, after the subscription lag
+    - subscribers grow by new subscriptions and shrink by churn on last month's subscribers
+    - revenue is subscribers times the subscription price, split into existing and new subscribers
+    """
+
+    months = 36
+    parameters = (
+        "ad_budget",
+        "ad_cpc",
+        "registration_conversion_rate",
+        "subscription_conversion_rate",
+        "registration_conversion_lag_in_months",
+        "subscription_conversion_lag_in_months",
+        "churn_rate",
+        "customer_lifetime_length_in_months",
+        "virality_per_registered_user",
+        "virality_per_subscribed_user",
+        "subscription_price",
+    )
+    # Not part of the recurrence, so scenarios changing these are always left to GRID
+    unmodeled = frozenset({"customer_lifetime_length_in_months"})
+    # Whole numbers of months
+    integral = frozenset({"registration_conversion_lag_in_months", "subscription_conversion_lag_in_months"})
+    # Values each parameter is verified at, relative to its default
+    verification_factors = (0.5, 1.5, 3.0)
+
+    def __init__(self) -> None:
+        self.defaults: dict[str, float] = {}
+        self.verified = False
+        self.verified_parameters: frozenset[str] = frozenset()
+        self.relative_tolerance = 0.0
+
+    def calibrate(self, defaults: ScenarioParameters) -> None:
+        """Set the values used for any parameter a scenario doesn't supply, from the workbook's own defaults"""
+        missing = [name for name in self.parameters if not isinstance(defaults.get(name), (int, float))]
+        if missing:
+            raise ValueError(f"Can't calibrate without numeric defaults for {missing}")
+        self.defaults = {name: float(defaults[name]) for name in self.parameters}  # type: ignore[arg-type]
+        self.reset()
+
+    def reset(self) -> None:
+        """Distrust the surrogate until it's verified again, e.g. once the workbook has changed"""
+        self.verified = False
+        self.verified_parameters = frozenset()
+
+    def can_forecast(self, scenarios: Sequence[ScenarioParameters]) -> bool:
+        """Whether the surrogate is verified for every parameter the scenarios change"""
+        return self.verified and all(
+            name in self.verified_parameters
+            for scenario in scenarios
+            for name, value in scenario.items()
+            if value is not None
+        )
+
+    def verification_scenarios(self) -> list[dict[str, float]]:
+        """Scenarios to verify() against first: the default one, and each modeled parameter at several values"""
+        scenarios: list[dict[str, float]] = [{}]
+        for name in self.defaults:
+            if name not in self.unmodeled:
+                scenarios += [{name: value} for value in self._verification_values(name)]
+        return scenarios
+
+    def combination_scenarios(
+        self, parameters: Iterable[str], count: int = 4, seed: int = 0
+    ) -> list[dict[str, float]]:
+        """Scenarios changing all the given parameters at once, to verify() that they also agree in combination"""
+        values = {name: self._verification_values(name) for name in sorted(parameters)}
+        rng = random.Random(seed)
+        return [{name: rng.choice(name_values) for name, name_values in values.items()} for _ in range(count)]
+
+    def _verification_values(self, name: str) -> list[float]:
+        default = self.defaults[name]
+        values = [default * factor if default else factor for factor in self.verification_factors]
+        if name in self.integral:
+            values = [float(round(value)) for value in values]
+        return sorted({value for value in values if value != default})
+
+    def evaluate(self, scenarios: Sequence[ScenarioParameters]) -> dict[str, np.ndarray]:
+        """
+        Evaluate every scenario at once, returning an array of shape (len(scenarios), months) for each output.
+        Parameters a scenario leaves out (or sets to None) take the calibrated defaults.
+        """
+        if not self.defaults:
+            raise RuntimeError("RevenueSurrogate must be calibrated before it can evaluate scenarios")
+
+        p = {
+            name: np.array([s[name] if s.get(name) is not None else default for s in scenarios], dtype=np.float64)
+            for name, default in self.defaults.items()
+        }
+        n = len(scenarios)
+        rows = np.arange(n)
+        registration_lag = np.rint(p["registration_conversion_lag_in_months"]).astype(np.int64)
+        subscription_lag = np.rint(p["subscription_conversion_lag_in_months"]).astype(np.int64)
+        paid_visitors = np.divide(p["ad_budget"], p["ad_cpc"], out=np.zeros(n), where=p["ad_cpc"] != 0)
+
+        visitors = np.zeros((n, self.months))
+        registrations = np.zeros((n, self.months))
+        new_subscriptions = np.zeros((n, self.months))
+        subscribers = np.zeros((n, self.months))
+        registered_users: np.ndarray = np.zeros(n)
+        previous_subscribers: np.ndarray = np.zeros(n)
+
+        def lagged(history: np.ndarray, month: int, lag: np.ndarray) -> np.ndarray:
+            source = month - lag
+            return np.where(source >= 0, history[rows, np.clip(source, 0, None)], 0.0)
+
+        for month in range(self.months):
+            visitors[:, month] = (
+                paid_visitors
+                + p["virality_per_registered_user"] * registered_users
+                + p["virality_per_subscribed_user"] * previous_subscribers
+            )
+            registrations[:, month] = lagged(visitors, month, registration_lag) * p["registration_conversion_rate"]
+            registered_users = registered_users + registrations[:, month]
+            new_subscriptions[:, month] = (
+                lagged(registrations, month, subscription_lag) * p["subscription_conversion_rate"]
+            )
+            subscribers[:, month] = previous_subscribers * (1 - p["churn_rate"]) + new_subscriptions[:, month]
+            previous_subscribers = subscribers[:, month]
+
+        price = p["subscription_price"][:, np.newaxis]
+        return {
+            "Subscribers": subscribers,
+            "Monthly Recurring Revenue": subscribers * price,
+            "Revenue from Existing subscribers": (subscribers - new_subscriptions) * price,
+            "Revenue from New subscribers": new_subscriptions * price,
+        }
+
+    def forecast(
+        self, scenarios: Sequence[ScenarioParameters], labels: Sequence[str]
+    ) -> list[dict[str, list[Any]]]:
+        """Evaluate the scenarios, shaped like the series ProjectXRevenueModel reads back from GRID"""
+        outputs = self.evaluate(scenarios)
+        return [{label: outputs[label][i].tolist() for label in labels} for i in range(len(scenarios))]
+
+    def verify(
+        self,
+        references: Sequence[tuple[ScenarioParameters, Mapping[str, Sequence[Any]]]],
+        relative_tolerance: float,
+    ) -> float:
+        """
+        Compare against (scenario, GRID forecast) pairs. The surrogate is verified if it agrees within the relative
+        tolerance on the default scenario (the pair with an empty scenario), and verified for each parameter
+        changed only by scenarios it agrees on too. Returns the largest relative error seen.
+        """
+        labels = list(references[0][1])
+        forecasts = self.forecast([scenario for scenario, _ in references], labels)
+        errors = [self._error(forecast, expected) for forecast, (_, expected) in zip(forecasts, references)]
+
+        changed = [{name for name, value in scenario.items() if value is not None} for scenario, _ in references]
+        defaults_agree = [error <= relative_tolerance for error, names in zip(errors, changed) if not names]
+        self.verified = bool(defaults_agree) and all(defaults_agree)
+        agreed = {name for error, names in zip(errors, changed) if error <= relative_tolerance for name in names}
+        disagreed = {name for error, names in zip(errors, changed) if error > relative_tolerance for name in names}
+        self.verified_parameters = frozenset(agreed - disagreed) - self.unmodeled if self.verified else frozenset()
+        self.relative_tolerance = relative_tolerance
+        max_error = max(errors)
+        logger.info(
+            f"Revenue surrogate verification: max relative error {max_error:.3g}, verified={self.verified} "
+            f"for {sorted(self.verified_parameters)}"
+        )
+        return max_error
+
+    def agrees(self, forecast: Mapping[str, Sequence[Any]], expected: Mapping[str, Sequence[Any]]) -> bool:
+        """Whether a forecast agrees with GRID's within the tolerance it was verified to"""
+        return self._error(forecast, expected) <= self.relative_tolerance
+
+    @staticmethod
+    def _error(forecast: Mapping[str, Sequence[Any]], expected: Mapping[str, Sequence[Any]]) -> float:
+        # The largest relative error over every month of every output
+        scenario_error = 0.0
+        for label in expected:
+            actual = np.asarray(forecast[label], dtype=np.float64)
+            target = np.asarray(expected[label], dtype=np.float64)
+            if actual.shape != target.shape:
+                return float("inf")
+            error = np.abs(actual - target) / np.maximum(np.abs(target), 1.0)
+            scenario_error = max(scenario_error, float(error.max(initial=0.0)))
+        return scenario_error
@@ -1,6 +1,7 @@
-from typing import Callable, Literal, TypedDict
+import json
+from typing import Annotated, Any, Awaitable, Callable, Literal, Mapping, NotRequired, Optional, TypedDict, Union
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Discriminator, Tag, TypeAdapter
 
 
 class TextMessage(BaseModel):
@@ -15,19 +16,56 @@ class FunctionCallRequest(BaseModel):
     call_id: str
 
 
+def canonical_arguments(arguments: str) -> str:
+    """A function call's JSON arguments, normalized so that calls with the same arguments compare equal"""
+    try:
+        parsed = json.loads(arguments)
+    except ValueError:
+        return arguments
+    if isinstance(parsed, dict):
+        # Strict mode tools are sent every parameter, with null for those left at their defaults
+        parsed = {key: value for key, value in parsed.items() if value is not None}
+    return json.dumps(parsed, sort_keys=True)
+
+
 class FunctionCallOutput(BaseModel):
     type: Literal["function_call_output"]
     call_id: str
     output: str
 
 
-Message = TextMessage | FunctionCallRequest | FunctionCallOutput
+def _message_type(message: Any) -> str:
+    # Text messages are sent without a type, as in OpenAI's input messages
+    if isinstance(message, dict):
+        return message.get("type", "message")
+    return getattr(message, "type", "message")
+
+
+# Discriminated on type, so each message is validated against just the one model it claims to be
+Message = Annotated[
+    Union[
+        Annotated[TextMessage, Tag("message")],
+        Annotated[FunctionCallRequest, Tag("function_call")],
+        Annotated[FunctionCallOutput, Tag("function_call_output")],
+    ],
+    Discriminator(_message_type),
+]
 
 MessageList = list[Message]
 
+# Dumps a whole message list in a single pass, rather than a model_dump() call per message. Serializing picks
+# each message's model by its class, so this skips calling the discriminator for every message.
+message_list_adapter: TypeAdapter[MessageList] = TypeAdapter(
+    list[TextMessage | FunctionCallRequest | FunctionCallOutput]
+)
+
 
 class ChatRequest(BaseModel):
     messages: MessageList
+    # Continue a server-side session, sending only the new messages
+    session_id: Optional[str] = None
+    # Start a server-side session with these messages, the response carries its session_id
+    start_session: bool = False
 
 
 # XXX: This tool definition is OpenAI specific, might need to refactor to support other LLM API's
@@ -38,6 +76,16 @@ class ToolDefinition(TypedDict):
     parameters: dict
 
 
+# Encodes a tool's result as the output string sent back to the LLM
+ToolOutputEncoder = Callable[[Any], str | Awaitable[str]]
+
+
 class ToolBinding(TypedDict):
     ref: Callable
     schema: ToolDefinition
+    # The complete definition sent to OpenAI, built once when the tool is bound
+    definition: NotRequired[Mapping[str, Any]]
+    # Validates and coerces the tool's arguments, straight from the JSON the model sends
+    validator: NotRequired[type[BaseModel]]
+    max_concurrency: NotRequired[int]
+    encoder: NotRequired[ToolOutputEncoder]
@@ -0,0 +1,132 @@
+import asyncio
+import logging
+from pathlib import Path
+from typing import Any, Literal, Optional
+
+from pydantic import BaseModel, ConfigDict, Field, TypeAdapter, create_model
+
+from .grid import CellValue, GridCalculator
+from .llm.openai import create_toolbinding
+from .types import ToolBinding
+
+logger = logging.getLogger(__name__)
+
+_INPUT_TYPES: dict[str, type] = {"number": float, "string": str, "boolean": bool}
+
+
+class WorkbookInput(BaseModel):
+    ref: str
+    description: str = ""
+    type: Literal["number", "string", "boolean"] = "number"
+
+
+class WorkbookSpec(BaseModel):
+    """
+    Declares a spreadsheet model to expose to the LLM: the GRID workbook, its named inputs, and the labeled
+    cells or ranges it outputs. Its tools are named after it, so the name must be a valid identifier.
+    """
+
+    name: str = Field(pattern=r"^[a-zA-Z][a-zA-Z0-9_]*$")
+    workbook_id: str
+    description: str
+    inputs: dict[str, WorkbookInput]
+    outputs: dict[str, str]
+    # Fetch the defaults and the default outputs in the background after startup, rather than on first use
+    warm: bool = False
+
+
+class WorkbookModel:
+    """A spreadsheet model described by a WorkbookSpec, calculated through a (shared) GridCalculator"""
+
+    def __init__(self, spec: WorkbookSpec, calculator: GridCalculator):
+        self.spec = spec
+        self._calculator = calculator
+        self.parameters_model: type[BaseModel] = create_model(  # type: ignore[call-overload]
+            f"{spec.name}Parameters",
+            __config__=ConfigDict(extra="forbid"),
+            **{
+                name: (
+                    Optional[_INPUT_TYPES[workbook_input.type]],
+                    Field(None, description=workbook_input.description),
+                )
+                for name, workbook_input in spec.inputs.items()
+            },
+        )
+        self._labels = {ref: label for label, ref in spec.outputs.items()}
+        self._input_labels = {workbook_input.ref: name for name, workbook_input in spec.inputs.items()}
+
+    async def get_defaults(self) -> dict[str, CellValue]:
+        reads = [workbook_input.ref for workbook_input in self.spec.inputs.values()]
+        results = await self._calculator.calc(self.spec.workbook_id, reads)
+        return {self._input_labels[ref]: self._value(result) for ref, result in results.items()}
+
+    async def calculate(self, **inputs: CellValue) -> dict[str, Any]:
+        apply: dict[str, CellValue] = {
+            self.spec.inputs[name].ref: value
+            for name, value in inputs.items()
+            if value is not None and name in self.spec.inputs
+        }
+        results = await self._calculator.calc(self.spec.workbook_id, list(self.spec.outputs.values()), apply)
+        return {self._labels.get(ref, ref): self._value(result) for ref, result in results.items()}
+
+    async def warm(self) -> None:
+        await asyncio.gather(self.get_defaults(), self.calculate())
+
+    @staticmethod
+    def _value(result: Any) -> Any:
+        if isinstance(result, list):
+            return [cell.value for cell in result]
+        return result.value
+
+    def tools(self) -> dict[str, ToolBinding]:
+        name = self.spec.name
+        return {
+            f"{name}_defaults": create_toolbinding(
+                self.get_defaults,
+                name=f"{name}_defaults",
+                description=f"Get the default values for all the inputs of '{name}_calculate'",
+            ),
+            f"{name}_calculate": create_toolbinding(
+                self.calculate,
+                name=f"{name}_calculate",
+                description=(
+                    f"{self.spec.description.strip()}\n\n"
+                    f"Returns the following outputs: {list(self.spec.outputs)}. None of the inputs are required, "
+                    "the model has built-in defaults, so supply a null value for any you don't have yet."
+                ),
+                parameters=self.parameters_model,
+            ),
+        }
+
+
+class WorkbookRegistry:
+    """
+    Spreadsheet models loaded from declarative specs, sharing a single GridCalculator, and so the GRID client's
+    connection pool, the result cache and in-flight request coalescing.
+
+    Everything is built once when the registry is created, without calling GRID. Nothing is calculated until a
+    model's tools are first used, other than for models marked to be warmed.
+    """
+
+    def __init__(self, specs: list[WorkbookSpec], calculator: GridCalculator):
+        self.models: dict[str, WorkbookModel] = {}
+        for spec in specs:
+            if spec.name in self.models:
+                raise ValueError(f"Workbook spec {spec.name} is declared more than once")
+            self.models[spec.name] = WorkbookModel(spec, calculator)
+
+    @classmethod
+    def from_file(cls, path: str | Path, calculator: GridCalculator) -> "WorkbookRegistry":
+        """Load specs from a JSON file holding a list of them"""
+        specs = TypeAdapter(list[WorkbookSpec]).validate_json(Path(path).read_bytes())
+        return cls(specs, calculator)
+
+    def tools(self) -> dict[str, ToolBinding]:
+        return {name: tool for model in self.models.values() for name, tool in model.tools().items()}
+
+    async def warm(self) -> None:
+        models = [model for model in self.models.values() if model.spec.warm]
+        results = await asyncio.gather(*(model.warm() for model in models), return_exceptions=True)
+        for model, result in zip(models, results):
+            if isinstance(result, Exception):
+                logger.warning(f"Failed to warm workbook {model.spec.name}: {result!r}")
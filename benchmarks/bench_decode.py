@@ -0,0 +1,90 @@
+"""
+Microbenchmark of decoding chat request bodies and encoding message histories for OpenAI, on long conversations.
+
+Compares the current single pass decoding (ChatRequest.model_validate_json on the raw body, with messages
+discriminated on their type) against the previous approach of json.loads followed by validating each message
+against the undiscriminated union, and likewise for dumping the history sent to OpenAI.
+
+    python -m benchmarks.bench_decode --messages 200
+"""
+
+import argparse
+import json
+import timeit
+from typing import Any, Callable, Optional
+
+from pydantic import BaseModel
+
+from backend.types import (
+    ChatRequest,
+    FunctionCallOutput,
+    FunctionCallRequest,
+    TextMessage,
+    message_list_adapter,
+)
+
+
+class UndiscriminatedChatRequest(BaseModel):
+    """ChatRequest as it was, each message is tried against every member of the union in turn"""
+
+    messages: list[TextMessage | FunctionCallRequest | FunctionCallOutput]
+    session_id: Optional[str] = None
+    start_session: bool = False
+
+
+def conversation(length: int) -> list[dict[str, Any]]:
+    """A what-if conversation: questions and answers, each with a forecast_revenue call and its output"""
+    forecast = json.dumps({"Monthly Recurring Revenue": [round(1000 * 1.05**month, 2) for month in range(36)]})
+    messages: list[dict[str, Any]] = []
+    turn = 0
+    while len(messages) < length:
+        call_id = f"call_{turn}"
+        messages += [
+            {"role": "user", "content": f"What if churn was {turn}%?"},
+            {
+                "type": "function_call",
+                "name": "forecast_revenue",
+                "arguments": json.dumps({"churn_rate": turn / 100}),
+                "call_id": call_id,
+            },
+            {"type": "function_call_output", "call_id": call_id, "output": forecast},
+            {"role": "assistant", "content": "Revenue would grow more slowly. " * 10},
+        ]
+        turn += 1
+    return messages[:length]
+
+
+def per_call_microseconds(function: Callable[[], Any], seconds: float) -> float:
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    repeats = max(1, round(seconds / max(timer.timeit(number), 1e-9)))
+    return min(timer.repeat(repeat=min(repeats, 20), number=number)) / number * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=200, help="messages in the conversation")
+    parser.add_argument("--seconds", type=float, default=1.0, help="rough time to spend per measurement")
+    args = parser.parse_args()
+
+    body = json.dumps({"messages": conversation(args.messages)}).encode()
+    messages = ChatRequest.model_validate_json(body).messages
+
+    results = {
+        "decode_undiscriminated_us": per_call_microseconds(
+            lambda: UndiscriminatedChatRequest(**json.loads(body)), args.seconds
+        ),
+        "decode_us": per_call_microseconds(lambda: ChatRequest.model_validate_json(body), args.seconds),
+        "encode_per_message_us": per_call_microseconds(lambda: [m.model_dump() for m in messages], args.seconds),
+        "encode_us": per_call_microseconds(lambda: message_list_adapter.dump_python(messages), args.seconds),
+    }
+    print(
+        json.dumps(
+            {"messages": args.messages, "body_bytes": len(body), **{k: round(v, 1) for k, v in results.items()}},
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
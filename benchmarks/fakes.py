@@ -0,0 +1,241 @@
+"""
+Local stand-ins for the OpenAI Responses API and the GRID workbooks.calc API, for load testing the chat
+backend without live accounts.
+
+The fake OpenAI follows a script: for every user message it answers with the scripted rounds of function calls
+in turn, then with a text reply. The fake GRID returns deterministic numbers derived from the applied values.
+Both sleep for a configurable, jittered latency per request and count the requests they serve on GET /stats.
+
+Run both with:
+    python -m benchmarks.fakes --openai-port 9101 --grid-port 9102
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import re
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+# A typical conversation: look up the defaults, then compare a few scenarios at once
+DEFAULT_SCRIPT: list[list[tuple[str, dict[str, Any]]]] = [
+    [("get_model_defaults", {})],
+    [("forecast_revenue", {"churn_rate": churn_rate}) for churn_rate in (0.02, 0.05, 0.1)],
+]
+
+FORECAST_PARAMETERS = (
+    "ad_budget",
+    "ad_cpc",
+    "registration_conversion_rate",
+    "subscription_conversion_rate",
+    "registration_conversion_lag_in_months",
+    "subscription_conversion_lag_in_months",
+    "churn_rate",
+    "customer_lifetime_length_in_months",
+    "virality_per_registered_user",
+    "virality_per_subscribed_user",
+    "subscription_price",
+)
+
+
+@dataclass
+class Latency:
+    """A per-request delay in seconds, uniformly jittered by +/- jitter"""
+
+    mean: float = 0.0
+    jitter: float = 0.0
+
+    async def sleep(self) -> None:
+        delay = self.mean + random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+@dataclass
+class Stats:
+    requests: int = 0
+    function_calls: int = 0
+    counts: dict[str, int] = field(default_factory=dict)
+
+    def as_dict(self) -> dict[str, Any]:
+        return {"requests": self.requests, "function_calls": self.function_calls, **self.counts}
+
+
+def _tool_arguments(name: str, arguments: dict[str, Any]) -> str:
+    # The backend's tools are bound in strict mode, where the model supplies every parameter
+    if name.startswith("forecast_revenue"):
+        arguments = {parameter: arguments.get(parameter) for parameter in FORECAST_PARAMETERS}
+    return json.dumps(arguments)
+
+
+def create_openai_app(
+    latency: Latency, script: list[list[tuple[str, dict[str, Any]]]] = DEFAULT_SCRIPT, reply: str = "Done."
+) -> Starlette:
+    stats = Stats()
+
+    async def create_response(request: Request):
+        body = await request.json()
+        stats.requests += 1
+        await latency.sleep()
+
+        items = body.get("input", [])
+        if isinstance(items, str):
+            items = [{"role": "user", "content": items}]
+        # Count the tool outputs since the latest user message to tell which scripted round we're on
+        last_user = max((i for i, item in enumerate(items) if item.get("role") == "user"), default=-1)
+        outputs_seen = sum(1 for item in items[last_user + 1 :] if item.get("type") == "function_call_output")
+        round_index = 0
+        while round_index < len(script) and outputs_seen >= len(script[round_index]):
+            outputs_seen -= len(script[round_index])
+            round_index += 1
+
+        if round_index < len(script) and body.get("tool_choice") != "none":
+            output = [
+                {
+                    "type": "function_call",
+                    "id": f"fc_{uuid.uuid4().hex}",
+                    "call_id": f"call_{uuid.uuid4().hex}",
+                    "name": name,
+                    "arguments": _tool_arguments(name, arguments),
+                    "status": "completed",
+                }
+                for name, arguments in script[round_index]
+            ]
+            stats.function_calls += len(output)
+        else:
+            output = [
+                {
+                    "type": "message",
+                    "id": f"msg_{uuid.uuid4().hex}",
+                    "role": "assistant",
+                    "status": "completed",
+                    "content": [{"type": "output_text", "text": reply, "annotations": []}],
+                }
+            ]
+
+        input_tokens = len(json.dumps(items)) // 4
+        return JSONResponse(
+            {
+                "id": f"resp_{uuid.uuid4().hex}",
+                "object": "response",
+                "created_at": time.time(),
+                "model": body.get("model"),
+                "status": "completed",
+                "output": output,
+                "parallel_tool_calls": True,
+                "tool_choice": body.get("tool_choice", "auto"),
+                "tools": body.get("tools", []),
+                "usage": {
+                    "input_tokens": input_tokens,
+                    "input_tokens_details": {"cached_tokens": 0},
+                    "output_tokens": 20,
+                    "output_tokens_details": {"reasoning_tokens": 0},
+                    "total_tokens": input_tokens + 20,
+                },
+            }
+        )
+
+    async def get_stats(request: Request):
+        return JSONResponse(stats.as_dict())
+
+    return Starlette(
+        routes=[
+            Route("/v1/responses", create_response, methods=["POST"]),
+            Route("/stats", get_stats, methods=["GET"]),
+        ]
+    )
+
+
+_RANGE = re.compile(r"^(?:[^!]+!)?([A-Z]+)(\d+)(?::([A-Z]+)(\d+))?$")
+
+
+def _column_number(column: str) -> int:
+    number = 0
+    for char in column:
+        number = number * 26 + ord(char) - ord("A") + 1
+    return number
+
+
+def _cell(value: float, x: int, y: int) -> dict[str, Any]:
+    return {"type": "number", "value": value, "formatted": f"{value:.2f}", "offset": [x, y]}
+
+
+def create_grid_app(latency: Latency) -> Starlette:
+    stats = Stats()
+
+    async def calc(request: Request):
+        body = await request.json()
+        stats.requests += 1
+        await latency.sleep()
+
+        # Every applied value shifts the results, so different scenarios give different numbers
+        seed = int(hashlib.sha1(json.dumps(body.get("apply") or {}, sort_keys=True).encode()).hexdigest()[:8], 16)
+        results: dict[str, Any] = {}
+        for ref in body["read"]:
+            match = _RANGE.match(ref)
+            if match is None:
+                return JSONResponse({"error": f"Can't parse reference {ref}"}, status_code=400)
+            start_column, start_row, end_column, end_row = match.groups()
+            if end_column is None:
+                results[ref] = _cell(float(seed % 1000) / 10, 0, 0)
+                continue
+            width = _column_number(end_column) - _column_number(start_column) + 1
+            height = int(end_row) - int(start_row) + 1
+            results[ref] = [
+                _cell(float(seed % 1000) + 100.0 * (x + 1) * (y + 1), x, y)
+                for y in range(height)
+                for x in range(width)
+            ]
+        return JSONResponse(results)
+
+    async def get_stats(request: Request):
+        return JSONResponse(stats.as_dict())
+
+    return Starlette(
+        routes=[
+            Route("/v1/workbooks/{id}/calc", calc, methods=["POST"]),
+            Route("/stats", get_stats, methods=["GET"]),
+        ]
+    )
+
+
+async def serve(openai_port: int, grid_port: int, openai_latency: Latency, grid_latency: Latency) -> None:
+    servers = [
+        uvicorn.Server(uvicorn.Config(create_openai_app(openai_latency), port=openai_port, log_level="warning")),
+        uvicorn.Server(uvicorn.Config(create_grid_app(grid_latency), port=grid_port, log_level="warning")),
+    ]
+    await asyncio.gather(*(server.serve() for server in servers))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--openai-port", type=int, default=9101)
+    parser.add_argument("--grid-port", type=int, default=9102)
+    parser.add_argument("--openai-latency", type=float, default=0.3, help="mean seconds per OpenAI response")
+    parser.add_argument("--openai-jitter", type=float, default=0.1)
+    parser.add_argument("--grid-latency", type=float, default=0.1, help="mean seconds per GRID calc")
+    parser.add_argument("--grid-jitter", type=float, default=0.03)
+    args = parser.parse_args()
+
+    asyncio.run(
+        serve(
+            args.openai_port,
+            args.grid_port,
+            Latency(args.openai_latency, args.openai_jitter),
+            Latency(args.grid_latency, args.grid_jitter),
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
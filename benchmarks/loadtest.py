@@ -0,0 +1,211 @@
+"""
+Load test the chat backend against local OpenAI and GRID stand-ins (see benchmarks.fakes).
+
+Starts the fakes and `backend.app:app` under uvicorn as subprocesses, then drives N scripted conversations through
+/chat with bounded concurrency. Reports throughput, p50/p95/p99 latency per /chat request, tool rounds per chat
+and upstream call counts.
+
+Results can be saved as a baseline, and later runs compared against it so regressions in the chat loop show up
+in review:
+    python -m benchmarks.loadtest --save-baseline benchmarks/baselines/default.json
+    python -m benchmarks.loadtest --compare benchmarks/baselines/default.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Iterator
+
+import httpx
+
+# Lower is better for latencies, higher is better for throughput
+COMPARED_METRICS = {"p50_ms": "lower", "p95_ms": "lower", "p99_ms": "lower", "chats_per_second": "higher"}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values: list[float], q: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, max(0, round(q / 100 * len(ordered)) - 1))]
+
+
+@contextmanager
+def run_servers(args: argparse.Namespace) -> Iterator[dict[str, str]]:
+    openai_port, grid_port, backend_port = free_port(), free_port(), free_port()
+    urls = {
+        "openai": f"http://127.0.0.1:{openai_port}",
+        "grid": f"http://127.0.0.1:{grid_port}",
+        "backend": f"http://127.0.0.1:{backend_port}",
+    }
+    env = {
+        **os.environ,
+        "OPENAI_API_KEY": "benchmark",
+        "GRID_API_KEY": "benchmark",
+        "OPENAI_BASE_URL": f"{urls['openai']}/v1",
+        "GRID_API_URL": urls["grid"],
+    }
+    fakes = [
+        sys.executable,
+        "-m",
+        "benchmarks.fakes",
+        f"--openai-port={openai_port}",
+        f"--grid-port={grid_port}",
+        f"--openai-latency={args.openai_latency}",
+        f"--openai-jitter={args.openai_latency / 3}",
+        f"--grid-latency={args.grid_latency}",
+        f"--grid-jitter={args.grid_latency / 3}",
+    ]
+    backend = [
+        sys.executable,
+        "-m",
+        "uvicorn",
+        "backend.app:app",
+        f"--port={backend_port}",
+        f"--workers={args.workers}",
+        "--log-level=warning",
+    ]
+    processes = [subprocess.Popen(fakes, env=env), subprocess.Popen(backend, env=env)]
+    try:
+        yield urls
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait(timeout=10)
+
+
+async def wait_until_ready(client: httpx.AsyncClient, urls: dict[str, str], timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    for url in (f"{urls['openai']}/stats", f"{urls['grid']}/stats", f"{urls['backend']}/metrics"):
+        while True:
+            try:
+                (await client.get(url)).raise_for_status()
+                break
+            except httpx.HTTPError:
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"{url} didn't come up within {timeout}s")
+                await asyncio.sleep(0.1)
+
+
+async def run_conversation(
+    client: httpx.AsyncClient, url: str, turns: int, latencies: list[float], errors: list[str]
+) -> None:
+    messages: list[dict[str, Any]] = []
+    for turn in range(turns):
+        messages.append({"role": "user", "content": f"How does churn affect revenue? ({turn})"})
+        started = time.perf_counter()
+        try:
+            response = await client.post(f"{url}/chat", json={"messages": messages})
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            errors.append(repr(e))
+            return
+        latencies.append(time.perf_counter() - started)
+        messages.append({"role": "assistant", "content": response.json()["reply"]})
+
+
+async def run_load(args: argparse.Namespace, urls: dict[str, str]) -> dict[str, Any]:
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(timeout=120, limits=limits) as client:
+        await wait_until_ready(client, urls)
+
+        latencies: list[float] = []
+        errors: list[str] = []
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def conversation() -> None:
+            async with semaphore:
+                await run_conversation(client, urls["backend"], args.turns, latencies, errors)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(conversation() for _ in range(args.conversations)))
+        elapsed = time.perf_counter() - started
+
+        openai_stats = (await client.get(f"{urls['openai']}/stats")).json()
+        grid_stats = (await client.get(f"{urls['grid']}/stats")).json()
+
+    chats = len(latencies)
+    return {
+        "settings": {
+            "conversations": args.conversations,
+            "turns": args.turns,
+            "concurrency": args.concurrency,
+            "workers": args.workers,
+            "openai_latency": args.openai_latency,
+            "grid_latency": args.grid_latency,
+        },
+        "chats": chats,
+        "errors": len(errors),
+        "seconds": round(elapsed, 3),
+        "chats_per_second": round(chats / elapsed, 2),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "tool_rounds_per_chat": round((openai_stats["requests"] - chats) / max(chats, 1), 2),
+        "openai_requests": openai_stats["requests"],
+        "grid_requests": grid_stats["requests"],
+        "grid_requests_per_chat": round(grid_stats["requests"] / max(chats, 1), 3),
+    }
+
+
+def compare(results: dict[str, Any], baseline: dict[str, Any], max_regression: float) -> list[str]:
+    """Describe every compared metric that's worse than the baseline by more than max_regression"""
+    if results["settings"] != baseline["settings"]:
+        return [f"Settings differ from the baseline's {baseline['settings']}, results aren't comparable"]
+    regressions = []
+    for metric, better in COMPARED_METRICS.items():
+        current, previous = results[metric], baseline[metric]
+        change = (current - previous) / previous if previous else 0.0
+        if (better == "lower" and change > max_regression) or (better == "higher" and -change > max_regression):
+            regressions.append(f"{metric}: {previous} -> {current} ({change:+.0%})")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--conversations", type=int, default=200)
+    parser.add_argument("--turns", type=int, default=2, help="user messages per conversation")
+    parser.add_argument("--concurrency", type=int, default=50, help="conversations in flight at once")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers for the backend")
+    parser.add_argument("--openai-latency", type=float, default=0.3, help="mean seconds per OpenAI response")
+    parser.add_argument("--grid-latency", type=float, default=0.1, help="mean seconds per GRID calc")
+    parser.add_argument("--save-baseline", type=Path, help="write the results to this file")
+    parser.add_argument("--compare", type=Path, help="fail if results regressed from this baseline file")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="tolerated relative regression")
+    args = parser.parse_args()
+
+    with run_servers(args) as urls:
+        results = asyncio.run(run_load(args, urls))
+
+    print(json.dumps(results, indent=2))
+
+    if args.save_baseline:
+        args.save_baseline.parent.mkdir(parents=True, exist_ok=True)
+        args.save_baseline.write_text(json.dumps(results, indent=2) + "\n")
+
+    if args.compare:
+        regressions = compare(results, json.loads(args.compare.read_text()), args.max_regression)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+    if results["errors"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
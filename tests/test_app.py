@@ -0,0 +1,284 @@
+import asyncio
+import json
+from dataclasses import replace
+from unittest.mock import patch
+
+import httpx
+import openai
+import pytest
+from starlette.testclient import TestClient
+
+from backend.limits import AdmissionController
+from backend.resilience import CircuitOpen
+from backend.shared_cache import SharedResultStore
+from backend.types import TextMessage
+
+
+@pytest.fixture
+def app():
+    # Imported here so the app's config is built from the patched test environment
+    from backend import app
+
+    return app
+
+
+@pytest.fixture
+def client(app):
+    with TestClient(app.app) as client:
+        yield client
+
+
+def test_chat_rejects_invalid_payload(client):
+    response = client.post("/chat", json={"messages": [{"role": "robot"}]})
+
+    assert response.status_code == 400
+    assert response.json()["error"] == "Invalid request payload"
+
+
+def test_chat_stream_sends_server_sent_events(app, client):
+    async def stream_response(messages):
+        yield "delta", {"delta": "Hello"}
+        yield "done", {"reply": "Hello", "role": "assistant"}
+
+    with patch.object(app.openai_chat, "stream_response", stream_response):
+        response = client.post("/chat/stream", json={"messages": [{"role": "user", "content": "Hi"}]})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert response.text == (
+        'event: delta\ndata: {"delta": "Hello"}\n\nevent: done\ndata: {"reply": "Hello", "role": "assistant"}\n\n'
+    )
+
+
+def test_chat_sessions(app, client):
+    replies = iter(["Hello", "Goodbye"])
+    seen_histories = []
+
+    async def create_response(messages, session=None):
+        seen_histories.append([m.content for m in messages])
+        message = TextMessage(role="assistant", content=next(replies))
+        messages.append(message)
+        return message
+
+    with patch.object(app.openai_chat, "create_response", create_response):
+        started = client.post(
+            "/chat", json={"messages": [{"role": "user", "content": "Hi"}], "start_session": True}
+        )
+        session_id = started.json()["session_id"]
+        continued = client.post(
+            "/chat", json={"messages": [{"role": "user", "content": "Bye"}], "session_id": session_id}
+        )
+
+    assert continued.json() == {"reply": "Goodbye", "role": "assistant", "session_id": session_id}
+    assert seen_histories[-1] == ["Hi", "Hello", "Bye"]
+
+
+def test_chat_unknown_session(client):
+    response = client.post("/chat", json={"messages": [{"role": "user", "content": "Hi"}], "session_id": "nope"})
+
+    assert response.status_code == 404
+
+
+def test_metrics_endpoint(client):
+    client.post("/chat", json={"messages": [{"role": "robot"}]})
+
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert 'chat_request_seconds_count{endpoint="chat"}' in response.text
+    assert "grid_cache_hits_total" in response.text
+
+
+def test_chat_rejects_when_overloaded(app, client):
+    with patch.object(app, "admission", AdmissionController(max_concurrent=0, max_queue=0, max_wait_seconds=1)):
+        response = client.post("/chat", json={"messages": [{"role": "user", "content": "Hi"}]})
+        stream_response = client.post("/chat/stream", json={"messages": [{"role": "user", "content": "Hi"}]})
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+    assert stream_response.status_code == 503
+
+
+def test_chat_stream_releases_admission(app, client):
+    async def stream_response(messages):
+        yield "done", {"reply": "Hello", "role": "assistant"}
+
+    with patch.object(app.openai_chat, "stream_response", stream_response):
+        client.post("/chat/stream", json={"messages": [{"role": "user", "content": "Hi"}]})
+
+    assert app.admission.active == 0
+    assert 'chat_request_seconds_count{endpoint="stream"}' in client.get("/metrics").text
+
+
+def test_chat_deadline_from_header(app, client):
+    async def create_response(messages, session=None):
+        await asyncio.sleep(10)
+
+    with patch.object(app.openai_chat, "create_response", create_response):
+        response = client.post(
+            "/chat",
+            json={"messages": [{"role": "user", "content": "Hi"}]},
+            headers={"X-Request-Timeout": "0.05"},
+        )
+
+    assert response.status_code == 504
+    assert app.admission.active == 0
+
+
+def test_chat_stream_deadline(app, client):
+    async def stream_response(messages):
+        yield "delta", {"delta": "Hel"}
+        await asyncio.sleep(10)
+        yield "done", {"reply": "Hello", "role": "assistant"}
+
+    with patch.object(app.openai_chat, "stream_response", stream_response):
+        response = client.post(
+            "/chat/stream",
+            json={"messages": [{"role": "user", "content": "Hi"}]},
+            headers={"X-Request-Timeout": "0.05"},
+        )
+
+    assert response.text.endswith('event: error\ndata: {"error": "Deadline exceeded"}\n\n')
+
+
+def test_abandoned_session_turn_is_rolled_back(app, client):
+    async def create_response(messages, session=None):
+        messages.append(TextMessage(role="assistant", content="partial"))
+        await asyncio.sleep(10)
+
+    session = app.sessions.create()
+    with patch.object(app.openai_chat, "create_response", create_response):
+        client.post(
+            "/chat",
+            json={"messages": [{"role": "user", "content": "Hi"}], "session_id": session.session_id},
+            headers={"X-Request-Timeout": "0.05"},
+        )
+
+    assert session.messages == []
+
+
+def test_chat_batch_streams_ndjson(app, client):
+    async def create_response(messages, session=None):
+        if messages[-1].content == "Fail":
+            raise RuntimeError("Upstream error")
+        return TextMessage(role="assistant", content=messages[-1].content.upper())
+
+    batch = {
+        "requests": [
+            {"messages": [{"role": "user", "content": "Hi"}]},
+            {"messages": [{"role": "user", "content": "Fail"}]},
+            {"messages": [{"role": "user", "content": "Hi"}], "start_session": True},
+        ]
+    }
+    with patch.object(app.openai_chat, "create_response", create_response):
+        response = client.post("/chat/batch", json=batch)
+
+    assert response.headers["content-type"] == "application/x-ndjson"
+    results = sorted((json.loads(line) for line in response.text.splitlines()), key=lambda r: r["index"])
+    assert results[0] == {"index": 0, "reply": "HI", "role": "assistant"}
+    assert results[1] == {"index": 1, "error": "Upstream error"}
+    assert "Sessions aren't supported" in results[2]["error"]
+    assert app.admission.active == 0
+
+
+def test_chat_fails_fast_while_openai_is_unavailable(app, client):
+    async def create_response(messages, session=None):
+        raise CircuitOpen("openai", retry_after=12)
+
+    with patch.object(app.openai_chat, "create_response", create_response):
+        response = client.post("/chat", json={"messages": [{"role": "user", "content": "Hi"}]})
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "12"
+
+
+def test_openai_errors_are_reported_as_bad_gateway(app, client):
+    request = httpx.Request("POST", "https://openai.test/responses")
+    error = openai.InternalServerError("Server error", response=httpx.Response(500, request=request), body=None)
+
+    async def create_response(messages, session=None):
+        raise error
+
+    async def stream_response(messages):
+        raise error
+        yield
+
+    with (
+        patch.object(app.openai_chat, "create_response", create_response),
+        patch.object(app.openai_chat, "stream_response", stream_response),
+    ):
+        response = client.post("/chat", json={"messages": [{"role": "user", "content": "Hi"}]})
+        stream_response = client.post("/chat/stream", json={"messages": [{"role": "user", "content": "Hi"}]})
+
+    assert response.status_code == 502
+    assert response.json()["error"] == "Upstream error"
+    assert stream_response.text.endswith('error\ndata: {"error": "Upstream error", "details": "Server error"}\n\n')
+
+
+def test_chat_batch_chats_count_against_admission(app, client):
+    batch = {"requests": [{"messages": [{"role": "user", "content": "Hi"}]}]}
+    with patch.object(app, "admission", AdmissionController(max_concurrent=0, max_queue=0, max_wait_seconds=1)):
+        response = client.post("/chat/batch", json=batch)
+
+    assert json.loads(response.text) == {"index": 0, "error": "Overloaded", "retry_after": 1}
+
+
+def test_invalidate_workbook_needs_the_admin_token(app, client):
+    assert client.post("/workbooks/wb/invalidate").status_code == 404
+
+    with patch.object(app, "config", replace(app.config, ADMIN_TOKEN="secret")):
+        unauthorized = client.post("/workbooks/wb/invalidate", headers={"Authorization": "Bearer wrong"})
+        response = client.post("/workbooks/wb/invalidate", headers={"Authorization": "Bearer secret"})
+
+    assert unauthorized.status_code == 401
+    assert response.status_code == 200
+    assert response.json() == {"invalidated": 0}
+
+
+@pytest.mark.parametrize("path", ["/chat", "/chat/stream", "/chat/batch"])
+async def test_client_disconnecting_before_sending_the_body(app, path):
+    scope = {"type": "http", "method": "POST", "path": path, "headers": [], "query_string": b""}
+    sent = []
+
+    async def receive():
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+
+    await app.app(scope, receive, send)
+
+    assert sent[0]["status"] == 499
+    assert app.admission.active == 0
+
+
+async def test_workbooks_invalidated_by_another_worker_are_invalidated_locally(app, tmp_path):
+    store = SharedResultStore(tmp_path / "results.db")
+    other_worker = SharedResultStore(tmp_path / "results.db")
+    with patch.object(app, "invalidate_locally") as invalidate_locally:
+        watching = asyncio.create_task(app.watch_workbook_versions(store, 0.01))
+        await asyncio.sleep(0.02)
+        await other_worker.invalidate("wb")
+        for _ in range(100):
+            if invalidate_locally.called:
+                break
+            await asyncio.sleep(0.01)
+        watching.cancel()
+    store.close()
+    other_worker.close()
+
+    invalidate_locally.assert_called_once_with("wb")
+
+
+def test_browsers_may_send_a_deadline_cross_origin(client):
+    response = client.options(
+        "/chat",
+        headers={
+            "Origin": "https://example.com",
+            "Access-Control-Request-Method": "POST",
+            "Access-Control-Request-Headers": "content-type, x-request-timeout",
+        },
+    )
+
+    assert response.status_code == 200
+    assert "x-request-timeout" in response.headers["access-control-allow-headers"].lower()
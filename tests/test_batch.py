@@ -0,0 +1,60 @@
+import asyncio
+
+from backend.batch import run_batch
+from backend.limits import AdmissionController
+from backend.types import ChatRequest, TextMessage
+
+
+class FakeChat:
+    def __init__(self, delay=0.01):
+        self.delay = delay
+        self.active = 0
+        self.max_active = 0
+
+    async def create_response(self, messages):
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            await asyncio.sleep(float(messages[-1].content) * self.delay)
+        finally:
+            self.active -= 1
+        return TextMessage(role="assistant", content=messages[-1].content)
+
+
+def chat_requests(*contents):
+    return [ChatRequest(messages=[TextMessage(role="user", content=content)]) for content in contents]
+
+
+async def test_run_batch_yields_results_as_they_complete_with_bounded_concurrency():
+    chat = FakeChat()
+    results = [result async for result in run_batch(chat, chat_requests("5", "1", "1", "1"), 2, 10)]
+
+    assert [result["index"] for result in results] == [1, 2, 3, 0]
+    assert results[0] == {"index": 1, "reply": "1", "role": "assistant"}
+    assert chat.max_active == 2
+
+
+async def test_run_batch_times_out_single_chats():
+    results = [result async for result in run_batch(FakeChat(delay=1), chat_requests("0", "10"), 2, 0.05)]
+
+    assert results == [{"index": 0, "reply": "0", "role": "assistant"}, {"index": 1, "error": "Deadline exceeded"}]
+
+
+async def test_closing_a_batch_cancels_running_chats():
+    chat = FakeChat(delay=1)
+    results = run_batch(chat, chat_requests("0", "10", "10"), 3, 60)
+
+    assert (await results.__anext__())["index"] == 0
+    await results.aclose()
+    assert chat.active == 0
+
+
+async def test_batch_chats_are_admitted_one_by_one():
+    chat = FakeChat()
+    admission = AdmissionController(max_concurrent=1, max_queue=1, max_wait_seconds=0.02)
+
+    results = [result async for result in run_batch(chat, chat_requests("1", "1", "5"), 3, 10, admission)]
+
+    assert chat.max_active == 1
+    assert {"index": 2, "error": "Overloaded", "retry_after": 1.0} in results
+    assert admission.active == 0
@@ -0,0 +1,21 @@
+from backend.config import get_config
+
+
+def test_get_config_defaults():
+    config = get_config()
+
+    assert config.OPENAI_API_KEY == "dummy-test-value"
+    assert config.GRID_API_URL is None
+    assert config.OPENAI_MAX_CONNECTIONS == 100
+
+
+def test_get_config_parses_optional_values(test_env):
+    test_env["GRID_API_URL"] = "http://localhost:9000"
+    test_env["OPENAI_MAX_CONNECTIONS"] = "8"
+    test_env["OPENAI_TIMEOUT_SECONDS"] = "2.5"
+
+    config = get_config()
+
+    assert config.GRID_API_URL == "http://localhost:9000"
+    assert config.OPENAI_MAX_CONNECTIONS == 8
+    assert config.OPENAI_TIMEOUT_SECONDS == 2.5
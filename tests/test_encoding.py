@@ -0,0 +1,77 @@
+import json
+
+from backend.llm.encoding import SeriesEncoder, json_encoder, round_significant
+
+FORECAST = {
+    "Monthly Recurring Revenue": [1234.5678, 2345.6789, 3456.789, 4567.891],
+    "Revenue from New subscribers": [1000.123456, 1100.0, 1200.0, 1300.0],
+}
+
+
+def test_json_encoder():
+    assert json_encoder({"a": [1, 2.5]}) == '{"a": [1, 2.5]}'
+
+
+def test_round_significant():
+    assert round_significant({"a": [123456.789, 0.000123456, 0.0], "b": "x", "c": 3}, 3) == {
+        "a": [123000.0, 0.000123, 0.0],
+        "b": "x",
+        "c": 3,
+    }
+
+
+async def test_series_encoder_rounds_compactly():
+    output = await SeriesEncoder(significant_digits=3)(FORECAST)
+
+    assert output == (
+        '{"Monthly Recurring Revenue":[1230.0,2350.0,3460.0,4570.0],'
+        '"Revenue from New subscribers":[1000.0,1100.0,1200.0,1300.0]}'
+    )
+    assert len(output) < len(json_encoder(FORECAST))
+
+
+async def test_series_encoder_rows_layout():
+    output = json.loads(await SeriesEncoder(significant_digits=2, layout="rows")(FORECAST))
+
+    assert output["table"] == [
+        ["Monthly Recurring Revenue", "Revenue from New subscribers"],
+        [1200.0, 1000.0],
+        [2300.0, 1100.0],
+        [3500.0, 1200.0],
+        [4600.0, 1300.0],
+    ]
+
+
+async def test_series_encoder_summary():
+    output = json.loads(await SeriesEncoder(summary=True)({"MRR": [1.0, 2.0, 6.0], "ARR": 5}))
+
+    assert output == {"ARR": 5, "MRR": {"min": 1.0, "max": 6.0, "mean": 3.0, "first": 1.0, "last": 6.0}}
+
+
+async def test_series_encoder_samples_points_including_the_last():
+    output = json.loads(await SeriesEncoder(sample_points=3)({"MRR": [float(i) for i in range(36)]}))
+
+    assert output == {"sampled_indexes": [0, 18, 35], "MRR": [0.0, 18.0, 35.0]}
+
+
+async def test_series_encoder_delta_against_baseline():
+    async def baseline():
+        return {"MRR": [1.0, 2.0, 3.0]}
+
+    output = json.loads(await SeriesEncoder(baseline=baseline)({"MRR": [1.0, 2.5, 4.0]}))
+
+    assert output["MRR"] == [0.0, 0.5, 1.0]
+    assert "default parameters" in output["encoding"]
+
+
+async def test_series_encoder_sends_the_baseline_itself_verbatim():
+    async def baseline():
+        return {"MRR": [1.0, 2.0, 3.0]}
+
+    output = json.loads(await SeriesEncoder(baseline=baseline)(await baseline()))
+
+    assert output == {"MRR": [1.0, 2.0, 3.0]}
+
+
+async def test_series_encoder_leaves_errors_alone():
+    assert json.loads(await SeriesEncoder(summary=True)({"error": "bad input"})) == {"error": "bad input"}
@@ -0,0 +1,343 @@
+import asyncio
+import time
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from backend.cache import TTLCache
+from backend.grid import CellRange, GridCalculator, ProjectXRevenueModel, calc_cache_key, plan_reads
+from backend.limits import deadline
+
+
+@pytest.fixture
+def grid_client():
+    grid_client = MagicMock()
+    grid_client.workbooks.calc = AsyncMock(
+        side_effect=lambda id, read, apply, timeout=None: {ref: SimpleNamespace(value=1.0) for ref in read}
+    )
+    return grid_client
+
+
+@pytest.fixture
+def calculator(grid_client):
+    return GridCalculator(grid_client, cache=TTLCache(max_entries=8, ttl_seconds=60))
+
+
+def test_calc_cache_key_normalizes_inputs():
+    assert calc_cache_key("wb", ["B2", "B1"], {"A2": 10, "A1": "x"}) == calc_cache_key(
+        "wb", ["B1", "B2"], {"A1": "x", "A2": 10.0}
+    )
+    assert calc_cache_key("wb", ["B1"], {"A1": 1}) != calc_cache_key("wb", ["B1"], {"A1": True})
+    assert calc_cache_key("wb", ["B1"]) != calc_cache_key("other", ["B1"])
+
+
+async def test_calc_memoizes_results(calculator, grid_client):
+    first = await calculator.calc("wb", ["B1", "B2"], {"A1": 10})
+    second = await calculator.calc("wb", ["B2", "B1"], {"A1": 10.0})
+
+    assert first is second
+    assert grid_client.workbooks.calc.await_count == 1
+    assert calculator.cache_stats == {"hits": 1, "misses": 1, "entries": 1}
+
+
+async def test_invalidate_drops_only_the_given_workbook(calculator, grid_client):
+    await calculator.calc("wb", ["B1"])
+    await calculator.calc("other", ["B1"])
+
+    assert calculator.invalidate("wb") == 1
+
+    await calculator.calc("wb", ["B1"])
+    await calculator.calc("other", ["B1"])
+    assert grid_client.workbooks.calc.await_count == 3
+
+
+async def test_forecast_revenue_is_served_from_cache(calculator, grid_client):
+    project_x = ProjectXRevenueModel(calculator)
+
+    await project_x.forecast_revenue(churn_rate=0.05)
+    response = await project_x.forecast_revenue(churn_rate=0.05)
+
+    assert response["Monthly Recurring Revenue"] == [1.0]
+    assert grid_client.workbooks.calc.await_count == 1
+
+
+def test_ttl_cache_expires_and_evicts():
+    now = 0.0
+    cache: TTLCache[str, int] = TTLCache(max_entries=2, ttl_seconds=10, clock=lambda: now)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+
+    # "b" was the least recently used entry
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+
+    now = 11.0
+    assert cache.get("a") is None
+    assert len(cache) == 1
+
+
+@pytest.fixture
+def slow_grid_client(grid_client):
+    async def slow_calc(id, read, apply, timeout=None):
+        await asyncio.sleep(0.1)
+        return {ref: SimpleNamespace(value=1.0) for ref in read}
+
+    grid_client.workbooks.calc.side_effect = slow_calc
+    return grid_client
+
+
+async def test_concurrent_identical_calcs_share_one_request(slow_grid_client):
+    calculator = GridCalculator(slow_grid_client)
+
+    results = await asyncio.gather(*(calculator.calc("wb", ["B1"], {"A1": 1}) for _ in range(5)))
+
+    assert all(result is results[0] for result in results)
+    assert slow_grid_client.workbooks.calc.await_count == 1
+    assert calculator.coalesced_calls == 4
+
+    # Nothing is kept once the request completes
+    await calculator.calc("wb", ["B1"], {"A1": 1})
+    assert slow_grid_client.workbooks.calc.await_count == 2
+
+
+async def test_cancelling_one_waiter_does_not_cancel_the_others(slow_grid_client):
+    calculator = GridCalculator(slow_grid_client)
+
+    cancelled = asyncio.create_task(calculator.calc("wb", ["B1"]))
+    waiting = asyncio.create_task(calculator.calc("wb", ["B1"]))
+    await asyncio.sleep(0.01)
+    cancelled.cancel()
+
+    result = await waiting
+    assert result["B1"].value == 1.0
+    assert cancelled.cancelled()
+    assert slow_grid_client.workbooks.calc.await_count == 1
+
+
+async def test_cancelling_every_waiter_cancels_the_calculation(grid_client):
+    started, cancelled = asyncio.Event(), asyncio.Event()
+
+    async def calc(id, read, apply, timeout=None):
+        started.set()
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    grid_client.workbooks.calc.side_effect = calc
+    calculator = GridCalculator(grid_client)
+
+    waiters = [asyncio.create_task(calculator.calc("wb", ["B1"])) for _ in range(2)]
+    await started.wait()
+    waiters[0].cancel()
+    await asyncio.sleep(0)
+    assert not cancelled.is_set()
+    waiters[1].cancel()
+
+    await asyncio.wait_for(cancelled.wait(), 1)
+    await asyncio.sleep(0)
+    assert not calculator._in_flight
+
+
+async def test_calc_after_every_waiter_is_cancelled_starts_afresh(slow_grid_client):
+    calculator = GridCalculator(slow_grid_client)
+
+    cancelled = asyncio.create_task(calculator.calc("wb", ["B1"]))
+    await asyncio.sleep(0.01)
+    cancelled.cancel()
+    await asyncio.sleep(0)
+    result = await calculator.calc("wb", ["B1"])
+
+    assert result["B1"].value == 1.0
+    assert slow_grid_client.workbooks.calc.await_count == 2
+
+
+async def test_each_waiter_has_its_own_deadline(slow_grid_client):
+    calculator = GridCalculator(slow_grid_client)
+
+    async def calc_by(deadline_at):
+        with deadline(deadline_at):
+            return await calculator.calc("wb", ["B1"])
+
+    hurried = asyncio.create_task(calc_by(time.monotonic() + 0.01))
+    patient = asyncio.create_task(calculator.calc("wb", ["B1"]))
+
+    with pytest.raises(TimeoutError):
+        await hurried
+    assert (await patient)["B1"].value == 1.0
+    assert slow_grid_client.workbooks.calc.await_count == 1
+
+
+async def test_concurrent_calc_failures_reach_every_waiter(grid_client):
+    grid_client.workbooks.calc.side_effect = RuntimeError("GRID is down")
+    calculator = GridCalculator(grid_client)
+
+    results = await asyncio.gather(*(calculator.calc("wb", ["B1"]) for _ in range(3)), return_exceptions=True)
+
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+
+async def test_upstream_requests_are_limited(grid_client):
+    in_flight = []
+
+    async def calc(id, read, apply, timeout=None):
+        in_flight.append(apply)
+        await asyncio.sleep(0.01)
+        assert len(in_flight) <= 2
+        in_flight.remove(apply)
+        return {ref: SimpleNamespace(value=1.0) for ref in read}
+
+    grid_client.workbooks.calc.side_effect = calc
+    calculator = GridCalculator(grid_client, max_concurrent_requests=2)
+
+    await asyncio.gather(*(calculator.calc("wb", ["B1"], {"A1": i}) for i in range(6)))
+
+    assert grid_client.workbooks.calc.await_count == 6
+
+
+@pytest.fixture
+def forecast_grid_client(grid_client):
+    # Every read returns a three month series offset by the sum of the applied values
+    def calc(id, read, apply, timeout=None):
+        offset = sum(value for value in apply.values())
+        return {ref: [SimpleNamespace(value=offset + month) for month in range(3)] for ref in read}
+
+    grid_client.workbooks.calc.side_effect = calc
+    return grid_client
+
+
+async def test_forecast_revenue_sweep_single_parameter(forecast_grid_client):
+    project_x = ProjectXRevenueModel(GridCalculator(forecast_grid_client))
+
+    response = await project_x.forecast_revenue_sweep("churn_rate", [0.0, 10.0])
+
+    assert response == {
+        "parameter": "churn_rate",
+        "values": [0.0, 10.0],
+        "Monthly Recurring Revenue (final month)": [2.0, 12.0],
+        "Total revenue": [3.0, 33.0],
+    }
+
+
+async def test_forecast_revenue_sweep_two_parameters(forecast_grid_client):
+    project_x = ProjectXRevenueModel(GridCalculator(forecast_grid_client))
+
+    response = await project_x.forecast_revenue_sweep(
+        "churn_rate", [0.0, 10.0], "subscription_price", [100.0, 200.0, 300.0], ad_budget=1000.0
+    )
+
+    assert response["second_parameter"] == "subscription_price"
+    assert response["Monthly Recurring Revenue (final month)"] == [
+        [1102.0, 1202.0, 1302.0],
+        [1112.0, 1212.0, 1312.0],
+    ]
+    assert forecast_grid_client.workbooks.calc.await_count == 6
+
+
+async def test_forecast_revenue_sweep_rejects_too_many_points(forecast_grid_client):
+    project_x = ProjectXRevenueModel(GridCalculator(forecast_grid_client), max_sweep_points=4)
+
+    response = await project_x.forecast_revenue_sweep("churn_rate", [1.0, 2.0, 3.0], "ad_cpc", [1.0, 2.0])
+
+    assert "error" in response
+    forecast_grid_client.workbooks.calc.assert_not_awaited()
+
+
+def range_results(read, absolute=False, row_major=True):
+    # Like GRID: a list of the range's cells in row order, or a single cell's result, valued by its position and
+    # with its offset in the range (or in the sheet, if absolute)
+    results = {}
+    for ref in read:
+        cell_range = CellRange.parse(ref)
+        origin = (cell_range.left - 1, cell_range.top - 1) if absolute else (0, 0)
+        positions = [
+            (row, column)
+            for row in range(cell_range.top, cell_range.bottom + 1)
+            for column in range(cell_range.left, cell_range.right + 1)
+        ]
+        if not row_major:
+            positions.sort(key=lambda position: (position[1], position[0]))
+        cells = [
+            SimpleNamespace(
+                value=(row, column),
+                offset=[origin[0] + column - cell_range.left, origin[1] + row - cell_range.top],
+            )
+            for row, column in positions
+        ]
+        results[ref] = cells if len(cells) > 1 else cells[0]
+    return results
+
+
+def test_plan_reads_merges_adjacent_cells_and_rows():
+    project_x = ProjectXRevenueModel(MagicMock())
+    forecast_reads = [project_x._data_ranges[label] for label in project_x._forecast_labels]
+
+    assert plan_reads(tuple(forecast_reads)).reads == ["Sheet1!C39:AL41"]
+    assert sorted(plan_reads(tuple(project_x._parameter_references.values())).reads) == [
+        "B12:B13",
+        "B16:B17",
+        "B20:B21",
+        "B23",
+        "B4:B5",
+        "B8:B9",
+    ]
+    assert plan_reads(("A1", "B1", "A2", "B2", "Sheet2!A3", "Named")).reads == ["A1:B2", "Sheet2!A3", "Named"]
+    assert not plan_reads(("A1", "C1")).merges
+
+
+def test_read_plan_slices_results_back_out():
+    plan = plan_reads(("C39:AL39", "C40:AL40", "B4", "B5", "D40:E40"))
+    results = plan.extract(range_results(plan.reads))
+
+    assert [cell.value for cell in results["C40:AL40"]] == [(40, column) for column in range(3, 39)]
+    assert results["B5"].value == (5, 2)
+    assert [cell.value for cell in results["D40:E40"]] == [(40, 4), (40, 5)]
+
+
+def test_read_plan_accepts_offsets_in_the_sheet():
+    plan = plan_reads(("C39:AL39", "C40:AL40", "D40:E40"))
+    results = plan.extract(range_results(plan.reads, absolute=True))
+
+    assert [cell.value for cell in results["D40:E40"]] == [(40, 4), (40, 5)]
+
+
+def test_read_plan_rejects_results_out_of_row_order():
+    plan = plan_reads(("C39:AL39", "C40:AL40"))
+
+    with pytest.raises(ValueError):
+        plan.extract(range_results(plan.reads, row_major=False))
+
+
+async def test_calculator_plans_reads(grid_client):
+    grid_client.workbooks.calc.side_effect = lambda id, read, apply, timeout=None: range_results(read)
+    project_x = ProjectXRevenueModel(GridCalculator(grid_client, plan_reads=True))
+
+    forecast = await project_x.forecast_revenue(churn_rate=0.1)
+
+    assert grid_client.workbooks.calc.call_args.kwargs["read"] == ["Sheet1!C39:AL41"]
+    assert forecast["Revenue from New subscribers"] == [(41, column) for column in range(3, 39)]
+
+
+async def test_calculator_reads_as_asked_when_merged_results_dont_fit(calculator, grid_client):
+    calculator._plan_reads = True
+
+    results = await calculator.calc("wb", ["A1", "A2"])
+
+    assert results["A2"].value == 1.0
+    assert grid_client.workbooks.calc.call_args.kwargs["read"] == ["A1", "A2"]
+
+
+async def test_calculator_reads_as_asked_when_merged_results_are_out_of_order(grid_client):
+    grid_client.workbooks.calc.side_effect = lambda id, read, apply, timeout=None: range_results(
+        read, row_major=False
+    )
+    calculator = GridCalculator(grid_client, plan_reads=True)
+
+    results = await calculator.calc("wb", ["B4", "C4", "B5", "C5"])
+
+    assert results["C4"].value == (4, 3)
+    assert grid_client.workbooks.calc.call_args.kwargs["read"] == ["B4", "C4", "B5", "C5"]
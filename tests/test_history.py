@@ -0,0 +1,72 @@
+import json
+
+from backend.llm.history import HistoryCompactor, message_tokens, summarize_output
+from backend.types import FunctionCallOutput, FunctionCallRequest, MessageList, TextMessage
+
+FORECAST = json.dumps({"Monthly Recurring Revenue": [1000.0 + month for month in range(36)]})
+
+
+def turn(index: int, churn_rate: float) -> MessageList:
+    call_id = f"call_{index}"
+    return [
+        TextMessage(role="user", content=f"What if churn was {churn_rate}?"),
+        FunctionCallRequest(
+            type="function_call",
+            name="forecast_revenue",
+            arguments=json.dumps({"churn_rate": churn_rate, "ad_budget": None}),
+            call_id=call_id,
+        ),
+        FunctionCallOutput(type="function_call_output", call_id=call_id, output=FORECAST),
+        TextMessage(role="assistant", content="Revenue would change."),
+    ]
+
+
+def history(*churn_rates: float) -> MessageList:
+    return [m for index, churn_rate in enumerate(churn_rates) for m in turn(index, churn_rate)]
+
+
+def call_ids(messages: MessageList) -> list[str]:
+    return [m.call_id for m in messages if isinstance(m, FunctionCallOutput)]
+
+
+def test_history_within_budget_is_sent_as_is():
+    messages = history(0.01, 0.02)
+
+    compacted, saved = HistoryCompactor(max_tokens=10000).compact(messages)
+
+    assert compacted is messages
+    assert saved == 0
+
+
+def test_superseded_tool_calls_are_dropped():
+    # The first and last turns ask for the same forecast
+    messages = history(0.01, 0.02, 0.03, 0.01)
+    recent_tokens = sum(message_tokens(m) for m in messages[4:])
+
+    compacted, saved = HistoryCompactor(max_tokens=recent_tokens + 40, keep_recent_turns=3).compact(messages)
+
+    assert call_ids(compacted) == ["call_1", "call_2", "call_3"]
+    assert compacted[0].content == "What if churn was 0.01?"
+    assert compacted[2:] == messages[4:]
+    assert saved > 0
+
+
+def test_older_tool_outputs_are_summarized_then_dropped():
+    messages = history(0.01, 0.02, 0.03)
+    compactor = HistoryCompactor(max_tokens=sum(message_tokens(m) for m in messages) - 50, keep_recent_turns=1)
+
+    compacted, _ = compactor.compact(messages)
+
+    assert compacted[-4:] == messages[-4:]
+    summary = json.loads(compacted[2].output)
+    assert summary["Monthly Recurring Revenue"] == {"first": 1000.0, "last": 1035.0, "min": 1000.0, "max": 1035.0}
+
+    compactor.max_tokens = sum(message_tokens(m) for m in messages[-4:])
+    compacted, _ = compactor.compact(messages)
+    assert compacted == messages[-4:]
+    assert messages == history(0.01, 0.02, 0.03)
+
+
+def test_summarize_output_truncates_other_outputs():
+    assert summarize_output("short", max_chars=10) == "short"
+    assert summarize_output("x" * 20, max_chars=10).startswith("x" * 10 + "...")
@@ -0,0 +1,119 @@
+import asyncio
+import time
+
+import pytest
+
+from backend.limits import (
+    Abandoned,
+    AdmissionController,
+    Overloaded,
+    deadline,
+    remaining_seconds,
+    run_until_abandoned,
+)
+
+
+async def test_admission_runs_up_to_max_concurrent():
+    admission = AdmissionController(max_concurrent=2, max_queue=0, max_wait_seconds=1)
+
+    async with admission.admit(), admission.admit():
+        assert admission.active == 2
+        with pytest.raises(Overloaded):
+            await admission.acquire()
+
+    assert admission.active == 0
+    assert admission.rejected == 1
+
+
+async def test_admission_queues_until_a_slot_frees():
+    admission = AdmissionController(max_concurrent=1, max_queue=1, max_wait_seconds=1)
+    order = []
+
+    async def chat(name: str):
+        async with admission.admit():
+            order.append(name)
+            await asyncio.sleep(0.01)
+
+    await asyncio.gather(chat("first"), chat("second"))
+
+    assert order == ["first", "second"]
+    assert admission.rejected == 0
+
+
+async def test_admission_rejects_when_queue_is_full():
+    admission = AdmissionController(max_concurrent=1, max_queue=1, max_wait_seconds=1, retry_after=5)
+    await admission.acquire()
+    queued = asyncio.create_task(admission.acquire())
+    await asyncio.sleep(0)
+
+    with pytest.raises(Overloaded) as e:
+        await admission.acquire()
+
+    assert e.value.retry_after == 5
+    assert admission.waiting == 1
+    admission.release()
+    await queued
+    assert admission.active == 1
+
+
+async def test_admission_rejects_after_max_wait():
+    admission = AdmissionController(max_concurrent=1, max_queue=1, max_wait_seconds=0.01)
+    await admission.acquire()
+
+    with pytest.raises(Overloaded):
+        await admission.acquire()
+
+    assert admission.waiting == 0
+
+
+async def test_deadline_bounds_remaining_seconds():
+    assert remaining_seconds(30) == 30
+
+    with deadline(time.monotonic() + 10):
+        assert 9 < remaining_seconds(30) <= 10
+        assert remaining_seconds(5) == 5
+        # Nested deadlines can only shorten the outer one
+        with deadline(time.monotonic() + 60):
+            assert remaining_seconds() <= 10
+
+    assert remaining_seconds() is None
+
+
+async def test_run_until_abandoned_returns_the_result():
+    disconnected = asyncio.get_running_loop().create_future()
+
+    assert await run_until_abandoned(asyncio.sleep(0, "done"), disconnected, time.monotonic() + 1) == "done"
+
+
+async def test_run_until_abandoned_cancels_work_on_disconnect():
+    disconnected = asyncio.get_running_loop().create_future()
+    cancelled = asyncio.Event()
+
+    async def work():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    asyncio.get_running_loop().call_later(0.01, disconnected.set_result, None)
+    with pytest.raises(Abandoned) as e:
+        await run_until_abandoned(work(), disconnected, time.monotonic() + 10)
+
+    assert e.value.reason == "disconnect"
+    assert cancelled.is_set()
+
+
+async def test_run_until_abandoned_passes_the_deadline_down():
+    disconnected = asyncio.get_running_loop().create_future()
+    timeouts = []
+
+    async def work():
+        timeouts.append(remaining_seconds(60))
+        await asyncio.sleep(10)
+
+    with pytest.raises(Abandoned) as e:
+        await run_until_abandoned(work(), disconnected, time.monotonic() + 0.05)
+
+    assert e.value.reason == "deadline"
+    assert timeouts[0] <= 0.05
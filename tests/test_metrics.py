@@ -0,0 +1,65 @@
+import time
+
+from backend.metrics import MetricsRegistry, Stopwatch, request_timings, timed
+
+
+def test_render_prometheus_text():
+    registry = MetricsRegistry()
+    counter = registry.counter("calls_total", "Calls made")
+    histogram = registry.histogram("call_seconds", "Call duration", buckets=(0.1, 1.0))
+    registry.callback("queue_depth", "Queue depth", lambda: 3)
+
+    counter.inc(tool="forecast")
+    counter.inc(2, tool="forecast")
+    histogram.observe(0.05, tool="forecast")
+    histogram.observe(0.5, tool="forecast")
+    histogram.observe(0.5, tool="forecast")
+
+    assert registry.render().splitlines() == [
+        "# HELP calls_total Calls made",
+        "# TYPE calls_total counter",
+        'calls_total{tool="forecast"} 3.0',
+        "# HELP call_seconds Call duration",
+        "# TYPE call_seconds histogram",
+        'call_seconds_bucket{tool="forecast",le="0.1"} 1',
+        'call_seconds_bucket{tool="forecast",le="1.0"} 3',
+        'call_seconds_bucket{tool="forecast",le="+Inf"} 3',
+        'call_seconds_sum{tool="forecast"} 1.05',
+        'call_seconds_count{tool="forecast"} 3.0',
+        "# HELP queue_depth Queue depth",
+        "# TYPE queue_depth gauge",
+        "queue_depth 3.0",
+    ]
+
+
+def test_timed_adds_to_request_timings():
+    histogram = MetricsRegistry().histogram("work_seconds", "Work")
+
+    with request_timings() as timings:
+        with timed(histogram, "work"):
+            pass
+        with timed(histogram, "work"):
+            pass
+
+    # Outside of a request, only the histogram is updated
+    with timed(histogram, "work"):
+        pass
+
+    assert histogram.count() == 3
+    assert list(timings.spans) == ["work"]
+    assert timings.server_timing().startswith("work;dur=")
+
+
+def test_stopwatch_only_counts_time_while_running():
+    histogram = MetricsRegistry().histogram("work_seconds", "Work")
+    stopwatch = Stopwatch()
+
+    with request_timings() as timings:
+        for _ in range(2):
+            with stopwatch.running():
+                time.sleep(0.01)
+            time.sleep(0.05)
+        stopwatch.observe(histogram, "work")
+
+    assert histogram.count() == 1
+    assert 0.02 <= timings.spans["work"] < 0.07
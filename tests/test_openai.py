@@ -1,12 +1,18 @@
-from dataclasses import dataclass
+import asyncio
+import json
+import time
+from dataclasses import dataclass, replace
+from types import SimpleNamespace
 from typing import List, Optional
-from unittest.mock import MagicMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
 
 import pytest
 
 from backend.config import AppConfig, get_config
-from backend.llm.openai import OpenAITooledChat
-from backend.types import MessageList, TextMessage, ToolBinding
+from backend.llm.history import HistoryCompactor
+from backend.llm.openai import OpenAITooledChat, create_toolbinding
+from backend.sessions import ChatSession
+from backend.types import FunctionCallRequest, MessageList, TextMessage, ToolBinding
 
 # filepath: backend/llm/test_openai.py
 
@@ -46,7 +52,12 @@ def openai_tooled_chat(config, mock_tools):
     return OpenAITooledChat(config=config, tools=mock_tools)
 
 
-@patch("backend.llm.openai.openai.responses.create")
+@pytest.fixture
+def mock_create(openai_tooled_chat):
+    with patch.object(openai_tooled_chat.client.responses, "create", new_callable=AsyncMock) as mock_create:
+        yield mock_create
+
+
 async def test_create_response_single_message(mock_create, openai_tooled_chat):
     # Mock OpenAI response with a single message
     mock_create.return_value = MagicMock(
@@ -64,7 +75,6 @@ async def test_create_response_single_message(mock_create, openai_tooled_chat):
     assert response.content == "Hello, world!"
 
 
-@patch("backend.llm.openai.openai.responses.create")
 async def test_create_response_function_call(mock_create, openai_tooled_chat):
     # Mock OpenAI response with a function call
     mock_create.side_effect = [
@@ -97,7 +107,6 @@ async def test_create_response_function_call(mock_create, openai_tooled_chat):
     assert response.content == "Result: 5"
 
 
-@patch("backend.llm.openai.openai.responses.create")
 async def test_create_response_unsupported_type(mock_create, openai_tooled_chat, caplog):
     # Mock OpenAI response with an unsupported type
     mock_create.return_value = MagicMock(output=[MockResponseOutput(type="unsupported_type")])
@@ -110,7 +119,6 @@ async def test_create_response_unsupported_type(mock_create, openai_tooled_chat,
     assert "Unsupported response from OpenAI" in caplog.text
 
 
-@patch("backend.llm.openai.openai.responses.create")
 async def test_create_response_multiple_outputs(mock_create, openai_tooled_chat, caplog):
     # Mock OpenAI response with multiple outputs
     mock_create.return_value = MagicMock(
@@ -130,3 +138,376 @@ async def test_create_response_multiple_outputs(mock_create, openai_tooled_chat,
     assert isinstance(response, TextMessage)
     assert response.content == "error, unexpected response type from LLM"
     assert "Unsupported response from OpenAI" in caplog.text
+
+
+async def test_create_response_does_not_block_event_loop(mock_create, openai_tooled_chat):
+    # Concurrent chats should overlap their upstream waits rather than run one after another
+    async def slow_create(**kwargs):
+        await asyncio.sleep(0.2)
+        return MagicMock(
+            output=[
+                MockResponseOutput(type="message", content=[MockResponseContent(type="output_text", text="Hi")])
+            ]
+        )
+
+    mock_create.side_effect = slow_create
+
+    started = time.monotonic()
+    responses = await asyncio.gather(*(openai_tooled_chat.create_response(MessageList([])) for _ in range(5)))
+    elapsed = time.monotonic() - started
+
+    assert [r.content for r in responses] == ["Hi"] * 5
+    assert elapsed < 0.5
+
+
+class MockStream:
+    def __init__(self, *events):
+        self.events = events
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for event in self.events:
+            yield event
+
+
+async def test_stream_response_function_call(mock_create, openai_tooled_chat):
+    tool_call = MockResponseOutput(
+        type="function_call", name="make_calculation", arguments='{"x": 2, "y": 3}', call_id="123"
+    )
+    final_output = MockResponseOutput(
+        type="message", content=[MockResponseContent(type="output_text", text="Result: 5")]
+    )
+    mock_create.side_effect = [
+        MockStream(
+            SimpleNamespace(type="response.output_item.added", item=tool_call),
+            SimpleNamespace(type="response.completed", response=MagicMock(output=[tool_call])),
+        ),
+        MockStream(
+            SimpleNamespace(type="response.output_text.delta", delta="Result"),
+            SimpleNamespace(type="response.output_text.delta", delta=": 5"),
+            SimpleNamespace(type="response.completed", response=MagicMock(output=[final_output])),
+        ),
+    ]
+
+    messages = MessageList([])
+    events = [event async for event in openai_tooled_chat.stream_response(messages)]
+
+    assert events == [
+        ("tool_call", {"name": "make_calculation"}),
+        ("delta", {"delta": "Result"}),
+        ("delta", {"delta": ": 5"}),
+        ("done", {"reply": "Result: 5", "role": "assistant"}),
+    ]
+    assert [m.type for m in messages] == ["function_call", "function_call_output"]
+    assert mock_create.call_args.kwargs["stream"] is True
+
+
+async def test_create_response_runs_tool_calls_concurrently(mock_create, openai_tooled_chat):
+    async def slow_calculation(x, y):
+        await asyncio.sleep(0.2)
+        return x + y
+
+    openai_tooled_chat.tools["make_calculation"] = {
+        "ref": slow_calculation,
+        "schema": {"name": "make_calculation", "description": "Adds two numbers"},
+    }
+    mock_create.side_effect = [
+        MagicMock(
+            output=[
+                MockResponseOutput(
+                    type="function_call",
+                    name="make_calculation",
+                    arguments=f'{{"x": {i}, "y": 1}}',
+                    call_id=str(i),
+                )
+                for i in range(3)
+            ]
+        ),
+        MagicMock(
+            output=[
+                MockResponseOutput(type="message", content=[MockResponseContent(type="output_text", text="Done")])
+            ]
+        ),
+    ]
+
+    messages = MessageList([])
+    started = time.monotonic()
+    response = await openai_tooled_chat.create_response(messages)
+    elapsed = time.monotonic() - started
+
+    assert response.content == "Done"
+    assert elapsed < 0.5
+    # Requests and outputs are appended in the order the model asked for them
+    assert [(m.type, m.call_id) for m in messages] == [
+        ("function_call", "0"),
+        ("function_call_output", "0"),
+        ("function_call", "1"),
+        ("function_call_output", "1"),
+        ("function_call", "2"),
+        ("function_call_output", "2"),
+    ]
+    assert [m.output for m in messages if m.type == "function_call_output"] == ["1", "2", "3"]
+
+
+async def test_create_response_limits_tool_rounds(mock_create, openai_tooled_chat):
+    openai_tooled_chat.max_tool_rounds = 2
+    function_call = MagicMock(
+        output=[
+            MockResponseOutput(
+                type="function_call", name="make_calculation", arguments='{"x": 2, "y": 3}', call_id="123"
+            )
+        ]
+    )
+    final_message = MagicMock(
+        output=[MockResponseOutput(type="message", content=[MockResponseContent(type="output_text", text="5")])]
+    )
+    mock_create.side_effect = [function_call, function_call, final_message]
+
+    response = await openai_tooled_chat.create_response(MessageList([]))
+
+    assert response.content == "5"
+    assert mock_create.call_count == 3
+    assert [call.kwargs["tool_choice"] for call in mock_create.call_args_list] == ["auto", "auto", "none"]
+
+
+async def test_create_response_chains_session_onto_previous_response(mock_create, openai_tooled_chat):
+    function_call = MagicMock(
+        id="resp_1",
+        output=[
+            MockResponseOutput(
+                type="function_call", name="make_calculation", arguments='{"x": 2, "y": 3}', call_id="123"
+            )
+        ],
+    )
+
+    def reply(response_id, text):
+        return MagicMock(
+            id=response_id,
+            output=[
+                MockResponseOutput(type="message", content=[MockResponseContent(type="output_text", text=text)])
+            ],
+        )
+
+    mock_create.side_effect = [function_call, reply("resp_2", "5"), reply("resp_3", "6")]
+    session = ChatSession(session_id="abc")
+
+    session.messages.append(TextMessage(role="user", content="What's 2 + 3?"))
+    await openai_tooled_chat.create_response(session.messages, session)
+    session.messages.append(TextMessage(role="user", content="And plus 1?"))
+    response = await openai_tooled_chat.create_response(session.messages, session)
+
+    assert response.content == "6"
+    first, tool_round, second_turn = [call.kwargs for call in mock_create.call_args_list]
+    assert "previous_response_id" not in first
+    # Only the tool output is new, the function call itself is part of the previous response
+    assert tool_round["previous_response_id"] == "resp_1"
+    assert tool_round["input"] == [{"type": "function_call_output", "call_id": "123", "output": "5"}]
+    assert second_turn["previous_response_id"] == "resp_2"
+    assert second_turn["input"] == [{"role": "user", "content": "And plus 1?"}]
+    assert [getattr(m, "content", None) for m in session.messages][-2:] == ["And plus 1?", "6"]
+    assert session.previous_response_id == "resp_3"
+
+
+async def test_handle_function_call_uses_tool_encoder(openai_tooled_chat):
+    async def encoder(result):
+        return f"result={result}"
+
+    openai_tooled_chat.tools["make_calculation"]["encoder"] = encoder
+    tool_call = FunctionCallRequest(
+        type="function_call", name="make_calculation", arguments='{"x": 2, "y": 3}', call_id="123"
+    )
+
+    output = await openai_tooled_chat.handle_function_call(tool_call)
+
+    assert output.output == "result=5"
+
+
+@pytest.fixture
+def cached_chat(config, mock_tools):
+    return OpenAITooledChat(
+        config=replace(config, OPENAI_RESPONSE_CACHE_MAX_ENTRIES=8),
+        tools=mock_tools,
+        cache_filter=lambda messages: "secret" not in messages[-1].content,
+    )
+
+
+def reply_response(text: str, response_id: str = "resp_1") -> MagicMock:
+    return MagicMock(
+        id=response_id,
+        output=[MockResponseOutput(type="message", content=[MockResponseContent(type="output_text", text=text)])],
+    )
+
+
+async def test_create_response_serves_repeated_conversations_from_cache(cached_chat):
+    with patch.object(cached_chat.client.responses, "create", new_callable=AsyncMock) as mock_create:
+        mock_create.return_value = reply_response("Defaults are...")
+
+        first = await cached_chat.create_response([TextMessage(role="user", content="What are the defaults?")])
+        # Differences in whitespace or case don't matter
+        second = await cached_chat.create_response([TextMessage(role="user", content="what are  the defaults? ")])
+        bypassed = await cached_chat.create_response(
+            [TextMessage(role="user", content="What are the defaults?")], use_cache=False
+        )
+        excluded = [TextMessage(role="user", content="A secret question")]
+        await cached_chat.create_response(excluded)
+        await cached_chat.create_response(excluded)
+
+    assert first.content == second.content == bypassed.content == "Defaults are..."
+    assert mock_create.await_count == 4
+    assert cached_chat.response_cache.hits == 1
+
+
+async def test_cached_reply_in_session_is_sent_with_the_next_turn(cached_chat):
+    with patch.object(cached_chat.client.responses, "create", new_callable=AsyncMock) as mock_create:
+        mock_create.side_effect = [reply_response("Hello", "resp_1"), reply_response("Bye", "resp_2")]
+        await cached_chat.create_response([TextMessage(role="user", content="Hi")])
+
+        session = ChatSession(session_id="abc", previous_response_id="resp_0", synced=0)
+        session.messages.append(TextMessage(role="user", content="Hi"))
+        cached = await cached_chat.create_response(session.messages, session)
+        session.messages.append(TextMessage(role="user", content="Bye"))
+        await cached_chat.create_response(session.messages, session)
+
+    assert cached.content == "Hello"
+    assert mock_create.await_count == 2
+    # OpenAI never saw the cached turn, so it goes along with the next one
+    assert [m["content"] for m in mock_create.call_args.kwargs["input"]] == ["Hi", "Hello", "Bye"]
+
+
+def test_request_params_compacts_full_history_only(openai_tooled_chat):
+    openai_tooled_chat.history = HistoryCompactor(max_tokens=1, keep_recent_turns=1)
+    messages = [
+        TextMessage(role="user", content="Hi"),
+        TextMessage(role="assistant", content="Hello"),
+        TextMessage(role="user", content="Bye"),
+    ]
+
+    full = openai_tooled_chat._request_params(messages)
+    chained = openai_tooled_chat._request_params(
+        messages, session=ChatSession(session_id="abc", previous_response_id="resp_1", synced=0)
+    )
+
+    assert full["input"] == [{"role": "user", "content": "Bye"}]
+    assert len(chained["input"]) == 3
+    assert len(messages) == 3
+
+
+async def test_handle_function_call_rejects_invalid_arguments(openai_tooled_chat):
+    calls = []
+
+    def make_calculation(x: int, y: int) -> int:
+        calls.append((x, y))
+        return x + y
+
+    openai_tooled_chat.tools["make_calculation"] = create_toolbinding(make_calculation)
+    tool_call = FunctionCallRequest(
+        type="function_call", name="make_calculation", arguments='{"x": "two", "y": 3}', call_id="123"
+    )
+
+    output = await openai_tooled_chat.handle_function_call(tool_call)
+
+    error = json.loads(output.output)
+    assert error["error"] == "Invalid arguments for make_calculation"
+    assert error["details"][0]["loc"] == ["x"]
+    assert calls == []
+
+
+def test_tool_definitions_are_built_once(openai_tooled_chat):
+    assert openai_tooled_chat.tool_definitions is openai_tooled_chat.tool_definitions
+    assert openai_tooled_chat.tool_definitions[0]["strict"] is True
+
+
+@pytest.fixture
+def speculative_chat(config):
+    calls = []
+
+    async def get_defaults() -> dict:
+        calls.append("get_defaults")
+        return {"churn_rate": 0.1}
+
+    async def forecast(churn_rate: Optional[float] = None) -> list:
+        calls.append(("forecast", churn_rate))
+        await asyncio.sleep(0.05)
+        return [1, 2, 3]
+
+    chat = OpenAITooledChat(
+        config=replace(config, OPENAI_SPECULATIVE_TOOLS="get_defaults, forecast"),
+        tools={"get_defaults": create_toolbinding(get_defaults), "forecast": create_toolbinding(forecast)},
+    )
+    chat.calls = calls
+    return chat
+
+
+def function_call_response(name: str, arguments: str) -> MagicMock:
+    call = MockResponseOutput(type="function_call", name=name, arguments=arguments, call_id="1")
+    return MagicMock(output=[call])
+
+
+async def test_speculative_calls_are_used_when_the_model_asks_for_them(speculative_chat):
+    with patch.object(speculative_chat.client.responses, "create", new_callable=AsyncMock) as mock_create:
+        mock_create.side_effect = [
+            function_call_response("get_defaults", "{}"),
+            function_call_response("forecast", '{"churn_rate": null}'),
+            reply_response("Revenue grows"),
+        ]
+        messages = [TextMessage(role="user", content="What's the revenue forecast?")]
+        await speculative_chat.create_response(messages)
+
+    assert speculative_chat.calls == ["get_defaults", ("forecast", None)]
+    assert json.loads(messages[4].output) == [1, 2, 3]
+    assert speculative_chat._speculative_calls == 0
+
+
+async def test_unused_speculative_calls_are_cancelled(speculative_chat):
+    with patch.object(speculative_chat.client.responses, "create", new_callable=AsyncMock) as mock_create:
+        mock_create.side_effect = [
+            function_call_response("forecast", '{"churn_rate": 0.2}'),
+            reply_response("Revenue grows faster"),
+        ]
+        messages = [TextMessage(role="user", content="What if churn was 20%?")]
+        await speculative_chat.create_response(messages)
+        await asyncio.sleep(0)
+
+    assert speculative_chat.calls == ["get_defaults", ("forecast", None), ("forecast", 0.2)]
+    assert speculative_chat._speculative_calls == 0
+
+    # Tools already called with their defaults in this conversation aren't called speculatively again
+    messages.append(TextMessage(role="user", content="And 30%?"))
+    with speculative_chat.speculate(messages) as speculation:
+        assert list(speculation._tasks) == [("get_defaults", "{}"), ("forecast", "{}")]
+    messages[1:1] = [FunctionCallRequest(type="function_call", name="forecast", arguments="{}", call_id="2")]
+    with speculative_chat.speculate(messages) as speculation:
+        assert list(speculation._tasks) == [("get_defaults", "{}")]
+
+
+async def test_handle_function_call_reports_tool_failures(openai_tooled_chat):
+    async def make_calculation(x: int, y: int) -> int:
+        raise RuntimeError("GRID is down")
+
+    openai_tooled_chat.tools["make_calculation"] = create_toolbinding(make_calculation)
+    tool_call = FunctionCallRequest(
+        type="function_call", name="make_calculation", arguments='{"x": 2, "y": 3}', call_id="123"
+    )
+
+    output = await openai_tooled_chat.handle_function_call(tool_call)
+
+    assert json.loads(output.output) == {"error": "make_calculation failed", "details": "GRID is down"}
+
+
+async def test_handle_function_call_reports_encoder_failures(openai_tooled_chat):
+    async def encoder(result):
+        raise RuntimeError("GRID down")
+
+    def make_calculation(x: int, y: int) -> int:
+        return x + y
+
+    openai_tooled_chat.tools["make_calculation"] = create_toolbinding(make_calculation, encoder=encoder)
+    tool_call = FunctionCallRequest(
+        type="function_call", name="make_calculation", arguments='{"x": 2, "y": 3}', call_id="123"
+    )
+
+    output = await openai_tooled_chat.handle_function_call(tool_call)
+
+    assert json.loads(output.output) == {"error": "make_calculation failed", "details": "GRID down"}
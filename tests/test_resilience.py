@@ -0,0 +1,104 @@
+import asyncio
+import time
+
+import grid_api
+import httpx
+import pytest
+
+from backend.limits import deadline
+from backend.resilience import CircuitBreaker, CircuitOpen, ResilientUpstream, is_transient
+
+
+def status_error(status_code: int) -> grid_api.APIStatusError:
+    request = httpx.Request("POST", "https://grid.test/calc")
+    return grid_api.APIStatusError("error", response=httpx.Response(status_code, request=request), body=None)
+
+
+class Flaky:
+    """Fails with the given errors in turn, then succeeds"""
+
+    def __init__(self, *errors, delay=0.0):
+        self.errors = list(errors)
+        self.delay = delay
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.errors:
+            raise self.errors.pop(0)
+        return "ok"
+
+
+def test_is_transient():
+    assert is_transient(status_error(503))
+    assert is_transient(status_error(429))
+    assert not is_transient(status_error(400))
+    assert not is_transient(ValueError("bad input"))
+
+
+async def test_transient_errors_are_retried():
+    upstream = ResilientUpstream("grid", max_attempts=3, base_delay=0.001)
+    attempt = Flaky(status_error(503), status_error(502))
+
+    assert await upstream.call(attempt) == "ok"
+    assert attempt.calls == 3
+
+
+async def test_retries_give_up_after_max_attempts_or_on_other_errors():
+    upstream = ResilientUpstream("grid", max_attempts=2, base_delay=0.001)
+
+    with pytest.raises(grid_api.APIStatusError):
+        await upstream.call(Flaky(status_error(503), status_error(503)))
+    attempt = Flaky(status_error(400))
+    with pytest.raises(grid_api.APIStatusError):
+        await upstream.call(attempt)
+    assert attempt.calls == 1
+
+
+async def test_retries_stay_within_the_deadline():
+    upstream = ResilientUpstream("grid", max_attempts=10, base_delay=1, max_delay=1)
+    attempt = Flaky(*[status_error(503)] * 10)
+
+    started = time.monotonic()
+    with deadline(time.monotonic() + 0.1), pytest.raises(grid_api.APIStatusError):
+        await upstream.call(attempt)
+    assert time.monotonic() - started < 0.5
+
+
+async def test_circuit_breaker_fails_fast_then_probes():
+    now = [0.0]
+    breaker = CircuitBreaker("grid", failure_threshold=2, reset_seconds=10, clock=lambda: now[0])
+    upstream = ResilientUpstream("grid", max_attempts=1, breaker=breaker)
+
+    for _ in range(2):
+        with pytest.raises(grid_api.APIStatusError):
+            await upstream.call(Flaky(status_error(503)))
+    attempt = Flaky()
+    with pytest.raises(CircuitOpen):
+        await upstream.call(attempt)
+    assert attempt.calls == 0
+
+    now[0] = 10
+    assert await upstream.call(attempt) == "ok"
+    assert not breaker.is_open
+
+
+async def test_slow_calls_are_hedged():
+    upstream = ResilientUpstream("grid", hedge_percentile=50)
+    for _ in range(20):
+        upstream.latencies.add(0.01)
+
+    slow_then_fast = iter([0.5, 0.0])
+    started = []
+
+    async def attempt():
+        delay = next(slow_then_fast)
+        started.append(delay)
+        await asyncio.sleep(delay)
+        return delay
+
+    began = time.monotonic()
+    assert await upstream.call(attempt) == 0.0
+    assert started == [0.5, 0.0]
+    assert time.monotonic() - began < 0.25
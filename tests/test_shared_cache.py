@@ -0,0 +1,116 @@
+import sqlite3
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+from grid_api.types.workbook_calc_response import WorkbookCalcResponseItemReadValue
+
+from backend.cache import TTLCache
+from backend.grid import GridCalculator, calc_cache_key
+from backend.shared_cache import SharedResultStore
+
+
+def cell(value):
+    return WorkbookCalcResponseItemReadValue(formatted=str(value), offset=[0, 0], type="number", value=value)
+
+
+def results(read):
+    return {ref: cell(1.0) for ref in read}
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = SharedResultStore(tmp_path / "results.db", max_entries=100)
+    yield store
+    store.close()
+
+
+async def test_stored_results_are_shared_between_stores(store, tmp_path):
+    key = calc_cache_key("wb", ["A1"], {})
+    _, version = await store.get(key)
+    await store.set(key, results(["A1"]), version)
+
+    other_worker = SharedResultStore(tmp_path / "results.db")
+    value, _ = await other_worker.get(key)
+    other_worker.close()
+    assert value == results(["A1"])
+
+
+async def test_invalidate_makes_results_stale_for_every_store(store, tmp_path):
+    key = calc_cache_key("wb", ["A1"], {})
+    other_key = calc_cache_key("other", ["A1"], {})
+    for k in (key, other_key):
+        _, version = await store.get(k)
+        await store.set(k, results(["A1"]), version)
+
+    other_worker = SharedResultStore(tmp_path / "results.db")
+    assert await other_worker.invalidate("wb") == 1
+    other_worker.close()
+
+    assert (await store.get(key))[0] is None
+    assert (await store.get(other_key))[0] is not None
+
+
+async def test_workbooks_invalidated_by_other_stores_are_noticed(store, tmp_path):
+    other_worker = SharedResultStore(tmp_path / "results.db")
+    await other_worker.invalidate("old")
+
+    assert await store.changed_workbooks() == []
+    await other_worker.invalidate("wb")
+    await other_worker.invalidate("new")
+    other_worker.close()
+
+    assert sorted(await store.changed_workbooks()) == ["new", "wb"]
+    assert await store.changed_workbooks() == []
+
+
+async def test_results_calculated_before_an_invalidate_are_not_stored(store):
+    key = calc_cache_key("wb", ["A1"], {})
+    _, version = await store.get(key)
+    await store.invalidate("wb")
+    await store.set(key, results(["A1"]), version)
+
+    value, new_version = await store.get(key)
+    assert value is None
+    assert new_version == version + 1
+
+
+async def test_expired_and_oldest_results_are_evicted(tmp_path):
+    now = [0.0]
+    store = SharedResultStore(tmp_path / "results.db", max_entries=2, ttl_seconds=10, clock=lambda: now[0])
+    keys = [calc_cache_key("wb", [f"A{i}"], {}) for i in range(3)]
+    for i, key in enumerate(keys):
+        now[0] = i
+        await store.set(key, results([f"A{i}"]), 0)
+
+    assert (await store.get(keys[0]))[0] is None
+    assert (await store.get(keys[2]))[0] is not None
+    now[0] = 20
+    assert (await store.get(keys[2]))[0] is None
+    store.close()
+
+
+async def test_calculator_checks_the_shared_cache_before_grid(store):
+    grid_client = MagicMock()
+    grid_client.workbooks.calc = AsyncMock(side_effect=lambda id, read, apply, timeout=None: results(read))
+    worker = GridCalculator(grid_client, cache=TTLCache(max_entries=8), shared_cache=store)
+    other_worker = GridCalculator(grid_client, cache=TTLCache(max_entries=8), shared_cache=store)
+
+    await worker.calc("wb", ["A1"])
+    assert await other_worker.calc("wb", ["A1"]) == results(["A1"])
+    assert grid_client.workbooks.calc.await_count == 1
+    assert other_worker.shared_cache_stats == {"hits": 1, "misses": 1}
+
+    assert await worker.invalidate_shared("wb") == 2
+    await other_worker.calc("wb", ["A1"], {"B1": 2})
+    assert grid_client.workbooks.calc.await_count == 2
+
+
+async def test_calculator_falls_back_to_grid_when_the_shared_cache_fails():
+    grid_client = MagicMock()
+    grid_client.workbooks.calc = AsyncMock(side_effect=lambda id, read, apply, timeout=None: results(read))
+    broken = MagicMock()
+    broken.get = AsyncMock(side_effect=sqlite3.OperationalError("database is locked"))
+    calculator = GridCalculator(grid_client, shared_cache=broken)
+
+    assert await calculator.calc("wb", ["A1"]) == results(["A1"])
+    broken.set.assert_not_called()
@@ -0,0 +1,260 @@
+import asyncio
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock
+
+import numpy as np
+import pytest
+
+from backend.grid import GridCalculator, ProjectXRevenueModel
+from backend.surrogate import RevenueSurrogate
+
+DEFAULTS = {
+    "ad_budget": 5000.0,
+    "ad_cpc": 2.5,
+    "registration_conversion_rate": 0.1,
+    "subscription_conversion_rate": 0.2,
+    "registration_conversion_lag_in_months": 1.0,
+    "subscription_conversion_lag_in_months": 2.0,
+    "churn_rate": 0.05,
+    "customer_lifetime_length_in_months": 20.0,
+    "virality_per_registered_user": 0.01,
+    "virality_per_subscribed_user": 0.05,
+    "subscription_price": 30.0,
+}
+
+
+def reference_mrr(p: dict[str, float], months: int = 36) -> list[float]:
+    # A plain, one scenario at a time version of the recurrence
+    visitors, registrations, subscriptions, mrr = [], [], [], []
+    registered = subscribers = 0.0
+    registration_lag = round(p["registration_conversion_lag_in_months"])
+    subscription_lag = round(p["subscription_conversion_lag_in_months"])
+    for month in range(months):
+        visitors.append(
+            p["ad_budget"] / p["ad_cpc"]
+            + p["virality_per_registered_user"] * registered
+            + p["virality_per_subscribed_user"] * subscribers
+        )
+        month_registrations = visitors[month - registration_lag] if month >= registration_lag else 0.0
+        registrations.append(month_registrations * p["registration_conversion_rate"])
+        registered += registrations[month]
+        month_subscriptions = registrations[month - subscription_lag] if month >= subscription_lag else 0.0
+        subscriptions.append(month_subscriptions * p["subscription_conversion_rate"])
+        subscribers = subscribers * (1 - p["churn_rate"]) + subscriptions[month]
+        mrr.append(subscribers * p["subscription_price"])
+    return mrr
+
+
+@pytest.fixture
+def surrogate():
+    surrogate = RevenueSurrogate()
+    surrogate.calibrate(DEFAULTS)
+    return surrogate
+
+
+def test_evaluate_matches_reference_for_many_scenarios(surrogate):
+    rng = np.random.default_rng(42)
+    scenarios = [
+        {
+            "churn_rate": rng.uniform(0.01, 0.2),
+            "ad_budget": rng.uniform(1000, 10000),
+            "subscription_conversion_lag_in_months": float(rng.integers(0, 4)),
+        }
+        for _ in range(50)
+    ]
+
+    outputs = surrogate.evaluate(scenarios)
+
+    assert outputs["Monthly Recurring Revenue"].shape == (50, 36)
+    for scenario, mrr in zip(scenarios, outputs["Monthly Recurring Revenue"]):
+        np.testing.assert_allclose(mrr, reference_mrr({**DEFAULTS, **scenario}))
+    np.testing.assert_allclose(
+        outputs["Revenue from Existing subscribers"] + outputs["Revenue from New subscribers"],
+        outputs["Monthly Recurring Revenue"],
+    )
+
+
+def test_evaluate_requires_calibration():
+    with pytest.raises(RuntimeError):
+        RevenueSurrogate().evaluate([{}])
+
+
+def test_verify_against_tolerance(surrogate):
+    expected = {"Monthly Recurring Revenue": reference_mrr(DEFAULTS)}
+
+    assert surrogate.verify([({}, expected)], relative_tolerance=1e-9) < 1e-9
+    assert surrogate.verified
+
+    off_by_one_percent = {"Monthly Recurring Revenue": [v * 1.01 for v in expected["Monthly Recurring Revenue"]]}
+    surrogate.verify([({}, off_by_one_percent)], relative_tolerance=1e-3)
+    assert not surrogate.verified
+
+
+def fake_grid_client(mrr_scale: float = 1.0) -> MagicMock:
+    # A GRID stand-in computing the workbook with the reference recurrence
+    project_x = ProjectXRevenueModel(MagicMock())
+    names = {ref: name for name, ref in project_x._parameter_references.items()}
+
+    def calc(id, read, apply, timeout=None):
+        if not apply and all(ref in names for ref in read):
+            return {ref: SimpleNamespace(value=DEFAULTS[names[ref]]) for ref in read}
+        parameters = {**DEFAULTS, **{names[ref]: value for ref, value in (apply or {}).items()}}
+        mrr = [v * mrr_scale for v in reference_mrr(parameters)]
+        return {ref: [SimpleNamespace(value=v) for v in mrr] for ref in read}
+
+    grid_client = MagicMock()
+    grid_client.workbooks.calc = AsyncMock(side_effect=calc)
+    return grid_client
+
+
+async def test_forecasts_are_served_locally_once_verified():
+    grid_client = fake_grid_client()
+    project_x = ProjectXRevenueModel(GridCalculator(grid_client), local_engine=RevenueSurrogate())
+    # Only MRR is modelled by the fake, so only compare that
+    project_x._forecast_labels = ["Monthly Recurring Revenue"]
+
+    assert await project_x.calibrate_local_engine(relative_tolerance=1e-9)
+    calls_after_calibration = grid_client.workbooks.calc.await_count
+
+    forecast = await project_x.forecast_revenue(churn_rate=0.1)
+    sweep = await project_x.forecast_revenue_sweep("churn_rate", [0.02, 0.04, 0.06, 0.08, 0.1])
+
+    assert grid_client.workbooks.calc.await_count == calls_after_calibration
+    np.testing.assert_allclose(
+        forecast["Monthly Recurring Revenue"], reference_mrr({**DEFAULTS, "churn_rate": 0.1})
+    )
+    assert sweep["Monthly Recurring Revenue (final month)"][-1] == pytest.approx(
+        forecast["Monthly Recurring Revenue"][-1]
+    )
+
+
+async def test_forecasts_fall_back_to_grid_when_not_verified():
+    grid_client = fake_grid_client(mrr_scale=1.1)
+    project_x = ProjectXRevenueModel(GridCalculator(grid_client), local_engine=RevenueSurrogate())
+    project_x._forecast_labels = ["Monthly Recurring Revenue"]
+
+    assert not await project_x.calibrate_local_engine(relative_tolerance=1e-3)
+    calls_after_calibration = grid_client.workbooks.calc.await_count
+
+    await project_x.forecast_revenue(churn_rate=0.1)
+
+    assert grid_client.workbooks.calc.await_count == calls_after_calibration + 1
+
+
+async def test_only_verified_parameters_are_forecast_locally():
+    grid_client = fake_grid_client()
+    calc = grid_client.workbooks.calc.side_effect
+
+    def calc_with_pricing_tiers(id, read, apply, timeout=None):
+        # Something about the price the surrogate doesn't know, so its perturbation won't agree
+        results = calc(id, read, apply, timeout)
+        if apply and apply.get("B23") is not None:
+            results = {
+                ref: [SimpleNamespace(value=r.value * 0.9) for r in result] for ref, result in results.items()
+            }
+        return results
+
+    grid_client.workbooks.calc.side_effect = calc_with_pricing_tiers
+    project_x = ProjectXRevenueModel(GridCalculator(grid_client), local_engine=RevenueSurrogate())
+    project_x._forecast_labels = ["Monthly Recurring Revenue"]
+
+    assert await project_x.calibrate_local_engine(relative_tolerance=1e-9)
+    assert "subscription_price" not in project_x._local_engine.verified_parameters
+    calls_after_calibration = grid_client.workbooks.calc.await_count
+
+    await project_x.forecast_revenue(ad_cpc=3.0, subscription_conversion_lag_in_months=3.0)
+    assert grid_client.workbooks.calc.await_count == calls_after_calibration
+    await project_x.forecast_revenue(subscription_price=50.0)
+    await project_x.forecast_revenue(customer_lifetime_length_in_months=2.0)
+    assert grid_client.workbooks.calc.await_count == calls_after_calibration + 2
+
+    project_x.reset_local_engine()
+    await project_x.forecast_revenue(ad_cpc=3.0, subscription_conversion_lag_in_months=3.0)
+    assert grid_client.workbooks.calc.await_count == calls_after_calibration + 3
+
+
+def test_verification_scenarios_cover_several_values_of_each_parameter(surrogate):
+    scenarios = surrogate.verification_scenarios()
+
+    assert scenarios[0] == {}
+    assert [s["churn_rate"] for s in scenarios if "churn_rate" in s] == pytest.approx([0.025, 0.075, 0.15])
+    assert [
+        s["subscription_conversion_lag_in_months"]
+        for s in scenarios
+        if "subscription_conversion_lag_in_months" in s
+    ] == [1.0, 3.0, 6.0]
+    assert not any("customer_lifetime_length_in_months" in s for s in scenarios)
+
+    combinations = surrogate.combination_scenarios({"churn_rate", "ad_cpc"})
+    assert len(combinations) == 4
+    assert all(set(s) == {"churn_rate", "ad_cpc"} for s in combinations)
+
+
+def grid_client_with(adjust) -> MagicMock:
+    # The reference recurrence with adjust(parameters, mrr) applied, for what the surrogate doesn't know about
+    grid_client = fake_grid_client()
+    calc = grid_client.workbooks.calc.side_effect
+    names = {ref: name for name, ref in ProjectXRevenueModel(MagicMock())._parameter_references.items()}
+
+    def adjusted_calc(id, read, apply, timeout=None):
+        results = calc(id, read, apply, timeout)
+        if not apply:
+            return results
+        parameters = {**DEFAULTS, **{names[ref]: value for ref, value in apply.items()}}
+        return {
+            ref: [SimpleNamespace(value=adjust(parameters, r.value)) for r in result]
+            for ref, result in results.items()
+        }
+
+    grid_client.workbooks.calc.side_effect = adjusted_calc
+    return grid_client
+
+
+async def test_parameters_are_verified_at_several_values():
+    # Churn is capped in the workbook, which a single small perturbation wouldn't show
+    def capped_churn(parameters, mrr):
+        return mrr if parameters["churn_rate"] <= 0.1 else mrr * 1.2
+
+    project_x = ProjectXRevenueModel(
+        GridCalculator(grid_client_with(capped_churn)), local_engine=RevenueSurrogate()
+    )
+    project_x._forecast_labels = ["Monthly Recurring Revenue"]
+
+    assert await project_x.calibrate_local_engine(relative_tolerance=1e-9)
+    assert "churn_rate" not in project_x._local_engine.verified_parameters
+    assert "ad_cpc" in project_x._local_engine.verified_parameters
+
+
+async def test_parameters_are_verified_in_combination():
+    def interacting(parameters, mrr):
+        both_changed = (
+            parameters["ad_cpc"] != DEFAULTS["ad_cpc"] and parameters["churn_rate"] != DEFAULTS["churn_rate"]
+        )
+        return mrr * 0.9 if both_changed else mrr
+
+    project_x = ProjectXRevenueModel(
+        GridCalculator(grid_client_with(interacting)), local_engine=RevenueSurrogate()
+    )
+    project_x._forecast_labels = ["Monthly Recurring Revenue"]
+
+    await project_x.calibrate_local_engine(relative_tolerance=1e-9)
+
+    assert not project_x._local_engine.can_forecast([{"ad_cpc": 3.0, "churn_rate": 0.1}])
+
+
+async def test_local_forecasts_are_spot_checked_against_grid():
+    grid_client = fake_grid_client()
+    project_x = ProjectXRevenueModel(
+        GridCalculator(grid_client), local_engine=RevenueSurrogate(), local_engine_sample_rate=1.0
+    )
+    project_x._forecast_labels = ["Monthly Recurring Revenue"]
+    assert await project_x.calibrate_local_engine(relative_tolerance=1e-9)
+
+    await project_x.forecast_revenue(churn_rate=0.1)
+    await asyncio.gather(*project_x._spot_checks)
+    assert project_x._local_engine.verified
+
+    grid_client.workbooks.calc.side_effect = fake_grid_client(mrr_scale=1.1).workbooks.calc.side_effect
+    await project_x.forecast_revenue(churn_rate=0.07)
+    await asyncio.gather(*project_x._spot_checks)
+    assert not project_x._local_engine.verified
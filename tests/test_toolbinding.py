@@ -1,5 +1,8 @@
 from typing import Optional
 
+import pytest
+from pydantic import ValidationError
+
 from backend.llm.openai import create_toolbinding
 
 
@@ -34,3 +37,17 @@ def test_create_toolbinding():
     generated_schema = toolbinding["schema"]
 
     assert generated_schema == expected_schema
+
+
+def test_create_toolbinding_validates_arguments():
+    toolbinding = create_toolbinding(sample_method, name="sample_method")
+    validator = toolbinding["validator"]
+
+    arguments = validator.model_validate_json(
+        '{"param1": "a", "param2": "2", "param3": 3, "param4": true, "param5": null}'
+    )
+
+    assert dict(arguments) == {"param1": "a", "param2": 2, "param3": 3.0, "param4": True, "param5": None}
+    assert toolbinding["definition"] == {**toolbinding["schema"], "strict": True}
+    with pytest.raises(ValidationError):
+        validator.model_validate_json('{"param1": "a", "param2": 2, "param3": 3, "param4": true, "extra": 1}')
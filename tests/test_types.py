@@ -0,0 +1,35 @@
+import json
+
+import pytest
+from pydantic import ValidationError
+
+from backend.types import ChatRequest, FunctionCallOutput, FunctionCallRequest, TextMessage, message_list_adapter
+
+MESSAGES = [
+    {"role": "user", "content": "What if churn was 5%?"},
+    {"type": "function_call", "name": "forecast_revenue", "arguments": "{}", "call_id": "call_1"},
+    {"type": "function_call_output", "call_id": "call_1", "output": "{}"},
+    {"role": "assistant", "content": "Revenue would grow more slowly."},
+]
+
+
+def test_chat_request_messages_are_discriminated_on_type():
+    chat_request = ChatRequest.model_validate_json(json.dumps({"messages": MESSAGES}))
+
+    assert [type(m) for m in chat_request.messages] == [
+        TextMessage,
+        FunctionCallRequest,
+        FunctionCallOutput,
+        TextMessage,
+    ]
+
+
+def test_chat_request_rejects_unknown_message_types():
+    with pytest.raises(ValidationError):
+        ChatRequest.model_validate_json(json.dumps({"messages": [{"type": "robot", "content": "beep"}]}))
+
+
+def test_message_list_dumps_like_each_message():
+    messages = ChatRequest.model_validate_json(json.dumps({"messages": MESSAGES})).messages
+
+    assert message_list_adapter.dump_python(messages) == [m.model_dump() for m in messages] == MESSAGES
@@ -0,0 +1,81 @@
+import json
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from backend.cache import TTLCache
+from backend.grid import GridCalculator
+from backend.workbooks import WorkbookRegistry, WorkbookSpec
+
+SPEC = {
+    "name": "pricing",
+    "workbook_id": "wb",
+    "description": "Calculate the margin for a price.",
+    "inputs": {
+        "price": {"ref": "B1", "description": "Unit price"},
+        "region": {"ref": "B2", "type": "string"},
+    },
+    "outputs": {"Margin": "C1:C3", "Break even": "D1"},
+    "warm": True,
+}
+
+
+@pytest.fixture
+def grid_client():
+    def calc(id, read, apply, timeout=None):
+        def cell(ref):
+            if ":" in ref:
+                return [SimpleNamespace(value=float(i)) for i in range(3)]
+            return SimpleNamespace(value=apply.get(ref, 1.0) if isinstance(apply, dict) else 1.0)
+
+        return {ref: cell(ref) for ref in read}
+
+    grid_client = MagicMock()
+    grid_client.workbooks.calc = AsyncMock(side_effect=calc)
+    return grid_client
+
+
+@pytest.fixture
+def registry(grid_client):
+    calculator = GridCalculator(grid_client, cache=TTLCache(max_entries=8))
+    return WorkbookRegistry([WorkbookSpec.model_validate(SPEC)], calculator)
+
+
+def test_registry_generates_tools(registry):
+    tools = registry.tools()
+
+    assert set(tools) == {"pricing_defaults", "pricing_calculate"}
+    parameters = tools["pricing_calculate"]["schema"]["parameters"]
+    assert parameters["required"] == ["price", "region"]
+    assert parameters["additionalProperties"] is False
+    assert parameters["properties"]["price"]["description"] == "Unit price"
+    assert "Margin" in tools["pricing_calculate"]["schema"]["description"]
+
+
+async def test_registry_tools_calculate_through_grid(registry, grid_client):
+    tools = registry.tools()
+    arguments = tools["pricing_calculate"]["validator"].model_validate_json('{"price": 10, "region": null}')
+
+    result = await tools["pricing_calculate"]["ref"](**dict(arguments))
+    defaults = await tools["pricing_defaults"]["ref"]()
+
+    assert result == {"Margin": [0.0, 1.0, 2.0], "Break even": 1.0}
+    assert grid_client.workbooks.calc.await_args_list[0].kwargs["apply"] == {"B1": 10.0}
+    assert defaults == {"price": 1.0, "region": 1.0}
+
+
+async def test_registry_warms_marked_workbooks(registry, grid_client):
+    await registry.warm()
+    await registry.models["pricing"].get_defaults()
+
+    # The defaults and default outputs, with the defaults then served from the cache
+    assert grid_client.workbooks.calc.await_count == 2
+
+
+def test_registry_loads_specs_from_file(tmp_path, grid_client):
+    path = tmp_path / "workbooks.json"
+    path.write_text(json.dumps([SPEC, {**SPEC, "name": "pricing"}]))
+
+    with pytest.raises(ValueError):
+        WorkbookRegistry.from_file(path, GridCalculator(grid_client))